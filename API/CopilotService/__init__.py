@@ -1,8 +1,11 @@
 import asyncio
+import contextlib
+import copy
 import json
 import logging
 import os
 from enum import Enum
+from types import SimpleNamespace
 from json import JSONDecodeError
 
 import azure.functions as func
@@ -10,13 +13,18 @@ from azure.core.exceptions import HttpResponseError
 from cli_validator.result import CommandSource
 from common import validate_command_in_task
 from common.auth import get_auth_token_for_learn_knowlegde_index, verify_token
+from common.context import DependencyCall
+from common.context_packer import pack_chunks
 from common.correct import correct_scenario
+from common.embedding_cache import start_request_statistics
 from common.exception import GPTInvalidResultException, KnowledgeSearchException, RequestException, \
     QuestionOutOfScopeException, ServiceException
 from common.prompt import DEFAULT_GENERATE_SCENARIO_MSG, DEFAULT_SPLIT_TASK_MSG
-from common.service_impl.chatgpt import gpt_generate, num_tokens_from_message
+from common.semantic_cache import get_prompt_version, semantic_cache
+from common.service_impl.chatgpt import TokenBudgeter, gpt_generate_async, num_tokens_from_message
 from common.service_impl.knowledge_base import knowledge_search, pass_verification
-from common.service_impl.learn_knowledge_index import (filter_chunks_by_keyword_similarity,
+from common.service_impl.learn_knowledge_index import (embedding_text_to_vector,
+                                                       filter_chunks_by_keyword_similarity,
                                                        merge_chunks_by_command,
                                                        retrieve_chunk_for_command,
                                                        retrieve_chunks_for_atomic_task,
@@ -36,14 +44,13 @@ class ServiceType(str, Enum):
 
 @telemetry
 @verify_token
-def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
+async def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
     try:
         question = get_param_str(req, 'question', required=True)
         history = get_param(req, 'history', default=[])
         top_num = get_param_int(req, 'top_num', default=5)
         service_type = get_param_enum(req, 'type', ServiceType, default=os.environ.get("DEFAULT_SERVICE_TYPE", ServiceType.GPT_GENERATION))
-
-        result = copilot_service(context, question, history, top_num, service_type)
+        result = await copilot_service(context, question, history, top_num, service_type)
     except RequestException as e:
         logger.error(f'Error: UserException: {e.msg}', exc_info=e)
         return func.HttpResponse(e.to_response_body(), status_code=400)
@@ -59,68 +66,165 @@ def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
     return func.HttpResponse(generate_response(result, 200))
 
 
-def copilot_service(context, question, history, top_num=5, service_type=ServiceType.GPT_GENERATION):
+async def copilot_service(context, question, history, top_num=5, service_type=ServiceType.GPT_GENERATION):
+    # The answer of a question with history depends on the conversation, so it is not cached
+    if semantic_cache is None or history:
+        return await _copilot_service(context, question, history, top_num, service_type)
+
+    question_vector = await embedding_text_to_vector(question)
+    if not question_vector:
+        return await _copilot_service(context, question, history, top_num, service_type)
+
+    cache_namespace = _get_semantic_cache_namespace(top_num, service_type)
+    dependency_call = DependencyCall("semantic cache")
+    dependency_call.start()
+    result = semantic_cache.get(cache_namespace, question_vector)
+    dependency_call.end()
+    _add_cache_metrics(context, dependency_call, {"hits": int(result is not None), "misses": int(result is None)})
+    if result is not None:
+        return result
+
+    result = await _copilot_service(context, question, history, top_num, service_type)
+    if result:
+        semantic_cache.set(cache_namespace, question_vector, result)
+    return result
+
+
+def _get_semantic_cache_namespace(top_num, service_type):
+    prompt_version = get_prompt_version(os.environ.get("OPENAI_GENERATE_SCENARIO_MSG", default=DEFAULT_GENERATE_SCENARIO_MSG),
+                                        os.environ.get("OPENAI_SPLIT_TASK_MSG", default=DEFAULT_SPLIT_TASK_MSG))
+    return ServiceType(service_type).value, top_num, prompt_version
+
+
+async def _copilot_service(context, question, history, top_num=5, service_type=ServiceType.GPT_GENERATION):
 
     system_msg = os.environ.get("OPENAI_GENERATE_SCENARIO_MSG", default=DEFAULT_GENERATE_SCENARIO_MSG)
 
     result = []
     if service_type == ServiceType.KNOWLEDGE_SEARCH:
         try:
-            result = knowledge_search(question, top_num)
-            if len(result) == 0 or not pass_verification(context, question, result):
+            result = await knowledge_search(question, top_num)
+            if len(result) == 0 or not await pass_verification(context, question, result):
                 result = []
         except HttpResponseError as e:
             raise KnowledgeSearchException() from e
 
         return result
 
-    if os.environ.get('ENABLE_RETRIEVAL_AUGMENTED_GENERATION', "true").lower() == "true":
-        logger.info(f'Starting the Retrieval Augmented Generation (RAG) process.')
-        task_list, usage_context = asyncio.run(_retrieve_context_from_learn_knowledge_index(context, question))
-        token_limit = int(os.environ.get("CONTEXT_TOKEN_LIMIT", 4096))
-        completion_tokens = int(os.environ.get('OPENAI_MAX_TOKENS', 4000))   # The default value should be the same as the one in initialize_chatgpt_service_params
-        factor = float(os.environ.get('ESTIMATION_ADJUSTMENT_FACTOR', 0.95))
-        system_msg_tokens = num_tokens_from_message(system_msg) or 0
-        token_remains = (token_limit - completion_tokens) * factor - system_msg_tokens
-        question = _add_context_to_queston(context, question, task_list, usage_context, token_limit=token_remains)
-        logger.info(f'Successfully completed the RAG process.')
+    if service_type == ServiceType.MIX and os.environ.get("ENABLE_CONCURRENT_MIX_MODE", "true").lower() == "true":
+        return [correct_scenario(s) for s in await _mix_service_concurrently(context, question, history, top_num, system_msg)]
+
+    question = await _augment_question(context, question, system_msg)
 
     if service_type == ServiceType.GPT_GENERATION:
         context.custom_context.gpt_task_name = 'GENERATE_SCENARIO'
-        gpt_result = gpt_generate(context, system_msg, question, history)
+        gpt_result = await gpt_generate_async(context, system_msg, question, history)
         result = [_build_scenario_response(gpt_result)] if gpt_result else []
 
     elif service_type == ServiceType.MIX:
         try:
-            result = knowledge_search(question, top_num)
+            result = await knowledge_search(question, top_num)
         except HttpResponseError as e:
             logger.error('Error from knowledge search: \n%s', e, exc_info=e)
             result = []
 
-        if len(result) == 0 or not pass_verification(context, question, result):
+        if len(result) == 0 or not await pass_verification(context, question, result):
             context.custom_context.gpt_task_name = 'GENERATE_SCENARIO'
-            gpt_result = gpt_generate(context, system_msg, question, history)
+            gpt_result = await gpt_generate_async(context, system_msg, question, history)
             result = [_build_scenario_response(gpt_result)] if gpt_result else []
 
     result = [correct_scenario(s) for s in result]
     return result
 
 
+async def _mix_service_concurrently(context, question, history, top_num, system_msg):
+    """
+    Run the knowledge search and its verification in parallel with the RAG process,
+    and cancel the RAG process as soon as the knowledge search result is verified.
+    """
+    # The GPT calls in both paths record their estimated usage in the context, so the verification uses a copy of it
+    verification_context = _fork_context(context)
+    rag_task = asyncio.create_task(_augment_question(context, question, system_msg))
+    try:
+        result = await _search_and_verify(verification_context, question, top_num)
+    except BaseException:
+        await _cancel_task(rag_task)
+        raise
+
+    if result:
+        logger.info('The knowledge search result is verified, the generation of scenario is skipped.')
+        await _cancel_task(rag_task)
+        return result
+
+    question = await rag_task
+    context.custom_context.gpt_task_name = 'GENERATE_SCENARIO'
+    gpt_result = await gpt_generate_async(context, system_msg, question, history)
+    return [_build_scenario_response(gpt_result)] if gpt_result else []
+
+
+async def _cancel_task(task):
+    # Wait for the task to finish its cleanup, and its error is dropped since its result is not needed any more
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+
+async def _search_and_verify(context, question, top_num):
+    try:
+        result = await knowledge_search(question, top_num)
+    except HttpResponseError as e:
+        logger.error('Error from knowledge search: \n%s', e, exc_info=e)
+        return []
+    if len(result) == 0 or not await pass_verification(context, question, result):
+        return []
+    return result
+
+
+def _fork_context(context):
+    """
+    Copy the custom context for a concurrent path of the request, the dependency calls are still recorded in the same statistics
+    """
+    return SimpleNamespace(custom_context=copy.copy(context.custom_context))
+
+
+async def _augment_question(context, question, system_msg):
+    if os.environ.get('ENABLE_RETRIEVAL_AUGMENTED_GENERATION', "true").lower() != "true":
+        return question
+
+    logger.info(f'Starting the Retrieval Augmented Generation (RAG) process.')
+    task_list, usage_context = await _retrieve_context_from_learn_knowledge_index(context, question)
+    token_limit = int(os.environ.get("CONTEXT_TOKEN_LIMIT", 4096))
+    completion_tokens = int(os.environ.get('OPENAI_MAX_TOKENS', 4000))   # The default value should be the same as the one in initialize_chatgpt_service_params
+    factor = float(os.environ.get('ESTIMATION_ADJUSTMENT_FACTOR', 0.95))
+    system_msg_tokens = num_tokens_from_message(system_msg) or 0
+    token_remains = (token_limit - completion_tokens) * factor - system_msg_tokens
+    question = _add_context_to_queston(context, question, task_list, usage_context, token_limit=token_remains)
+    logger.info(f'Successfully completed the RAG process.')
+    return question
+
+
 async def _retrieve_context_from_learn_knowledge_index(context, question):
     system_msg = os.environ.get("OPENAI_SPLIT_TASK_MSG", default=DEFAULT_SPLIT_TASK_MSG)
     context.custom_context.gpt_task_name = 'SPLIT_TASK'
-    generate_results = gpt_generate(context, system_msg, question, history_msg=[])
+    generate_results = await gpt_generate_async(context, system_msg, question, history_msg=[])
     try:
         raw_task_list = _build_json_output(generate_results)
     except Exception as e:
         logger.error(f"Error while parsing the generate results: {generate_results}, {e}")
         return None, None
 
-    token = get_auth_token_for_learn_knowlegde_index()
+    # The token is cached, but it may be fetched synchronously when the cache is cold
+    token = await asyncio.to_thread(get_auth_token_for_learn_knowlegde_index)
 
+    # The call covers the retrieval of all the tasks, and the time of the embedding cache lookups is in its `lookupSeconds` metric
+    retrieve_context_call = DependencyCall("retrieve task context")
+    retrieve_context_call.start()
+    embedding_cache_statistics = start_request_statistics()
     context_tasks = [asyncio.create_task(_build_task_context(raw_task, token)) for raw_task in raw_task_list]
 
     context_info_list = await asyncio.gather(*context_tasks)
+    retrieve_context_call.end()
+    _add_cache_metrics(context, retrieve_context_call, embedding_cache_statistics)
     task_list = [context_info[0] for context_info in context_info_list]
     chunk_list = _join_chunks_in_context(context_info_list)
 
@@ -183,25 +287,29 @@ def _add_context_to_queston(context, question, task_list, usage_context, token_l
     context.custom_context.task_list_lens = len(task_list)
     context.custom_context.estimated_task_list_tokens = num_tokens_from_message(task_list)
     context.custom_context.estimated_usage_context_tokens = num_tokens_from_message(usage_context)
+    question_budgeter = TokenBudgeter(question, token_limit)
     if task_list:
         guiding_steps_separation = "\nHere are the steps you can refer to for this question:\n"
-        question = _try_add_steps_to_queston(question, guiding_steps_separation, task_list, token_limit)
+        _try_add_steps_to_queston(question_budgeter, guiding_steps_separation, task_list)
     if usage_context:
         commands_info_separation = "\nBelow are some potentially relevant CLI commands information as context, please select the commands information that may be used in the scenario of the question from context, and supplement the missing commands information of context\n"
-        question = _try_add_steps_to_queston(question, commands_info_separation, usage_context, token_limit)
-    return question
+        # Select the most valuable chunks that fit in the remaining tokens, instead of stopping at the first one that does not fit
+        separation_tokens = num_tokens_from_message(f'\n\n{commands_info_separation}\n') or 0
+        token_remains = question_budgeter.token_limit - question_budgeter.num_tokens - separation_tokens
+        # One more token for each chunk, as the tokens may be merged differently when the chunk is joined to the question
+        usage_context = pack_chunks(usage_context, token_remains, lambda chunk: (num_tokens_from_message('\n' + str(chunk)) or 0) + 1)
+        _try_add_steps_to_queston(question_budgeter, commands_info_separation, usage_context)
+    return question_budgeter.message
 
 
-def _try_add_steps_to_queston(question, intro, steps, token_limit):
+def _try_add_steps_to_queston(question_budgeter, intro, steps):
     if not steps:
-        return question
+        return
     new_steps = [f'\n{intro}\n{str(steps[0])}'] + steps[1:]
     new_steps = ['\n' + str(step) for step in new_steps]
     for step in new_steps:
-        if (num_tokens_from_message(question + step) or 0) > token_limit:
-            return question
-        question += step
-    return question
+        if not question_budgeter.try_append(step):
+            return
 
 
 def _build_json_output(content):
@@ -252,5 +360,12 @@ def _map_unknown_to_step(scenario):
     return scenario
 
 
+def _add_cache_metrics(context, dependency_call, cache_statistics):
+    total = cache_statistics["hits"] + cache_statistics["misses"]
+    dependency_call.metrics = dict(cache_statistics, hitRate=cache_statistics["hits"] / total if total else 0.0)
+    logger.info(f'{dependency_call.callName} metrics: {dependency_call.metrics}')
+    context.custom_context.statistics.addCall(dependency_call)
+
+
 def _join_chunks_in_context(context_info_list):
     return [chunk for context_info in context_info_list for chunk in context_info[1]]
@@ -0,0 +1,35 @@
+import asyncio
+import datetime
+import logging
+import os
+
+import azure.functions as func
+
+from RecommendationService.cosmos_helper import recommendation_container, recommendation_container_2
+from RecommendationService.offline_snapshot import SNAPSHOT_TABLE, SNAPSHOT_TABLE_2, export_offline_snapshot, prune_offline_snapshots
+
+
+async def main(mytimer: func.TimerRequest) -> None:
+    utc_timestamp = datetime.datetime.utcnow().replace(
+        tzinfo=datetime.timezone.utc).isoformat()
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    root = os.environ.get("Offline_Snapshot_Path")
+    if not root:
+        logging.info('Offline snapshot is disabled because "Offline_Snapshot_Path" is not set')
+        return
+
+    os.makedirs(root, exist_ok=True)
+    tables = {
+        SNAPSHOT_TABLE: [item async for item in recommendation_container.read_all_items()],
+        SNAPSHOT_TABLE_2: [item async for item in recommendation_container_2.read_all_items()],
+    }
+    # The export writes the whole containers to the file share, so it runs in a thread to keep the worker serving the requests
+    version = await asyncio.to_thread(export_offline_snapshot, root, tables)
+    removed = await asyncio.to_thread(prune_offline_snapshots, root, int(os.environ.get("Offline_Snapshot_Keep", "3")))
+    logging.info('Offline snapshot %s is exported with %s, removed versions: %s',
+                 version, {name: len(items) for name, items in tables.items()}, removed)
+
+    logging.info('Python timer trigger function ran at %s', utc_timestamp)
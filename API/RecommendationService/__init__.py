@@ -1,19 +1,33 @@
+import functools
 import json
 import os
-import asyncio
 
 import azure.functions as func
 
 from .aladdin_service import get_recommend_from_aladdin
-from .filter import filter_recommendation_result
+from .deadline import gather_with_deadline
+from .filter import classify_recommendation_item, filter_recommendation_result
 from .knowledge_base_service import get_recommend_from_knowledge_base
+from .merge_engine import MergeSource, merge_recommendation_items
 from .offline_data_service import get_recommend_from_offline_data, get_recommend_from_solution
 from .personalized_analysis import analyze_personal_path
 from .scenario_service import get_scenario_recommendation_from_search
 from .util import get_success_commands, load_command_list, need_aladdin_recommendation, need_offline_recommendation, need_scenario_recommendation, need_solution_recommendation
 
+# The merge configuration is resolved once, instead of being read from the app settings for each item
+# Recommendation_Prefer: "1" means the offline calculation is preferred to Aladdin
+recommendation_prefer = os.environ.get("Recommendation_Prefer", "1")
+# Recommendation_Merge_Strategy: "round_robin" or "score", see `merge_engine.MERGE_STRATEGIES`
+recommendation_merge_strategy = os.environ.get("Recommendation_Merge_Strategy", "round_robin")
+# Recommendation_Merge_Weights: the weights of sources in JSON, e.g. {"OfflineCaculation": 2, "Aladdin": 1}
+recommendation_merge_weights = json.loads(os.environ.get("Recommendation_Merge_Weights") or "{}")
+# Recommendation_Deadline: the budget of a request in seconds, the sources that don't finish in time are skipped
+recommendation_deadline = float(os.environ["Recommendation_Deadline"]) if os.environ.get("Recommendation_Deadline") else None
+# Recommendation_Source_Timeouts: the timeouts of sources in seconds in JSON, e.g. {"Aladdin": 0.8, "Scenario": 1.5}
+recommendation_source_timeouts = json.loads(os.environ.get("Recommendation_Source_Timeouts") or "{}")
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
 
     try:
         command_list = get_param_str(req, 'command_list')
@@ -73,49 +87,58 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     except ValueError:
         return func.HttpResponse('Illegal parameter: the parameter "user_id" must be the type of string', status_code=400)
 
-    result = asyncio.run(get_recommendation_items(command_list, recommend_type, error_info, correlation_id, subscription_id, cli_version, user_id, command_top_num, scenario_top_num))
+    result, missing_sources = await get_recommendation_items(command_list, recommend_type, error_info, correlation_id, subscription_id, cli_version, user_id, command_top_num, scenario_top_num)
 
     if not result:
+        # The client still needs to know that the result is empty because some sources are missing
+        if missing_sources:
+            return func.HttpResponse(generate_response(data=[], status=200, missing_sources=missing_sources))
         return func.HttpResponse('{}', status_code=200)
 
-    return func.HttpResponse(generate_response(data=result, status=200))
+    return func.HttpResponse(generate_response(data=result, status=200, missing_sources=missing_sources))
 
 
 async def get_recommendation_items(command_list, recommend_type, error_info, correlation_id, subscription_id, cli_version, user_id, command_top_num=5, scenario_top_num=5):
     command_list = load_command_list(command_list)
     success_command_list = get_success_commands(command_list)
 
+    # The sources are queried concurrently, and a source that isn't needed is not in the dict
+    sources = {}
+
     # Take the data of knowledge base first, when the quantity of knowledge base is not enough, then take the data from calculation and Aladdin
-    knowledge_base_items_task = asyncio.create_task(asyncio.to_thread(get_recommend_from_knowledge_base, command_list, recommend_type, error_info))
+    sources['KnowledgeBase'] = get_recommend_from_knowledge_base(command_list, recommend_type, error_info)
 
     # Get the recommendation of offline caculation from offline data
-    # Since the `get_recommend_from_offline_data` method is already an async function, so we don't need to create a new thread for it to run in.
-    calculation_items_task = None
     if need_offline_recommendation(recommend_type):
-        calculation_items_task = asyncio.create_task(get_recommend_from_offline_data(success_command_list, recommend_type, top_num=command_top_num))
+        sources['OfflineCaculation'] = get_recommend_from_offline_data(success_command_list, recommend_type, top_num=command_top_num)
 
     # Get the recommendation from Aladdin
-    aladdin_items_task = None
     if need_aladdin_recommendation(recommend_type):
-        aladdin_items_task = asyncio.create_task(asyncio.to_thread(get_recommend_from_aladdin, success_command_list, correlation_id, subscription_id, cli_version, user_id, command_top_num))
+        sources['Aladdin'] = get_recommend_from_aladdin(success_command_list, correlation_id, subscription_id, cli_version, user_id, command_top_num)
 
     # Get the recommendation from E2E Scenarios
-    scenario_items_task = None
     if need_scenario_recommendation(recommend_type):
-        scenario_items_task = asyncio.create_task(asyncio.to_thread(get_scenario_recommendation_from_search, success_command_list, scenario_top_num))
+        sources['Scenario'] = get_scenario_recommendation_from_search(success_command_list, scenario_top_num)
 
     # Get Solution recommendation
-    solution_items_task = None
     if need_solution_recommendation(recommend_type, error_info):
-        solution_items_task = asyncio.create_task(asyncio.to_thread(get_recommend_from_solution, command_list, recommend_type, error_info, top_num=command_top_num))
-
-    solution_items = await solution_items_task if solution_items_task else []
-    calculation_items = await calculation_items_task if calculation_items_task else []
-    knowledge_base_items = await knowledge_base_items_task if knowledge_base_items_task else []
-    aladdin_items = await aladdin_items_task if aladdin_items_task else []
-    scenario_items = await scenario_items_task if scenario_items_task else []
-
-    result = merge_and_sort_recommendation_items(solution_items + knowledge_base_items, calculation_items, aladdin_items)
+        sources['Solution'] = get_recommend_from_solution(command_list, recommend_type, error_info, top_num=command_top_num)
+
+    # The sources that fail or miss the deadline are cancelled, and the request is served by the other sources
+    source_items, missing_sources = await gather_with_deadline(sources, recommendation_deadline, recommendation_source_timeouts)
+    solution_items = source_items.get('Solution', [])
+    calculation_items = source_items.get('OfflineCaculation', [])
+    knowledge_base_items = source_items.get('KnowledgeBase', [])
+    aladdin_items = source_items.get('Aladdin', [])
+    scenario_items = source_items.get('Scenario', [])
+
+    # The merge stops early once there are enough commands for the filter, unless the personalization needs all the commands
+    # to find the most used one. The merged sources only contain commands, the scenarios are appended after the merge
+    limits, classify = None, None
+    if os.environ["Support_Personalization"] != '1' and success_command_list:
+        limits = {'command': command_top_num}
+        classify = functools.partial(classify_recommendation_item, filter_command=success_command_list[-1]['command'])
+    result = merge_and_sort_recommendation_items(solution_items + knowledge_base_items, calculation_items, aladdin_items, limits, classify)
     result.extend(scenario_items)
 
     if os.environ["Support_Personalization"] == '1':
@@ -123,7 +146,7 @@ async def get_recommendation_items(command_list, recommend_type, error_info, cor
 
     result = filter_recommendation_result(result, success_command_list, command_top_num, scenario_top_num)
 
-    return result
+    return result, missing_sources
 
 
 def get_param_str(req, param_name):
@@ -150,7 +173,7 @@ def get_param_int(req, param_name):
     return param
 
 
-def generate_response(data, status, error=None):
+def generate_response(data, status, error=None, missing_sources=None):
     response_data = {
         'data': data,
         'error': error,
@@ -158,62 +181,16 @@ def generate_response(data, status, error=None):
         # The version of the API, which is defined in the function app settings and can be changed without redeploying the whole function.
         'api_version': os.environ["API_Version"]
     }
+    # The sources that are skipped because of errors or timeouts, so the client knows the result is partial
+    if missing_sources:
+        response_data['missing_sources'] = missing_sources
     return json.dumps(response_data)
 
 
 # Merge and sort multiple data sources
-def merge_and_sort_recommendation_items(knowledge_base_items, calculation_items, aladdin_items):
-
-    result = knowledge_base_items
-
-    # Record recommended commands for duplicate removal
-    exist_commands = []
-    if knowledge_base_items:
-        for item in knowledge_base_items:
-            if 'command' in item:
-                exist_commands.append(item['command'])
-
-    # Merge calculation_items and aladdin_items, and sort them interleaved
-    command_index = 0
-    commands_from_recommendation = []
-    while(command_index < len(calculation_items) and command_index < len(aladdin_items)):
-        aladdin_command = aladdin_items[command_index]['command']
-        calculation_command = calculation_items[command_index]['command']
-
-        if os.environ["Recommendation_Prefer"] == "1":
-            if calculation_command not in exist_commands:
-                commands_from_recommendation.append(calculation_items[command_index])
-                exist_commands.append(calculation_command)
-            if aladdin_command not in exist_commands:
-                commands_from_recommendation.append(aladdin_items[command_index])
-                exist_commands.append(aladdin_command)
-
-        else:
-            if aladdin_command not in exist_commands:
-                commands_from_recommendation.append(aladdin_items[command_index])
-                exist_commands.append(aladdin_command)
-            if calculation_command not in exist_commands:
-                commands_from_recommendation.append(calculation_items[command_index])
-                exist_commands.append(calculation_command)
-
-        command_index = command_index + 1
-
-    commands_from_recommendation = merge_remaining_items(command_index, calculation_items, exist_commands, commands_from_recommendation)
-    commands_from_recommendation = merge_remaining_items(command_index, aladdin_items, exist_commands, commands_from_recommendation)
-
-    result.extend(commands_from_recommendation)
-    return result
-
-
-def merge_remaining_items(command_index, items, exist_commands, commands_from_recommendation):
-
-    while command_index < len(items):
-
-        command = items[command_index]['command']
-        if command not in exist_commands:
-            commands_from_recommendation.append(items[command_index])
-            exist_commands.append(command)
-
-        command_index = command_index + 1
-
-    return commands_from_recommendation
+def merge_and_sort_recommendation_items(knowledge_base_items, calculation_items, aladdin_items, limits=None, classify=None):
+    sources = [MergeSource('OfflineCaculation', calculation_items, recommendation_merge_weights.get('OfflineCaculation', 1)),
+               MergeSource('Aladdin', aladdin_items, recommendation_merge_weights.get('Aladdin', 1))]
+    if recommendation_prefer != "1":
+        sources.reverse()
+    return merge_recommendation_items(knowledge_base_items, sources, recommendation_merge_strategy, limits, classify)
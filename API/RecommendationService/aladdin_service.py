@@ -1,11 +1,15 @@
 import os
-import requests
 import json
 import logging
+
+import httpx
+
+from common.http_client import get_async_http_client, get_timeout
+
 from .util import RecommendationSource, RecommendType
 
 
-def get_recommend_from_aladdin(command_list, correlation_id, subscription_id, cli_version, user_id, top_num=50):  # pylint: disable=unused-argument
+async def get_recommend_from_aladdin(command_list, correlation_id, subscription_id, cli_version, user_id, top_num=50):  # pylint: disable=unused-argument
     '''query next command from web api'''
 
     url = os.environ["Aladdin_Service_URL"]
@@ -30,9 +34,14 @@ def get_recommend_from_aladdin(command_list, correlation_id, subscription_id, cl
     if subscription_id:
         payload["context"]["SubscriptionId"] = subscription_id
 
-    response = requests.post(url, json.dumps(payload), headers=headers)
+    try:
+        client = get_async_http_client()
+        response = await client.post(url, content=json.dumps(payload), headers=headers, timeout=get_timeout("Aladdin_Timeout"))
+    except httpx.RequestError as e:
+        logging.error('Error while retrieving recommendation from Aladdin: %s', e)
+        return []
     if response.status_code != 200:
-        logging.info('Status:{} {} ErrorMessage:{}'.format(response.status_code, response.reason, response.text))
+        logging.info('Status:{} {} ErrorMessage:{}'.format(response.status_code, response.reason_phrase, response.text))
         return []
     return transform_response(response)
 
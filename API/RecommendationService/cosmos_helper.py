@@ -1,8 +1,12 @@
+import copy
 import os
 
-from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient
 
-from .util import generated_query_kql
+from common.cache import LRUCache
+
+from .offline_snapshot import SNAPSHOT_TABLE, SNAPSHOT_TABLE_2, OfflineSnapshotStore
+from .util import generated_query_conditions, generated_query_kql, match_query_conditions
 
 client = CosmosClient(os.environ["CosmosDB_Endpoint"], os.environ["CosmosDB_Key"])
 database = client.get_database_client(os.environ["CosmosDB_DataBase"])
@@ -11,31 +15,80 @@ recommendation_container = database.get_container_client(os.environ["Recommendat
 recommendation_container_2 = database.get_container_client(os.environ["Recommendation_Container_2"])
 e2e_scenario_container = database.get_container_client(os.environ["E2EScenario_Container"])
 
+# The recommendation data in Cosmos DB is generated by offline batch jobs and rarely changes,
+# so the query results of hot commands are cached in each worker to save RUs and round-trip latency.
+query_cache = LRUCache(max_size=int(os.environ.get("Cosmos_Cache_Max_Size", "2048")),
+                       ttl=float(os.environ.get("Cosmos_Cache_TTL", "3600")))
 
-def query_recommendation_from_knowledge_base(prev_command, recommend_type, error_info):
-    query = generated_query_kql(prev_command, recommend_type, error_info)
-
-    return knowledge_base_container.query_items(query=query, enable_cross_partition_query=True)
+# The offline recommendation containers can be served from a snapshot exported by `OfflineSnapshotUpdater`,
+# which is shared by the workers through the path, e.g. a mounted file share, and copied to the local path of each worker
+offline_snapshot_store = OfflineSnapshotStore(os.environ["Offline_Snapshot_Path"], float(os.environ.get("Offline_Snapshot_Check_Interval", "60")),
+                                              os.environ.get("Offline_Snapshot_Local_Path")) \
+    if os.environ.get("Offline_Snapshot_Path") else None
 
 
-def query_recommendation_from_offline_data(prev_command, recommend_type, error_info):
-    query = generated_query_kql(prev_command, recommend_type, error_info)
+async def query_recommendation_from_knowledge_base(prev_command, recommend_type, error_info):
+    return await _query_items_with_cache(knowledge_base_container, prev_command, recommend_type, error_info)
 
-    return recommendation_container.query_items(query=query, enable_cross_partition_query=True)
 
+async def query_recommendation_from_offline_data(prev_command, recommend_type, error_info, copy_items=True):
+    items = _query_items_from_snapshot(SNAPSHOT_TABLE, prev_command, recommend_type, error_info)
+    if items is not None:
+        return items
+    return await _query_items_with_cache(recommendation_container, prev_command, recommend_type, error_info, copy_items=copy_items)
 
-def query_recommendation_from_offline_data_2(pprev_command, prev_command, recommend_type, error_info):
-    query = generated_query_kql(pprev_command + "|" + prev_command, recommend_type, error_info)
 
-    return recommendation_container_2.query_items(query=query, enable_cross_partition_query=True)
+async def query_recommendation_from_offline_data_2(pprev_command, prev_command, recommend_type, error_info, copy_items=True):
+    items = _query_items_from_snapshot(SNAPSHOT_TABLE_2, pprev_command + "|" + prev_command, recommend_type, error_info)
+    if items is not None:
+        return items
+    return await _query_items_with_cache(recommendation_container_2, pprev_command + "|" + prev_command, recommend_type, error_info,
+                                         copy_items=copy_items)
 
 
-def query_recommendation_from_e2e_scenario(prev_command, source_type):
+async def query_recommendation_from_e2e_scenario(prev_command, source_type):
     qry = f'SELECT * FROM c where c.firstCommand = @cmd and c.source in ({",".join(["@src"+str(int(src)) for src in source_type])})'
-    return e2e_scenario_container.query_items(
+    query_items = e2e_scenario_container.query_items(
         query=qry,
         parameters=[
             {"name": "@cmd", "value": "az " + prev_command},
         ] + [{"name": "@src"+str(int(src)), "value": src} for src in source_type],
-        enable_cross_partition_query=True,
     )
+    return [item async for item in query_items]
+
+
+def _query_items_from_snapshot(table, command, recommend_type, error_info):
+    '''
+    Returns: the items in the snapshot, which are built for each call so they don't need to be copied,
+             or `None` if no snapshot is loaded yet and the items should be queried from Cosmos DB
+    '''
+    snapshot = offline_snapshot_store.get() if offline_snapshot_store else None
+    if snapshot is None or not snapshot.has_table(table):
+        return None
+    cosmos_type, error_info_arr = generated_query_conditions(recommend_type, error_info)
+    return [item for item in snapshot.get_items(table, command) if match_query_conditions(item, cosmos_type, error_info_arr)]
+
+
+async def _query_items_with_cache(container, command, recommend_type, error_info, copy_items=True):
+    """
+    Args:
+        copy_items: whether to return a copy of the items. The callers that never modify the items can skip the copy of large items.
+    """
+    if os.environ.get("Enable_Cosmos_Cache", '1') != '1':
+        return await _query_items(container, command, recommend_type, error_info)
+
+    cosmos_type, error_info_arr = generated_query_conditions(recommend_type, error_info)
+    cache_key = (container.id, command, str(cosmos_type), error_info_arr)
+    items = query_cache.get(cache_key)
+    if items is None:
+        items = await _query_items(container, command, recommend_type, error_info)
+        query_cache.set(cache_key, items)
+
+    # The callers add fields such as `ratio` and `source` into the returned items, so never hand out the cached objects
+    return copy.deepcopy(items) if copy_items else items
+
+
+async def _query_items(container, command, recommend_type, error_info):
+    query = generated_query_kql(command, recommend_type, error_info)
+
+    return [item async for item in container.query_items(query=query)]
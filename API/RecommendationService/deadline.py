@@ -0,0 +1,46 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+
+async def gather_with_deadline(sources: Dict[str, Awaitable], deadline: Optional[float] = None,
+                               timeouts: Optional[Dict[str, float]] = None) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Wait for the recommendation sources concurrently within the deadline of the request.
+    The sources that time out are cancelled, so one slow dependency doesn't hold up the whole request.
+    Args:
+        sources: the name of each source -> the awaitable of its items
+        deadline: the budget of the whole request in seconds, `None` means there is no deadline
+        timeouts: the timeout of each source in seconds, which is capped by the deadline
+    Returns: the results of the sources that finish in time, and the names of the missing sources
+    """
+    timeouts = timeouts or {}
+    start = time.monotonic()
+
+    async def wait_source(name, awaitable):
+        timeout = timeouts.get(name)
+        if deadline is not None:
+            timeout = deadline if timeout is None else min(timeout, deadline)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            logging.warning('Recommendation source %s timed out after %.3fs', name, time.monotonic() - start)
+            raise
+        except Exception as e:
+            logging.error('Error while retrieving recommendation from %s: %s', name, e)
+            raise
+
+    names = list(sources)
+    outcomes = await asyncio.gather(*[wait_source(name, sources[name]) for name in names], return_exceptions=True)
+
+    results, missing_sources = {}, []
+    for name, outcome in zip(names, outcomes):
+        # The cancellation of a source is a `BaseException`, which is also a missing source
+        if isinstance(outcome, BaseException):
+            missing_sources.append(name)
+        else:
+            results[name] = outcome
+    if missing_sources:
+        logging.warning('Recommendation is partial, missing sources: %s, elapsed: %.3fs', ','.join(missing_sources), time.monotonic() - start)
+    return results, missing_sources
@@ -15,9 +15,8 @@ def filter_recommendation_result(recommendation_result, command_list, command_to
     filter_result = []
     for item in recommendation_result:
         if item['type'] != RecommendType.Scenario:
-            if item['type'] == RecommendType.Command:
-                if item['command'] == filter_command or 'delete' in item['command']:
-                    continue
+            if is_filtered_command(item, filter_command):
+                continue
             if command_count >= command_top_num:
                 continue
             else:
@@ -30,3 +29,19 @@ def filter_recommendation_result(recommendation_result, command_list, command_to
         filter_result.append(item)
 
     return filter_result
+
+
+def is_filtered_command(item, filter_command):
+    """
+    Whether the item is removed from the result, since it is the same as the last command or it deletes resources
+    """
+    return item['type'] == RecommendType.Command and (item['command'] == filter_command or 'delete' in item['command'])
+
+
+def classify_recommendation_item(item, filter_command):
+    """
+    Returns: the quota that the item is counted toward in the result, `None` if the item is removed
+    """
+    if item['type'] == RecommendType.Scenario:
+        return 'scenario'
+    return None if is_filtered_command(item, filter_command) else 'command'
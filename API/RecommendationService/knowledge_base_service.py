@@ -2,12 +2,12 @@ from .cosmos_helper import query_recommendation_from_knowledge_base
 from .util import get_latest_cmd, RecommendationSource, RecommendType
 
 
-def get_recommend_from_knowledge_base(command_list, recommend_type, error_info, top_num=50):
+async def get_recommend_from_knowledge_base(command_list, recommend_type, error_info, top_num=50):
 
     commands = get_latest_cmd(command_list)
 
     result = []
-    knowledge_base_items = list(query_recommendation_from_knowledge_base(commands[-1], recommend_type, error_info))
+    knowledge_base_items = await query_recommendation_from_knowledge_base(commands[-1], recommend_type, error_info)
     if knowledge_base_items:
         for item in knowledge_base_items:
             if 'nextCommand' in item:
@@ -0,0 +1,87 @@
+import heapq
+from itertools import islice
+from typing import Callable, Dict, Hashable, Iterator, List, NamedTuple, Optional
+
+
+class MergeSource(NamedTuple):
+    name: str
+    items: List[Dict]
+    # The number of items taken in each round of `round_robin`, or the multiplier of the score in `score`
+    weight: float = 1
+
+
+def interleave_round_robin(sources: List[MergeSource]) -> Iterator[Dict]:
+    """
+    Take `weight` items from each source in turn, and skip the sources that are exhausted
+    """
+    iterators = [(iter(source.items), max(1, int(source.weight))) for source in sources]
+    while iterators:
+        remaining_iterators = []
+        for items, weight in iterators:
+            taken = list(islice(items, weight))
+            yield from taken
+            if len(taken) == weight:
+                remaining_iterators.append((items, weight))
+        iterators = remaining_iterators
+
+
+def interleave_by_score(sources: List[MergeSource]) -> Iterator[Dict]:
+    """
+    Order the items of all sources by `weight / (rank + 1)`, so that the scores of different sources are comparable.
+    The ties are broken by the order of sources.
+    """
+    def scored_items(source_index, source):
+        for rank, item in enumerate(source.items):
+            yield -source.weight / (rank + 1), source_index, rank, item
+
+    for _, _, _, item in heapq.merge(*[scored_items(index, source) for index, source in enumerate(sources)]):
+        yield item
+
+
+MERGE_STRATEGIES = {
+    'round_robin': interleave_round_robin,
+    'score': interleave_by_score,
+}
+
+
+def merge_recommendation_items(leading_items: List[Dict], sources: List[MergeSource], strategy: str = 'round_robin',
+                               limits: Optional[Dict[Hashable, int]] = None,
+                               classify: Optional[Callable[[Dict], Optional[Hashable]]] = None) -> List[Dict]:
+    """
+    Merge the recommendation items of multiple sources in a single pass, and remove the duplicate commands.
+    Args:
+        leading_items: the items that are always kept at the front, e.g. the items of solution and knowledge base
+        sources: the sources that are interleaved after the leading items
+        strategy: the name of the interleaving strategy in `MERGE_STRATEGIES`
+        limits: the number of items needed for each category, the merge stops once all of them are reached.
+                `None` means all the items are merged
+        classify: get the category of an item, `None` means the item is not counted toward any limit
+    Returns: a new list of the merged items
+    """
+    result = list(leading_items)
+    # The leading items are not deduplicated among themselves, but the items of sources are deduplicated against them
+    exist_commands = {item['command'] for item in leading_items if 'command' in item}
+    remaining = {category: num for category, num in limits.items() if num > 0} if limits is not None else None
+    if remaining is not None:
+        for item in result:
+            _count_item(remaining, classify(item))
+
+    for item in MERGE_STRATEGIES[strategy](sources):
+        if remaining is not None and not remaining:
+            break
+        command = item['command']
+        if command in exist_commands:
+            continue
+        exist_commands.add(command)
+        result.append(item)
+        if remaining is not None:
+            _count_item(remaining, classify(item))
+    return result
+
+
+def _count_item(remaining, category):
+    # The category is removed once its limit is reached, so the merge stops when no category remains
+    if category in remaining:
+        remaining[category] -= 1
+        if remaining[category] <= 0:
+            del remaining[category]
@@ -1,10 +1,31 @@
 import asyncio
+import heapq
+import logging
 import os
+import time
 
 from .cosmos_helper import query_recommendation_from_offline_data, query_recommendation_from_offline_data_2
+from .query_policy import OfflineQueryPolicy, OfflineQueryStats, PairHitTracker
 from .util import get_latest_cmd, RecommendationSource, RecommendType, generated_cosmos_type, CosmosType
 
 
+
+def _get_offline_query_policy():
+    # Offline_Query_Policy: "race", "sequential" or "auto", see `query_policy.OfflineQueryPolicy`
+    policy = os.environ.get("Offline_Query_Policy", "auto")
+    try:
+        return OfflineQueryPolicy(policy)
+    except ValueError:
+        logging.warning('Unknown Offline_Query_Policy "%s", the "auto" policy is used', policy)
+        return OfflineQueryPolicy.Auto
+
+
+offline_query_policy = _get_offline_query_policy()
+pair_hit_tracker = PairHitTracker(max_size=int(os.environ.get("Offline_Query_Tracker_Max_Size", "4096")),
+                                  hot_rate=float(os.environ.get("Offline_Query_Hot_Rate", "0.8")))
+offline_query_stats = OfflineQueryStats(report_interval=float(os.environ.get("Offline_Query_Stats_Interval", "60")))
+
+
 async def get_recommend_from_offline_data(command_list, recommend_type, top_num=50):
     commands = get_latest_cmd(command_list, 2)
 
@@ -12,30 +33,59 @@ async def get_recommend_from_offline_data(command_list, recommend_type, top_num=
     ratio_threshold = int(os.environ["Command_Ratio_Threshold"])
 
     # The recommended content matching the last two commands is preferred. If there is no data, it will fall back to the situation of matching the last command
-    result_2_task = asyncio.create_task(asyncio.to_thread(get_recommend_from_cosmos, commands[-2:], recommend_type, None, totalcount_threshold, ratio_threshold, top_num))
-    result_task = asyncio.create_task(asyncio.to_thread(get_recommend_from_cosmos, commands[-1:], recommend_type, None, totalcount_threshold, ratio_threshold, top_num))
+    pair = tuple(commands[-2:])
+    policy = offline_query_policy
+    if policy == OfflineQueryPolicy.Auto:
+        policy = OfflineQueryPolicy.Sequential if pair_hit_tracker.is_hot(pair) else OfflineQueryPolicy.Race
+
+    result_2_task = asyncio.create_task(get_recommend_from_cosmos(commands[-2:], recommend_type, None, totalcount_threshold, ratio_threshold, top_num))
+    result_task = None
+    if policy == OfflineQueryPolicy.Race:
+        result_task = asyncio.create_task(get_recommend_from_cosmos(commands[-1:], recommend_type, None, totalcount_threshold, ratio_threshold, top_num))
 
     result_2 = await result_2_task
-    if len(result_2) >= top_num:
+    hit = len(result_2) >= top_num
+    pair_hit_tracker.record(pair, hit)
+    if hit:
+        if result_task:
+            result_task.cancel()
+        offline_query_stats.record(saved=result_task is None, wasted=result_task is not None)
+        logging.debug('Offline query policy: %s, the query of the last command is %s', policy.value, 'skipped' if result_task is None else 'discarded')
         return result_2
-    else:
+
+    if result_task:
+        offline_query_stats.record()
         return result_2 + await result_task
 
+    start = time.monotonic()
+    result = await get_recommend_from_cosmos(commands[-1:], recommend_type, None, totalcount_threshold, ratio_threshold, top_num)
+    fallback_seconds = time.monotonic() - start
+    offline_query_stats.record(fallback_seconds=fallback_seconds)
+    logging.debug('Offline query policy: %s, the query of the last command falls back in %.3fs', policy.value, fallback_seconds)
+    return result_2 + result
+
 
-def get_recommend_from_solution(command_list, recommend_type, error_info, top_num=50):
+async def get_recommend_from_solution(command_list, recommend_type, error_info, top_num=50):
     last_command = get_latest_cmd(command_list, 1)
     totalcount_threshold = int(os.environ["Solution_TotalCount_Threshold"])
     ratio_threshold = int(os.environ["Solution_Ratio_Threshold"])
-    return get_recommend_from_cosmos(last_command, recommend_type, error_info, totalcount_threshold, ratio_threshold, top_num)
+    return await get_recommend_from_cosmos(last_command, recommend_type, error_info, totalcount_threshold, ratio_threshold, top_num)
 
 
-def get_recommend_from_cosmos(commands, recommend_type, error_info, totalcount_threshold, ratio_threshold, top_num=50):
+async def get_recommend_from_cosmos(commands, recommend_type, error_info, totalcount_threshold, ratio_threshold, top_num=50):
+    # The items are only read here, and the selected commands are copied, so the cached items are not copied as a whole
     if len(commands) == 2:
-        query_items = list(query_recommendation_from_offline_data_2(commands[-2], commands[-1], recommend_type, error_info))
+        query_items = await query_recommendation_from_offline_data_2(commands[-2], commands[-1], recommend_type, error_info, copy_items=False)
     else:
-        query_items = list(query_recommendation_from_offline_data(commands[-1], recommend_type, error_info))
+        query_items = await query_recommendation_from_offline_data(commands[-1], recommend_type, error_info, copy_items=False)
 
-    result = []
+    if not top_num or top_num <= 0:
+        return []
+
+    # A min-heap of the top n commands by usage ratio. The later command is evicted first among the commands with the same ratio,
+    # so the result is the same as a stable sort of all the commands.
+    top_commands = []
+    sequence = 0
     for item in query_items:
         if item['totalCount'] < totalcount_threshold:
             continue
@@ -44,26 +94,31 @@ def get_recommend_from_cosmos(commands, recommend_type, error_info, totalcount_t
             for command_info in item['nextCommand']:
 
                 # The items in 'nextCommand' have been sorted according to frequency of occurrence
-                command_info['ratio'] = float((int(command_info['count'])/int(item['totalCount'])))
-                if command_info['ratio'] * 100 < ratio_threshold:
+                ratio = float((int(command_info['count'])/int(item['totalCount'])))
+                if ratio * 100 < ratio_threshold:
+                    break
+                # The remaining commands of this item can't be better than the top n commands
+                if len(top_commands) >= top_num and ratio <= top_commands[0][0]:
                     break
 
                 if error_info:
-                    command_info['type'] = RecommendType.Solution
+                    recommend_item_type = RecommendType.Solution
                 else:
-                    command_info['type'] = RecommendType.Command
+                    recommend_item_type = RecommendType.Command
                     # Commands inputed by this user do not participate in recommendations for Command scenario
                     if command_info['command'] in commands:
                         continue
 
-                command_info['usage_condition'] = get_usage_condition(command_info['ratio'])
-                command_info['source'] = RecommendationSource.OfflineCaculation
-                result.append(command_info)
+                command_info = dict(command_info, ratio=ratio, type=recommend_item_type, usage_condition=get_usage_condition(ratio),
+                                    source=RecommendationSource.OfflineCaculation)
+                sequence += 1
+                if len(top_commands) < top_num:
+                    heapq.heappush(top_commands, (ratio, -sequence, command_info))
+                else:
+                    heapq.heapreplace(top_commands, (ratio, -sequence, command_info))
 
-    # Sort the calculated offline data according to the usage ratio and take the top n data
-    if result:
-        result = sorted(result, key=lambda x: x['ratio'], reverse=True)
-    return result[0: top_num]
+    # Sort the calculated offline data according to the usage ratio
+    return [command_info for _, _, command_info in sorted(top_commands, key=lambda x: (-x[0], -x[1]))]
 
 
 def get_usage_condition(ratio):
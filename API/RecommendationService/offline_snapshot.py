@@ -0,0 +1,294 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# The tables of the snapshot, which are exported from `Recommendation_Container` and `Recommendation_Container_2`
+SNAPSHOT_TABLE = 'recommendation'
+SNAPSHOT_TABLE_2 = 'recommendation_2'
+
+# The file that contains the name of the current version, it is replaced atomically after a version is completely written
+CURRENT_FILE = 'CURRENT'
+
+# The arrays of each table, items are rows and the next commands of the items are stored in the CSR layout:
+#   keys, types, totals, item_extras: the interned command, `type`, `totalCount` and the other fields of each item
+#   indptr: the next commands of row i are in [indptr[i], indptr[i + 1])
+#   next_commands, counts, edge_extras: the interned command, `count` and the other fields of each next command
+TABLE_ARRAYS = ['keys', 'types', 'totals', 'item_extras', 'indptr', 'next_commands', 'counts', 'edge_extras']
+
+_ITEM_FIELDS = {'id', 'command', 'type', 'totalCount', 'nextCommand'}
+_EDGE_FIELDS = {'command', 'count'}
+
+
+def export_offline_snapshot(root: str, tables: Dict[str, Iterable[dict]], version: Optional[str] = None) -> str:
+    """
+    Export the items of the offline recommendation containers into a new version of the snapshot,
+    and make it the current version once all the files are written.
+    Args:
+        root: the directory of the snapshot versions
+        tables: the name of each table -> the items of the container
+        version: the name of the version, the UTC time is used by default
+    Returns: the name of the exported version
+    """
+    version = version or datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    strings, string_ids = [], {}
+    extras, extra_ids = [], {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    def add_extra(fields):
+        # The fields that are not stored in arrays, such as `errorInformation`, are kept in a deduplicated JSON table
+        if not fields:
+            return -1
+        content = json.dumps(fields, sort_keys=True)
+        if content not in extra_ids:
+            extra_ids[content] = len(extras)
+            extras.append(fields)
+        return extra_ids[content]
+
+    tmp_dir = os.path.join(root, '.' + version + '.tmp')
+    os.makedirs(tmp_dir)
+    try:
+        table_sizes = {}
+        for name, items in tables.items():
+            # The rows of the same command are contiguous, so they can be found by a range
+            items = sorted(items, key=lambda item: item['command'])
+            arrays = {array_name: [] for array_name in TABLE_ARRAYS}
+            arrays['indptr'].append(0)
+            for item in items:
+                arrays['keys'].append(intern(item['command']))
+                arrays['types'].append(item.get('type') if item.get('type') is not None else -1)
+                arrays['totals'].append(int(item.get('totalCount', 0)))
+                arrays['item_extras'].append(add_extra({key: value for key, value in item.items()
+                                                        if key not in _ITEM_FIELDS and not key.startswith('_')}))
+                for command_info in item.get('nextCommand') or []:
+                    arrays['next_commands'].append(intern(command_info['command']))
+                    arrays['counts'].append(int(command_info['count']))
+                    arrays['edge_extras'].append(add_extra({key: value for key, value in command_info.items() if key not in _EDGE_FIELDS}))
+                arrays['indptr'].append(len(arrays['next_commands']))
+
+            dtypes = {'types': np.int16, 'totals': np.int64, 'indptr': np.int64, 'counts': np.int64}
+            for array_name, values in arrays.items():
+                np.save(os.path.join(tmp_dir, f'{name}.{array_name}.npy'), np.asarray(values, dtype=dtypes.get(array_name, np.int32)))
+            table_sizes[name] = len(items)
+
+        _write_json(os.path.join(tmp_dir, 'strings.json'), strings)
+        _write_json(os.path.join(tmp_dir, 'extras.json'), extras)
+        _write_json(os.path.join(tmp_dir, 'manifest.json'), {'version': version, 'tables': table_sizes})
+        os.rename(tmp_dir, os.path.join(root, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    tmp_current = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(tmp_current, 'w') as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, CURRENT_FILE))
+    return version
+
+
+def prune_offline_snapshots(root: str, keep: int = 3) -> List[str]:
+    """
+    Remove the old versions of the snapshot, the current version and the latest `keep` versions are kept.
+    The temporary directories left by the failed exports are removed as well.
+    Returns: the removed versions
+    """
+    for name in os.listdir(root):
+        if name.startswith('.') and name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    current_version = read_current_version(root)
+    versions = sorted(name for name in os.listdir(root) if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+    removed = []
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version == current_version:
+            continue
+        try:
+            shutil.rmtree(os.path.join(root, version))
+        except OSError as e:
+            # The files may be still mapped by a worker on some platforms, they will be removed next time
+            logging.warning('Failed to remove the offline snapshot %s: %s', version, e)
+        else:
+            removed.append(version)
+    return removed
+
+
+def read_current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class OfflineSnapshot():
+    """
+    A read-only version of the snapshot. The arrays are memory-mapped, so only the pages that are read are loaded.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        with open(os.path.join(path, 'strings.json')) as f:
+            self._strings = json.load(f)
+        with open(os.path.join(path, 'extras.json')) as f:
+            self._extras = json.load(f)
+        self.version = manifest['version']
+        self._tables = {}
+        for name in manifest['tables']:
+            arrays = {array_name: np.load(os.path.join(path, f'{name}.{array_name}.npy'), mmap_mode='r') for array_name in TABLE_ARRAYS}
+            # command -> the range of its rows
+            rows = {}
+            for row, key in enumerate(arrays['keys'].tolist()):
+                command = self._strings[key]
+                rows[command] = (rows[command][0] if command in rows else row, row + 1)
+            self._tables[name] = (arrays, rows)
+
+    def has_table(self, name: str) -> bool:
+        return name in self._tables
+
+    def get_items(self, name: str, command: str) -> List[dict]:
+        """
+        Get the items of the command in the same format as the items in Cosmos DB.
+        The `nextCommand` of each item is built lazily, so the callers that stop early only build the commands they read.
+        """
+        arrays, rows = self._tables[name]
+        start, stop = rows.get(command, (0, 0))
+        items = []
+        for row in range(start, stop):
+            item = {'command': command, 'totalCount': int(arrays['totals'][row])}
+            item_type = int(arrays['types'][row])
+            if item_type >= 0:
+                item['type'] = item_type
+            extra = int(arrays['item_extras'][row])
+            if extra >= 0:
+                item.update(self._extras[extra])
+            item['nextCommand'] = _NextCommandList(self, arrays, int(arrays['indptr'][row]), int(arrays['indptr'][row + 1]))
+            items.append(item)
+        return items
+
+    def _build_command_info(self, arrays, index):
+        command_info = {'command': self._strings[arrays['next_commands'][index]], 'count': int(arrays['counts'][index])}
+        extra = int(arrays['edge_extras'][index])
+        if extra >= 0:
+            command_info.update(self._extras[extra])
+        return command_info
+
+
+class _NextCommandList(Sequence):
+
+    def __init__(self, snapshot, arrays, start, stop):
+        self._snapshot = snapshot
+        self._arrays = arrays
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('next command index out of range')
+        return self._snapshot._build_command_info(self._arrays, self._start + index)
+
+    def __iter__(self):
+        for index in range(self._start, self._stop):
+            yield self._snapshot._build_command_info(self._arrays, index)
+
+
+class OfflineSnapshotStore():
+    """
+    Serve the current version of the snapshot, and switch to a newer version when the `CURRENT` file is changed.
+    The root is usually a file share that is mounted by all the workers, so each version is copied to the local disk
+    before it is mapped, and the reads of the requests never go to the network.
+    The versions are copied and loaded in a loader thread, the requests keep using the previous version until the new one is ready.
+    Args:
+        root: the directory of the snapshot versions
+        check_interval: the minimum interval in seconds between two checks of the `CURRENT` file
+        local_dir: the local directory that the versions are copied into
+    """
+
+    def __init__(self, root: str, check_interval: float = 60, local_dir: Optional[str] = None) -> None:
+        self.root = root
+        self.check_interval = check_interval
+        self.local_dir = local_dir or os.path.join(tempfile.gettempdir(), 'offline_snapshot')
+        self._snapshot = None
+        self._checked_at = None
+        self._loader = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[OfflineSnapshot]:
+        """
+        Returns: the current snapshot, or `None` if no snapshot has been loaded yet
+        """
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if (self._checked_at is None or now - self._checked_at >= self.check_interval) and \
+                        (self._loader is None or not self._loader.is_alive()):
+                    self._checked_at = now
+                    self._loader = threading.Thread(target=self.reload, name='OfflineSnapshotLoader', daemon=True)
+                    self._loader.start()
+        return self._snapshot
+
+    def reload(self) -> None:
+        """
+        Load the current version if it is not loaded, which blocks until the version is copied and loaded
+        """
+        version = read_current_version(self.root)
+        if not version or (self._snapshot is not None and self._snapshot.version == version):
+            return
+        try:
+            snapshot = OfflineSnapshot(self._copy_to_local(version))
+        except (OSError, ValueError, KeyError) as e:
+            # Keep serving the loaded version, the new version is retried in the next check
+            logging.error('Failed to load the offline snapshot %s: %s', version, e)
+            return
+        # The requests that hold the previous snapshot keep reading it, and it is released after they finish
+        self._snapshot = snapshot
+        logging.info('Offline snapshot %s is loaded', version)
+        self._remove_local_versions(exclude=version)
+
+    def _copy_to_local(self, version):
+        local_path = os.path.join(self.local_dir, version)
+        if not os.path.isdir(local_path):
+            os.makedirs(self.local_dir, exist_ok=True)
+            # The worker processes of an instance may share the local directory, so each of them copies into its own directory
+            tmp_path = os.path.join(self.local_dir, f'.{version}.{os.getpid()}.tmp')
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.copytree(os.path.join(self.root, version), tmp_path)
+            try:
+                os.rename(tmp_path, local_path)
+            except OSError:
+                # Another worker process has copied the same version
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                if not os.path.isdir(local_path):
+                    raise
+        return local_path
+
+    def _remove_local_versions(self, exclude):
+        for name in os.listdir(self.local_dir):
+            if name != exclude and not name.startswith('.'):
+                # The files of the previous version may be still mapped on some platforms, they will be removed next time
+                shutil.rmtree(os.path.join(self.local_dir, name), ignore_errors=True)
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
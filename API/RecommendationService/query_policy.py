@@ -0,0 +1,94 @@
+import json
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Hashable
+
+from common.cache import LRUCache
+
+
+class OfflineQueryPolicy(str, Enum):
+    # Query the last two commands and the last command concurrently, the latter is discarded when the former is enough
+    Race = 'race'
+    # Query the last two commands first, and only query the last command when the result is not enough
+    Sequential = 'sequential'
+    # Use `Sequential` for the command pairs whose query is usually enough, and `Race` for the others
+    Auto = 'auto'
+
+
+class PairHitTracker():
+    """
+    Track how often the query of a command pair fills the top n commands by itself.
+    Args:
+        max_size: the maximum number of command pairs tracked, the least recently used pair is evicted first
+        hot_rate: the minimum hit rate for a pair to be hot
+        min_samples: the minimum number of queries before a pair can be hot
+        window: the counts are halved once the number of queries exceeds it, so the rate follows the recent data
+    """
+
+    def __init__(self, max_size: int = 4096, hot_rate: float = 0.8, min_samples: int = 5, window: int = 100) -> None:
+        self.hot_rate = hot_rate
+        self.min_samples = min_samples
+        self.window = window
+        # pair -> (hits, total)
+        self._counts = LRUCache(max_size=max_size)
+
+    def record(self, pair: Hashable, hit: bool) -> None:
+        hits, total = self._counts.get(pair, (0, 0))
+        hits, total = hits + int(hit), total + 1
+        if total > self.window:
+            hits, total = hits / 2, total / 2
+        self._counts.set(pair, (hits, total))
+
+    def is_hot(self, pair: Hashable) -> bool:
+        hits, total = self._counts.get(pair, (0, 0))
+        return total >= self.min_samples and hits / total >= self.hot_rate
+
+
+class OfflineQueryStats():
+    """
+    The metrics of the offline queries, which show how many queries and how much latency the policy saves or costs.
+    The counters are logged at most once per `report_interval` seconds, instead of once per request.
+    Args:
+        report_interval: the minimum interval in seconds between two reports, `None` means the counters are never reported
+    """
+
+    def __init__(self, report_interval: float = None) -> None:
+        self.report_interval = report_interval
+        self._reported_at = time.monotonic()
+        self.pair_queries = 0
+        # The queries of the last command that are not sent, each saves the RUs of a point read
+        self.saved_queries = 0
+        # The queries of the last command that are sent concurrently but discarded
+        self.wasted_queries = 0
+        # The queries of the last command that are sent after the pair query isn't enough, and the latency they add
+        self.fallback_queries = 0
+        self.fallback_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, saved: bool = False, wasted: bool = False, fallback_seconds: float = None) -> None:
+        with self._lock:
+            self.pair_queries += 1
+            self.saved_queries += int(saved)
+            self.wasted_queries += int(wasted)
+            if fallback_seconds is not None:
+                self.fallback_queries += 1
+                self.fallback_seconds += fallback_seconds
+            now = time.monotonic()
+            report = self.report_interval is not None and now - self._reported_at >= self.report_interval
+            if report:
+                self._reported_at = now
+        if report:
+            logging.info('Offline query stats: %s', json.dumps(self.stats()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pairQueries": self.pair_queries,
+                "savedQueries": self.saved_queries,
+                "wastedQueries": self.wasted_queries,
+                "fallbackQueries": self.fallback_queries,
+                "fallbackSeconds": self.fallback_seconds,
+                "savedRate": self.saved_queries / self.pair_queries if self.pair_queries else 0.0,
+            }
@@ -1,9 +1,7 @@
 import os
 from typing import List
 
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-
+from common.search_client import get_async_scenario_search_client
 from common.util import ScenarioSourceType
 
 from .cosmos_helper import query_recommendation_from_e2e_scenario
@@ -27,12 +25,12 @@ def strip_az_in_command_set(command_set):
     return result
 
 
-def get_scenario_recommendation(command_list, top_num=50):
+async def get_scenario_recommendation(command_list, top_num=50):
     source_type: List[ScenarioSourceType] = [ScenarioSourceType.SAMPLE_REPO]
     commands = get_latest_cmd(command_list)
 
     result = []
-    for item in query_recommendation_from_e2e_scenario(commands[-1], source_type):
+    for item in await query_recommendation_from_e2e_scenario(commands[-1], source_type):
         if len(item['commandSet']) > 1:
             scenario = {
                 'scenario': item['name'],
@@ -47,7 +45,7 @@ def get_scenario_recommendation(command_list, top_num=50):
     return result[0: top_num]
 
 
-def get_search_results(trigger_commands: List[str], top: int = 5):
+async def get_search_results(trigger_commands: List[str], top: int = 5):
     """Search related sceanrios using cognitive search
 
     Args:
@@ -59,27 +57,24 @@ def get_search_results(trigger_commands: List[str], top: int = 5):
     """
     if len(trigger_commands) == 0:
         return []
-    service_endpoint = os.environ["SCENARIO_SEARCH_SERVICE_ENDPOINT"]
-    search_client = SearchClient(endpoint=service_endpoint,
-                                 index_name=os.environ["SCENARIO_SEARCH_INDEX"],
-                                 credential=AzureKeyCredential(os.environ["SCENARIO_SEARCH_SERVICE_SEARCH_KEY"]))
     search_statement = ""
     if len(trigger_commands) > 1:
         search_statement = "(" + " OR ".join([f'"{cmd}"' for cmd in trigger_commands][:-1]) + ") AND "
     search_statement = search_statement + f'"{trigger_commands[-1]}"'
     search_statement = f'"{trigger_commands[-1]}" OR ({search_statement})'
-    results = search_client.search(
+    search_client = get_async_scenario_search_client()
+    results = await search_client.search(
         search_text=search_statement,
         include_total_count=True,
         search_fields=["commandSet/command"],
         highlight_fields="commandSet/command",
         top=top,
         query_type='full')
-    results = list(results)
+    results = [result async for result in results]
     return results
 
 
-def get_scenario_recommendation_from_search(command_list, top_num=5):
+async def get_scenario_recommendation_from_search(command_list, top_num=5):
     """Recommend Scenarios that current context could be in
 
     Args:
@@ -94,7 +89,7 @@ def get_scenario_recommendation_from_search(command_list, top_num=5):
     trigger_len = int(os.environ.get("ScenarioRecommendationTriggerLength", "3"))
     trigger_commands = get_latest_cmd(command_list, trigger_len)
     trigger_commands = [cmd[3:] if cmd.startswith("az ") else cmd for cmd in trigger_commands]
-    searched = get_search_results(trigger_commands, top_num)
+    searched = await get_search_results(trigger_commands, top_num)
 
     results = []
     for item in searched:
@@ -109,19 +109,45 @@ def get_success_commands(command_list):
     return [cmd for cmd in command_list if cmd.get('exit_code', 0) == 0]
 
 
+def generated_query_conditions(recommend_type, error_info):
+    ''' Return the `type` and `errorInformation` conditions used to filter the recommendation items '''
+    cosmos_type = generated_cosmos_type(recommend_type, error_info)
+
+    # If there is an error message, recommend the solution first
+    error_info_arr = []
+    if error_info and need_error_info(recommend_type):
+        error_info_arr = parse_error_info(error_info)
+
+    return cosmos_type, tuple(error_info_arr)
+
+
 def generated_query_kql(command, recommend_type, error_info):
     query = "SELECT * FROM c WHERE c.command = '{}' ".format(command)
 
-    cosmos_type = generated_cosmos_type(recommend_type, error_info)
+    cosmos_type, error_info_arr = generated_query_conditions(recommend_type, error_info)
     if isinstance(cosmos_type, str):
         query += " and c.type in ({}) ".format(cosmos_type)
     elif isinstance(cosmos_type, int):
         query += " and c.type = {} ".format(cosmos_type)
 
-    # If there is an error message, recommend the solution first
-    if error_info and need_error_info(recommend_type):
-        error_info_arr = parse_error_info(error_info)
-        for info in error_info_arr:
-            query += " and CONTAINS(c.errorInformation, '{}', true) ".format(info)
+    for info in error_info_arr:
+        query += " and CONTAINS(c.errorInformation, '{}', true) ".format(info)
 
     return query
+
+
+def match_query_conditions(item, cosmos_type, error_info_arr):
+    ''' Apply the `type` and `errorInformation` conditions of `generated_query_kql` to an item in process '''
+    if isinstance(cosmos_type, str):
+        if item.get('type') not in [int(t) for t in cosmos_type.split(',')]:
+            return False
+    elif isinstance(cosmos_type, int):
+        if item.get('type') != cosmos_type:
+            return False
+
+    error_information = item.get('errorInformation')
+    for info in error_info_arr:
+        if not isinstance(error_information, str) or info.lower() not in error_information.lower():
+            return False
+
+    return True
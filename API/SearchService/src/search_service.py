@@ -1,19 +1,13 @@
-import os
 from typing import List, Optional
 
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-
+from common.search_client import get_scenario_search_client
 from common.util import ScenarioSourceType
 
 
 def get_search_results(
         search_statement: str, source_filter: List[ScenarioSourceType],
         top: int = 5, search_fields: Optional[List[str]] = None):
-    service_endpoint = os.environ["SCENARIO_SEARCH_SERVICE_ENDPOINT"]
-    search_client = SearchClient(endpoint=service_endpoint,
-                                 index_name=os.environ["SCENARIO_SEARCH_INDEX"],
-                                 credential=AzureKeyCredential(os.environ["SCENARIO_SEARCH_SERVICE_SEARCH_KEY"]))
+    search_client = get_scenario_search_client()
 
     filter = " or ".join([f"(source eq {src})" for src in source_filter])
     results = search_client.search(
@@ -1,9 +1,15 @@
 
+import asyncio
 import base64
+import hashlib
+import inspect
 import json
 import logging
 import os
+import threading
+import time
 from functools import wraps
+from typing import Optional
 
 import jwt
 import requests
@@ -11,65 +17,221 @@ from azure.identity import DefaultAzureCredential
 from azure.functions import HttpResponse
 from jwt.algorithms import RSAAlgorithm
 
+from common.cache import LRUCache
+
 logger = logging.getLogger(__name__)
 
 
-def verify_token(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs) -> HttpResponse:
-        token = kwargs['req'].headers.get('Authorization')
-        if not token:
-            return HttpResponse("Authorization token is missing", status_code=401)
-        token = token.replace('Bearer ', '')
-        parts = token.split(".")
-        header = json.loads(base64.b64decode(parts[0] +"==").decode("utf-8")) 
-        payload = json.loads(base64.b64decode(parts[1] +"==").decode("utf-8"))
-        if 'alg' not in header or 'kid' not in header or 'aud' not in payload or ('azp' not in payload and 'appid' not in payload):
-            logger.error("Token is invalid.")
-            return HttpResponse("Token is invalid", status_code=401)
-        alg = header['alg']
-        kid = header['kid']
-        azp = payload['azp'] if 'azp' in payload else payload['appid']
-        aud = payload['aud']
-        if azp not in os.environ["ALLOWED_APP_IDS"].split(','):
-            logger.error("App ID is invalid.")
-            return HttpResponse("App ID is invalid", status_code=401)
+class JWKSCache():
+    """
+    Cache the public keys of AAD by `kid`.
+    The keys are refreshed in the background when they are older than `ttl` seconds,
+    and refreshed immediately when an unknown `kid` is met, at most once every `min_refresh_interval` seconds.
+    """
+
+    def __init__(self, ttl: float = 86400, min_refresh_interval: float = 300) -> None:
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = None
+        self._refreshed_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get_public_key(self, kid):
+        """
+        Returns: the public key of `kid`, or None if it is not found.
+        Raise `ValueError` if JWKS has never been retrieved successfully.
+        """
+        if self._keys is None:
+            self.refresh()
+            if self._keys is None:
+                raise ValueError("Failed to retrieve JWKS")
+        elif time.monotonic() - self._refreshed_at > self.ttl:
+            self._refresh_in_background()
 
+        public_key = self._keys.get(kid)
+        if public_key is None and time.monotonic() - self._refreshed_at > self.min_refresh_interval:
+            # The keys may be rotated, refresh them immediately
+            self.refresh()
+            public_key = self._keys.get(kid)
+        return public_key
+
+    def refresh(self):
         tenant_id = os.environ["MICROSOFT_TENANT_ID"]
         jwks_url = f"https://login.microsoftonline.com/{tenant_id}/discovery/v2.0/keys"
-
-        response = requests.get(jwks_url)
-        if response.status_code == 200:
-            jwks = response.json()
-        else:
-            logger.error("Failed to retrieve JWKS:", response.status_code, response.text)
-            return HttpResponse("Failed to retrieve JWKS", status_code=401)
-
-        # Load AAD's public key from the retrieved key set
-        public_key = None
-        for key in jwks["keys"]:
-            if key["kid"] == kid:
-                public_key = RSAAlgorithm.from_jwk(json.dumps(key))
-                break
-        if public_key is None:
-            logger.error("Failed to retrieve public key from JWKS")
-            return HttpResponse("Failed to retrieve public key from JWKS", status_code=401)
-
-        # Verify the JWT token: expiration, signature
         try:
-            jwt.decode(token, public_key, algorithms=[alg], audience=aud)
-            logger.info("token is valid")
-        except jwt.InvalidTokenError as e:
-            logger.error(f"Token validation failed: {e}")
-            return HttpResponse(f"Token validation failed: {e}", status_code=401)
+            response = requests.get(jwks_url, timeout=float(os.environ.get("JWKS_TIMEOUT", "10")))
+        except requests.RequestException as e:
+            logger.error("Failed to retrieve JWKS: %s", e)
+            return
+        if response.status_code != 200:
+            logger.error("Failed to retrieve JWKS: %s %s", response.status_code, response.text)
+            return
+
+        # Load AAD's public keys from the retrieved key set
+        keys = {}
+        for key in response.json()["keys"]:
+            try:
+                keys[key["kid"]] = RSAAlgorithm.from_jwk(json.dumps(key))
+            except (KeyError, jwt.InvalidKeyError) as e:
+                logger.warning("Failed to load a key from JWKS: %s", e)
+        with self._lock:
+            self._keys = keys
+            self._refreshed_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+jwks_cache = JWKSCache(ttl=float(os.environ.get("JWKS_CACHE_TTL", "86400")))
+# The hashes of the tokens that have been verified, which expire at the same time as the tokens
+verified_token_cache = LRUCache(max_size=int(os.environ.get("VERIFIED_TOKEN_CACHE_MAX_SIZE", "1024")))
+
+
+def verify_token(func):
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs) -> HttpResponse:
+            # The verification may fetch the signing keys with a blocking request, so it doesn't run on the event loop
+            error_response = await asyncio.to_thread(_verify_request, kwargs['req'])
+            if error_response is not None:
+                return error_response
+            return await func(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> HttpResponse:
+        error_response = _verify_request(kwargs['req'])
+        if error_response is not None:
+            return error_response
         return func(*args, **kwargs)
     return wrapper
 
 
+def _verify_request(req) -> Optional[HttpResponse]:
+    """
+    Verify the token in the request
+    Returns: the error response if the token is invalid, otherwise `None`
+    """
+    token = req.headers.get('Authorization')
+    if not token:
+        return HttpResponse("Authorization token is missing", status_code=401)
+    token = token.replace('Bearer ', '')
+    parts = token.split(".")
+    header = json.loads(base64.b64decode(parts[0] +"==").decode("utf-8")) 
+    payload = json.loads(base64.b64decode(parts[1] +"==").decode("utf-8"))
+    if 'alg' not in header or 'kid' not in header or 'aud' not in payload or ('azp' not in payload and 'appid' not in payload):
+        logger.error("Token is invalid.")
+        return HttpResponse("Token is invalid", status_code=401)
+    alg = header['alg']
+    kid = header['kid']
+    azp = payload['azp'] if 'azp' in payload else payload['appid']
+    aud = payload['aud']
+    if azp not in os.environ["ALLOWED_APP_IDS"].split(','):
+        logger.error("App ID is invalid.")
+        return HttpResponse("App ID is invalid", status_code=401)
+
+    # The same token is sent in the following requests of a client, skip the verification until it expires
+    token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    if verified_token_cache.get(token_hash):
+        return None
+
+    try:
+        public_key = jwks_cache.get_public_key(kid)
+    except ValueError:
+        return HttpResponse("Failed to retrieve JWKS", status_code=401)
+    if public_key is None:
+        logger.error("Failed to retrieve public key from JWKS")
+        return HttpResponse("Failed to retrieve public key from JWKS", status_code=401)
+
+    # Verify the JWT token: expiration, signature
+    try:
+        jwt.decode(token, public_key, algorithms=[alg], audience=aud)
+        logger.info("token is valid")
+    except jwt.InvalidTokenError as e:
+        logger.error(f"Token validation failed: {e}")
+        return HttpResponse(f"Token validation failed: {e}", status_code=401)
+    if 'exp' in payload:
+        verified_token_cache.set(token_hash, True, ttl=payload['exp'] - time.time())
+    return None
+
+
+class AccessTokenCache():
+    """
+    Cache the access tokens of a process-wide `DefaultAzureCredential`.
+    A token is refreshed in the background when it will expire in `refresh_margin` seconds,
+    and only one refresh runs at a time for the same scopes.
+    """
+
+    def __init__(self, refresh_margin: float = 300) -> None:
+        self.refresh_margin = refresh_margin
+        self._credential = None
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes: str):
+        token = self._tokens.get(scopes)
+        now = time.time()
+        if token is None or token.expires_on <= now:
+            # No valid token, wait for the refresh
+            with self._get_lock(scopes):
+                token = self._tokens.get(scopes)
+                if token is None or token.expires_on <= time.time():
+                    token = self._refresh(scopes)
+        elif token.expires_on - self.refresh_margin <= now:
+            self._refresh_in_background(scopes)
+        return token
+
+    def _get_credential(self):
+        with self._lock:
+            if self._credential is None:
+                self._credential = DefaultAzureCredential()
+            return self._credential
+
+    def _get_lock(self, scopes):
+        with self._lock:
+            return self._locks.setdefault(scopes, threading.Lock())
+
+    def _refresh(self, scopes):
+        token = self._get_credential().get_token(*scopes)
+        self._tokens[scopes] = token
+        return token
+
+    def _refresh_in_background(self, scopes):
+        lock = self._get_lock(scopes)
+        if not lock.acquire(blocking=False):
+            # Another request is refreshing the token
+            return
+
+        def refresh():
+            try:
+                self._refresh(scopes)
+            except Exception as e:
+                logger.warning("Failed to refresh auth token: %s", e)
+            finally:
+                lock.release()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+access_token_cache = AccessTokenCache(refresh_margin=float(os.environ.get("AUTH_TOKEN_REFRESH_MARGIN", "300")))
+
+
 def _get_auth_token(*scopes: str):
     try:
-        credential = DefaultAzureCredential()
-        token = credential.get_token(*scopes)
+        token = access_token_cache.get_token(*scopes)
         token = "Bearer " + token.token
         return token
     except Exception as e:
@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import traceback
@@ -20,6 +21,7 @@ class DependencyCall():
     endTime = 0
     duration = 0
     usage = None
+    metrics = None
     exception = None
     telemetryClient = None
     tracer = None
@@ -44,6 +46,7 @@ class DependencyCall():
             "endTime": self.endTime.strftime("%Y-%m-%d %H:%M:%S.%f"),
             "duration": self.duration,
             "usage": self.usage,
+            "metrics": self.metrics,
             "exception": self.exception,
         }
 
@@ -63,14 +66,41 @@ class ContextStatistics():
         }
 
 
+def load_openai_deployments():
+    """
+    Load the pool of Azure OpenAI deployments from the environment variable `OPENAI_DEPLOYMENTS`, e.g.
+    [{"name": "eastus", "apiUrl": "https://eastus.openai.azure.com/", "apiKey": "...", "gptEngine": "GPT_4_32k", "weight": 2, "tpm": 120000, "rpm": 720}]
+    `apiVersion` and `gptEngine` are optional, `weight` is 1 by default, and `tpm`/`rpm` are the quotas of the deployment (0 means no limit).
+    The single deployment of `OPENAI_API_URL` is used if it is not set.
+    """
+    deployments = json.loads(os.environ.get("OPENAI_DEPLOYMENTS") or "[]")
+    if not deployments:
+        deployments = [{
+            "name": "default",
+            "apiUrl": os.environ.get("OPENAI_API_URL"),
+            "apiKey": os.environ.get("OPENAI_API_KEY"),
+            "tpm": float(os.environ.get("OPENAI_TPM_LIMIT", "0")),
+            "rpm": float(os.environ.get("OPENAI_RPM_LIMIT", "0")),
+        }]
+    for idx, deployment in enumerate(deployments):
+        deployment.setdefault("name", f"deployment-{idx}")
+        deployment.setdefault("apiVersion", os.environ.get("OPENAI_API_VERSION"))
+        deployment.setdefault("gptEngine", None)
+        deployment.setdefault("weight", 1)
+        deployment.setdefault("tpm", 0)
+        deployment.setdefault("rpm", 0)
+    return deployments
+
+
 class OpenAIConfig():
     apiUrl: str  # API url for the Azure OpenAI instance
     apiVersion: str  # API version for the Azure OpenAI
     apiKey: str  # API key for the Azure OpenAI
     gptEngine: str  # GPT engine for the Azure OpenAI model
     embeddingUrl: str  # Embedding url for the Azure OpenAI model
+    deployments: list  # The pool of Azure OpenAI deployments that the GPT calls are routed to
 
-    def __init__(self, apiUrl: str = None, apiVersion: str = None, apiKey: str = None, gptEngine: str = None, embeddingUrl: str = None) -> None:
+    def __init__(self, apiUrl: str = None, apiVersion: str = None, apiKey: str = None, gptEngine: str = None, embeddingUrl: str = None, deployments: list = None) -> None:
         if (apiUrl is None):
             self.apiUrl = os.environ.get("OPENAI_API_URL")
         else:
@@ -91,13 +121,18 @@ class OpenAIConfig():
             self.embeddingUrl = os.environ.get("EMBEDDING_MODEL_URL")
         else:
             self.embeddingUrl = embeddingUrl
+        if (deployments is None):
+            self.deployments = load_openai_deployments()
+        else:
+            self.deployments = deployments
         
     def toDict(self):
         return {
             "apiUrl": self.apiUrl,
             "apiVersion": self.apiVersion,
             "gptEngine": self.gptEngine,
-            "embeddingUrl": self.embeddingUrl
+            "embeddingUrl": self.embeddingUrl,
+            "deployments": [deployment["name"] for deployment in self.deployments]
         }
 
 
@@ -134,11 +169,14 @@ class Context():
                     'completion_tokens': 0,
                     'prompt_tokens': 0,
                     'total_tokens': 0,
+                    'saved_tokens': 0,
                 }
             modelUsage = totalUsage[model]
             modelUsage['completion_tokens'] += usage.get('completion_tokens', 0)
             modelUsage['prompt_tokens'] += usage.get('prompt_tokens', 0)
             modelUsage['total_tokens'] += usage.get('total_tokens', 0)
+            # The tokens that are not consumed since the response is cached
+            modelUsage['saved_tokens'] += usage.get('saved_tokens', 0)
         self.originalCall.usage = totalUsage
 
     def toDict(self):
@@ -168,6 +206,7 @@ def log_dependency_call(callName):
                     response = func(*args, **kwargs)
                     if 'usage' in response:
                         dependencyCall.usage = response['usage']
+                        dependencyCall.metrics = response.get('metrics')
                         for key, value in response['usage'].items():
                             span.add_attribute(f"{key}", value)
                         response = response['content']
@@ -199,6 +238,7 @@ def log_dependency_call_async(callName):
                     response = await func(*args, **kwargs)
                     if 'usage' in response:
                         dependencyCall.usage = response['usage']
+                        dependencyCall.metrics = response.get('metrics')
                         for key, value in response['usage'].items():
                             span.add_attribute(f"{key}", value)
                         response = response['content']
@@ -0,0 +1,83 @@
+import math
+from typing import Callable, Dict, List
+
+# The fractions of optional parameters kept in the trimmed variants of a chunk
+TRIM_LEVELS = (1, 0.5, 0.25, 0)
+
+
+def pack_chunks(chunks: List[Dict], token_limit: float, count_tokens: Callable[[Dict], int], max_units: int = 1000) -> List[Dict]:
+    """
+    Select the subset of chunks with the highest total score under the token limit (a group knapsack problem).
+    A chunk can be selected as is, or with part of its optional parameters trimmed, which is worth less.
+    Args:
+        chunks: scored chunks, e.g. the output of `merge_chunks_by_command` or `filter_chunks_by_keyword_similarity`.
+                A chunk without a score, e.g. the output of `retrieve_chunk_for_command`, is matched by the exact command,
+                and it is worth as much as the best scored chunk
+        token_limit: the number of tokens that the selected chunks can take
+        count_tokens: the function to count the tokens of a chunk when it is added to the context
+        max_units: the token limit is divided into at most `max_units` units to bound the cost of the knapsack
+    Returns: the selected chunks in their original order
+    """
+    if not chunks or token_limit <= 0:
+        return []
+
+    # Token costs are rounded up to units, so the selected chunks never exceed the limit
+    unit = max(1, math.ceil(token_limit / max_units))
+    capacity = int(token_limit // unit)
+
+    default_score = max((chunk['score'] for chunk in chunks if 'score' in chunk), default=1)
+    variants_list = []
+    for chunk in chunks:
+        variants = []
+        for variant, value in _build_chunk_variants(chunk, chunk.get('score', default_score)):
+            cost = math.ceil(count_tokens(variant) / unit)
+            if cost <= capacity:
+                variants.append((variant, value, cost))
+        variants_list.append(variants)
+
+    # best[c] is the highest total score within cost c, choices[i][c] is the variant of chunk i selected for it
+    best = [0.0] * (capacity + 1)
+    choices = []
+    for variants in variants_list:
+        new_best = best[:]
+        choice = [-1] * (capacity + 1)
+        for idx, (_, value, cost) in enumerate(variants):
+            for c in range(cost, capacity + 1):
+                if best[c - cost] + value > new_best[c]:
+                    new_best[c] = best[c - cost] + value
+                    choice[c] = idx
+        best = new_best
+        choices.append(choice)
+
+    selected = []
+    c = capacity
+    for i in range(len(chunks) - 1, -1, -1):
+        idx = choices[i][c]
+        if idx >= 0:
+            variant, _, cost = variants_list[i][idx]
+            selected.append(variant)
+            c -= cost
+    selected.reverse()
+    return selected
+
+
+def _build_chunk_variants(chunk, score):
+    optional_params = chunk.get('optional parameters', [])
+    if not optional_params:
+        return [(chunk, score)]
+
+    # Trim the parameters that are least related to the command first
+    ranked_params = sorted(optional_params, key=lambda p: p.get('score', 0), reverse=True)
+    variants = []
+    kept_nums = sorted({math.ceil(len(optional_params) * level) for level in TRIM_LEVELS}, reverse=True)
+    for kept_num in kept_nums:
+        if kept_num == len(optional_params):
+            variant = chunk
+        else:
+            kept_param_ids = {id(p) for p in ranked_params[:kept_num]}
+            variant = chunk.copy()
+            variant['optional parameters'] = [p for p in optional_params if id(p) in kept_param_ids]
+        # A trimmed chunk keeps at least half of its value, because the summary and required parameters are kept
+        value = score * (0.5 + 0.5 * kept_num / len(optional_params))
+        variants.append((variant, value))
+    return variants
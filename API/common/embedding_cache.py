@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from typing import List, Optional
+
+from common.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# The cache statistics of the current request, which are reported to the telemetry of the request
+_request_statistics = contextvars.ContextVar('embedding_cache_statistics', default=None)
+
+
+class EmbeddingCache():
+    """
+    Cache the embedding vectors by the hash of the normalized text and the embedding model url.
+    The vectors are stored as float32 in an in-memory LRU cache, backed by a SQLite database on the local disk.
+    The database is opened on the first use. The reads of `get_async` run in a thread, and the writes are queued
+    and committed in batches by a writer thread, so the disk is never accessed on the event loop.
+    Args:
+        max_size: the maximum number of vectors kept in memory
+        path: the path of the SQLite database, the vectors are only cached in memory if it is `None`
+        max_disk_size: the maximum number of vectors kept in the SQLite database
+    """
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, max_size: int = 4096, path: Optional[str] = None, max_disk_size: int = 100000) -> None:
+        self._memory = LRUCache(max_size=max_size)
+        self._path = path
+        self._max_disk_size = max_disk_size
+        self._db = None
+        self._lock = threading.Lock()
+        self._inserts = 0
+        # key -> (vector bytes, update time) of the vectors that are not written yet
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._writer = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def build_key(text: str, model_url: str) -> str:
+        normalized_text = ' '.join(str(text).split())
+        return hashlib.sha256(f'{model_url}\n{normalized_text}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        start = time.monotonic()
+        vector = self._memory.get(key)
+        if vector is None:
+            vector = self._read_disk(key)
+        self._record(vector is not None, time.monotonic() - start)
+        return vector.tolist() if vector is not None else None
+
+    async def get_async(self, key: str) -> Optional[List[float]]:
+        start = time.monotonic()
+        vector = self._memory.get(key)
+        if vector is None and self._path:
+            vector = await asyncio.to_thread(self._read_disk, key)
+        self._record(vector is not None, time.monotonic() - start)
+        return vector.tolist() if vector is not None else None
+
+    def set(self, key: str, vector: List[float]) -> None:
+        vector = array('f', vector)
+        self._memory.set(key, vector)
+        if not self._path:
+            return
+        with self._pending_lock:
+            self._pending[key] = (vector.tobytes(), time.time())
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name='EmbeddingCacheWriter', daemon=True)
+                self._writer.start()
+
+    def flush(self) -> None:
+        """
+        Wait until the queued vectors are written to the database
+        """
+        writer = self._writer
+        if writer is not None:
+            writer.join()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hitRate": self.hits / total if total else 0.0}
+
+    def _connect(self):
+        # It is called with `self._lock`
+        if self._db is None and self._path:
+            try:
+                self._db = sqlite3.connect(self._path, check_same_thread=False)
+                self._db.execute('CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB, update_time REAL)')
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning('Failed to open the embedding cache database %s: %s', self._path, e)
+                # The vectors are only cached in memory from now on
+                self._path = None
+                self._db = None
+        return self._db
+
+    def _read_disk(self, key):
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            row = pending
+        else:
+            with self._lock:
+                db = self._connect()
+                if db is None:
+                    return None
+                try:
+                    row = db.execute('SELECT vector FROM embedding WHERE key = ?', (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning('Failed to read the embedding cache: %s', e)
+                    row = None
+        if not row:
+            return None
+        vector = array('f')
+        vector.frombytes(row[0])
+        self._memory.set(key, vector)
+        return vector
+
+    def _write_pending(self):
+        while True:
+            with self._pending_lock:
+                pending = list(self._pending.items())
+                if not pending:
+                    self._writer = None
+                    return
+            with self._lock:
+                db = self._connect()
+                try:
+                    if db is not None:
+                        db.executemany('INSERT OR REPLACE INTO embedding (key, vector, update_time) VALUES (?, ?, ?)',
+                                       [(key, vector, update_time) for key, (vector, update_time) in pending])
+                        previous_inserts = self._inserts
+                        self._inserts += len(pending)
+                        if self._inserts // self.PRUNE_INTERVAL != previous_inserts // self.PRUNE_INTERVAL:
+                            db.execute('DELETE FROM embedding WHERE key IN '
+                                       '(SELECT key FROM embedding ORDER BY update_time DESC LIMIT -1 OFFSET ?)',
+                                       (self._max_disk_size,))
+                        db.commit()
+                except sqlite3.Error as e:
+                    logger.warning('Failed to write the embedding cache: %s', e)
+            with self._pending_lock:
+                for key, value in pending:
+                    if self._pending.get(key) is value:
+                        del self._pending[key]
+
+    def _record(self, hit: bool, seconds: float):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        request_statistics = _request_statistics.get()
+        if request_statistics is not None:
+            request_statistics["hits" if hit else "misses"] += 1
+            request_statistics["lookupSeconds"] += seconds
+
+
+def start_request_statistics() -> dict:
+    """
+    Count the cache hits and misses of the current request (and the tasks created from it)
+    Returns: the dict of the cache statistics, which is updated in place
+    """
+    request_statistics = {"hits": 0, "misses": 0, "lookupSeconds": 0.0}
+    _request_statistics.set(request_statistics)
+    return request_statistics
+
+
+def _build_embedding_cache():
+    if os.environ.get("ENABLE_EMBEDDING_CACHE", "true").lower() != "true":
+        return None
+    path = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "embedding_cache.sqlite3"))
+    return EmbeddingCache(max_size=int(os.environ.get("EMBEDDING_CACHE_MAX_SIZE", "4096")),
+                          path=path or None,
+                          max_disk_size=int(os.environ.get("EMBEDDING_CACHE_MAX_DISK_SIZE", "100000")))
+
+
+embedding_cache = _build_embedding_cache()
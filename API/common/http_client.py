@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# The replaced async clients may be still used by the in-flight requests, so they are closed after this delay
+ASYNC_CLIENT_CLOSE_DELAY = 60
+# The replaced async clients and the deadlines to close them, they are referenced until they are closed
+_retired_clients = []
+_closing_tasks = set()
+
+# The async http client is shared by all the requests of the worker, so that the connections are kept alive and reused.
+# Its connections are bound to the event loop where they are created, so a new client is created when the loop changes.
+_client_loop = None
+_client = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        if _client is not None and not _client.is_closed:
+            retire_async_client(_client_loop, _client.aclose)
+        limits = httpx.Limits(max_connections=int(os.environ.get("HTTP_CLIENT_MAX_CONNECTIONS", "100")),
+                              max_keepalive_connections=int(os.environ.get("HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", "20")),
+                              keepalive_expiry=float(os.environ.get("HTTP_CLIENT_KEEPALIVE_EXPIRY", "60")))
+        _client = httpx.AsyncClient(http2=os.environ.get("HTTP_CLIENT_ENABLE_HTTP2", "true").lower() == "true", limits=limits)
+        _client_loop = loop
+    return _client
+
+
+def retire_async_client(loop: asyncio.AbstractEventLoop, close: Callable[[], Awaitable], delay: float = None) -> None:
+    """
+    Close a replaced async client after a delay, so that the requests that are still using it can finish.
+    Args:
+        loop: the event loop where the client is created, the client is closed in it if it is still running
+        close: the close method of the client
+        delay: the delay in seconds, `ASYNC_CLIENT_CLOSE_DELAY` by default
+    """
+    delay = ASYNC_CLIENT_CLOSE_DELAY if delay is None else delay
+    entry = (time.monotonic() + delay, close)
+    _retired_clients.append(entry)
+    current_loop = asyncio.get_running_loop()
+    if loop is current_loop or loop.is_closed() or not loop.is_running():
+        # The connections of a stopped loop can't be used any more, so the client is closed in the current loop as soon as possible
+        current_loop.call_later(delay if loop is current_loop else 0, _close_retired_client, entry)
+    else:
+        # The loop is running in another thread
+        loop.call_soon_threadsafe(loop.call_later, delay, _close_retired_client, entry)
+
+
+def _close_retired_client(entry):
+    _retired_clients.remove(entry)
+    task = asyncio.get_running_loop().create_task(entry[1]())
+    # The loop only keeps a weak reference to the task
+    _closing_tasks.add(task)
+    task.add_done_callback(_on_client_closed)
+
+
+def _on_client_closed(task):
+    _closing_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('Failed to close the replaced async client: %s', task.exception())
+
+
+def get_timeout(env_key: str, default: float = 10) -> httpx.Timeout:
+    """
+    Get the timeout of an endpoint from the environment variable `env_key`
+    """
+    return httpx.Timeout(float(os.environ.get(env_key, default)))
@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.context import load_openai_deployments
+from openai.error import APIConnectionError, APIError, RateLimitError, ServiceUnavailableError, Timeout, TryAgain
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket():
+    """
+    A token bucket that is refilled at `rate_per_minute`, and holds at most `capacity` tokens.
+    A reservation is always granted, and the caller should wait for the returned seconds before sending the request,
+    so the requests are spread out instead of being rejected.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+            self._last_refill = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_second
+
+
+class RateLimiter():
+    """
+    Limit the tokens per minute (TPM) and the requests per minute (RPM) sent to a deployment, `0` means no limit
+    """
+
+    def __init__(self, tokens_per_minute: float = 0, requests_per_minute: float = 0) -> None:
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+
+    def reserve(self, tokens: float) -> float:
+        """
+        Returns: the seconds to wait before the request can be sent
+        """
+        delay = 0.0
+        if self._token_bucket:
+            delay = max(delay, self._token_bucket.reserve(tokens))
+        if self._request_bucket:
+            delay = max(delay, self._request_bucket.reserve(1))
+        return delay
+
+
+class RetryPolicy():
+    """
+    Retry the transient errors with exponential backoff and full jitter, and honor the `Retry-After` header of the response.
+    The backoff and the `Retry-After` only apply to the same deployment, a healthy alternative is retried after a small jitter.
+    """
+    def __init__(self, max_retries: int = 3, base_delay: float = 1, max_delay: float = 30, failover_jitter: float = 0.1) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failover_jitter = failover_jitter
+
+    def get_delay(self, attempt: int, error: Exception, failover: bool = False) -> Optional[float]:
+        """
+        Args:
+            failover: whether the next attempt goes to another healthy deployment
+        Returns: the seconds to wait before the next attempt, or `None` if the error should not be retried
+        """
+        if attempt >= self.max_retries or not self.is_retryable(error):
+            return None
+        if failover:
+            return random.uniform(0, self.failover_jitter)
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _get_retry_after(error)
+        if retry_after is None:
+            return backoff
+        if retry_after > self.max_delay:
+            return None
+        # The jitter prevents the throttled requests from being retried at the same time
+        return retry_after + random.uniform(0, self.base_delay)
+
+    def is_retryable(self, error: Exception) -> bool:
+        return _is_unhealthy(error)
+
+
+class LatencyTracker():
+    """
+    Track the latencies of the recent successful calls
+    """
+
+    def __init__(self, window: int = 100, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Returns: the latency at the percentile, or `None` if there are not enough samples
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+class Deployment():
+    """
+    An Azure OpenAI deployment in the pool, with its quota and the statistics for routing
+    """
+
+    def __init__(self, name: str, api_url: str, api_key: str, api_version: Optional[str] = None, gpt_engine: Optional[str] = None,
+                 weight: float = 1, tpm: float = 0, rpm: float = 0) -> None:
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+        self.api_version = api_version
+        self.gpt_engine = gpt_engine
+        self.weight = weight
+        self.rate_limiter = RateLimiter(tokens_per_minute=tpm, requests_per_minute=rpm)
+        self.in_flight = 0
+        # The exponentially weighted moving average of the latencies, `None` until the first successful call
+        self.latency = None
+        self.ejected_until = 0.0
+
+    def build_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        params = dict(params, api_type="azure", api_base=self.api_url, api_key=self.api_key, api_version=self.api_version)
+        if self.gpt_engine:
+            params["engine"] = self.gpt_engine
+        return params
+
+
+class DeploymentRouter():
+    """
+    Route each call to the healthy deployment with the least load, which is estimated by the in-flight calls,
+    the recent latency and the weight of the deployment.
+    A deployment is ejected for `eject_seconds` (or the `Retry-After` of the response) when it is throttled or unavailable.
+    """
+
+    def __init__(self, deployments: List[Deployment], eject_seconds: float = 30, ewma_alpha: float = 0.2) -> None:
+        self.deployments = deployments
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+
+    def select(self, exclude=()) -> Deployment:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [d for d in self.deployments if d not in exclude] or self.deployments
+            healthy = [d for d in candidates if d.ejected_until <= now]
+            if not healthy:
+                # All the deployments are ejected, try the one that recovers first
+                return min(candidates, key=lambda d: d.ejected_until)
+            default_latency = min((d.latency for d in healthy if d.latency is not None), default=1.0)
+            return min(healthy, key=lambda d: (d.in_flight + 1) * (d.latency or default_latency) / d.weight)
+
+    def has_healthy(self, exclude=()) -> bool:
+        """
+        Returns: whether any deployment that is not excluded is healthy
+        """
+        with self._lock:
+            now = time.monotonic()
+            return any(d not in exclude and d.ejected_until <= now for d in self.deployments)
+
+    def start(self, deployment: Deployment) -> None:
+        with self._lock:
+            deployment.in_flight += 1
+
+    def end(self, deployment: Deployment, latency: float, error: Optional[Exception] = None, cancelled: bool = False) -> None:
+        with self._lock:
+            deployment.in_flight -= 1
+            if cancelled:
+                # The latency of a cancelled call is unknown
+                return
+            if error is None:
+                deployment.latency = latency if deployment.latency is None \
+                    else self.ewma_alpha * latency + (1 - self.ewma_alpha) * deployment.latency
+            elif _is_unhealthy(error):
+                eject_seconds = max(self.eject_seconds, _get_retry_after(error) or 0)
+                deployment.ejected_until = time.monotonic() + eject_seconds
+                logger.warning('Deployment %s is ejected for %.2f seconds due to %s', deployment.name, eject_seconds, type(error).__name__)
+
+
+def call_openai(create: Callable, params: Dict[str, Any], estimated_tokens: int) -> Tuple[Any, List[Dict]]:
+    """
+    Call OpenAI with routing, rate limiting and retries
+    Args:
+        create: the OpenAI API, e.g. `openai.ChatCompletion.create`
+        params: the params of the API
+        estimated_tokens: the estimated tokens consumed by the call, which are reserved in the rate limiter of the deployment
+    Returns: A tuple. The first element is the response and the second element is the timings of each attempt.
+    """
+    attempts = []
+    failed_deployments = set()
+    for attempt in range(retry_policy.max_retries + 1):
+        deployment = deployment_router.select(exclude=failed_deployments)
+        throttle = deployment.rate_limiter.reserve(estimated_tokens)
+        if throttle:
+            time.sleep(throttle)
+        deployment_params = deployment.build_params(params)
+        record = _start_attempt(attempts, deployment, deployment_params, throttle)
+        try:
+            response = create(**deployment_params)
+        except Exception as e:
+            _end_attempt(record, deployment, e)
+            failed_deployments.add(deployment)
+            delay = retry_policy.get_delay(attempt, e, failover=deployment_router.has_healthy(exclude=failed_deployments))
+            if delay is None:
+                raise
+            logger.warning('OpenAI call failed with %s, retry in %.2f seconds', type(e).__name__, delay)
+            time.sleep(delay)
+            continue
+        _end_attempt(record, deployment)
+        latency_tracker.record(record["duration"])
+        return response, attempts
+
+
+async def call_openai_async(acreate: Callable, params: Dict[str, Any], estimated_tokens: int, hedge: bool = True) -> Tuple[Any, List[Dict]]:
+    """
+    The same as `call_openai`, and the call is hedged to another deployment (or `OPENAI_HEDGE_ENGINE`)
+    if it is slower than the recent calls
+    """
+    attempts = []
+    failed_deployments = set()
+    for attempt in range(retry_policy.max_retries + 1):
+        deployment = deployment_router.select(exclude=failed_deployments)
+        throttle = deployment.rate_limiter.reserve(estimated_tokens)
+        if throttle:
+            await asyncio.sleep(throttle)
+        try:
+            return await _call_with_hedging(acreate, params, deployment, attempts, throttle, hedge, estimated_tokens), attempts
+        except Exception as e:
+            failed_deployments.add(deployment)
+            delay = retry_policy.get_delay(attempt, e, failover=deployment_router.has_healthy(exclude=failed_deployments))
+            if delay is None:
+                raise
+            logger.warning('OpenAI call failed with %s, retry in %.2f seconds', type(e).__name__, delay)
+            await asyncio.sleep(delay)
+
+
+async def _call_with_hedging(acreate, params, deployment, attempts, throttle, hedge, estimated_tokens):
+    tasks = {asyncio.create_task(_timed_call(acreate, deployment.build_params(params), deployment, attempts, throttle))}
+    try:
+        hedge_target = _get_hedge_target(params, deployment) if hedge else None
+        hedge_delay = latency_tracker.percentile(hedge_percentile) if hedge_target else None
+        done, pending = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            hedge_deployment, hedge_params = hedge_target
+            logger.info('OpenAI call is slower than %.2f seconds, hedge to %s %s', hedge_delay, hedge_deployment.name, hedge_params["engine"])
+            hedge_throttle = hedge_deployment.rate_limiter.reserve(estimated_tokens)
+            pending.add(asyncio.create_task(_timed_call(acreate, hedge_params, hedge_deployment, attempts, hedge_throttle, hedged=True)))
+            tasks |= pending
+
+        # The first successful response wins, and the error is only raised when all the calls fail
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _get_hedge_target(params, deployment):
+    """
+    Hedge to another deployment in the pool, or to `OPENAI_HEDGE_ENGINE` if there is only one deployment
+    Returns: A tuple of the deployment and the params, or `None` if the call can't be hedged
+    """
+    hedge_deployment = deployment_router.select(exclude={deployment})
+    if hedge_deployment is not deployment:
+        return hedge_deployment, hedge_deployment.build_params(params)
+    hedge_engine = os.environ.get("OPENAI_HEDGE_ENGINE")
+    if hedge_engine:
+        return deployment, dict(deployment.build_params(params), engine=hedge_engine)
+    return None
+
+
+async def _timed_call(acreate, params, deployment, attempts, throttle, hedged=False):
+    if hedged and throttle:
+        await asyncio.sleep(throttle)
+    record = _start_attempt(attempts, deployment, params, throttle, hedged)
+    try:
+        response = await acreate(**params)
+    except asyncio.CancelledError:
+        _end_attempt(record, deployment, cancelled=True)
+        raise
+    except Exception as e:
+        _end_attempt(record, deployment, e)
+        raise
+    _end_attempt(record, deployment)
+    if not hedged:
+        latency_tracker.record(record["duration"])
+    return response
+
+
+def _start_attempt(attempts, deployment, params, throttle, hedged=False):
+    deployment_router.start(deployment)
+    record = {"deployment": deployment.name, "engine": params["engine"], "throttle": throttle, "hedged": hedged, "start": time.monotonic()}
+    attempts.append(record)
+    return record
+
+
+def _end_attempt(record, deployment, error=None, cancelled=False):
+    record["duration"] = time.monotonic() - record.pop("start")
+    record["result"] = "cancelled" if cancelled else (type(error).__name__ if error else "success")
+    deployment_router.end(deployment, record["duration"], error, cancelled)
+
+
+def _is_unhealthy(error):
+    if isinstance(error, (RateLimitError, Timeout, TryAgain, APIConnectionError, ServiceUnavailableError)):
+        return True
+    return isinstance(error, APIError) and error.http_status is not None and error.http_status >= 500
+
+
+def _get_retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after-ms")
+    if retry_after is not None:
+        try:
+            return float(retry_after) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(retry_after) if retry_after is not None else None
+    except ValueError:
+        return None
+
+
+deployment_router = DeploymentRouter([Deployment(name=d["name"], api_url=d["apiUrl"], api_key=d["apiKey"], api_version=d["apiVersion"],
+                                                  gpt_engine=d["gptEngine"], weight=d["weight"], tpm=d["tpm"], rpm=d["rpm"])
+                                       for d in load_openai_deployments()],
+                                      eject_seconds=float(os.environ.get("OPENAI_DEPLOYMENT_EJECT_SECONDS", "30")))
+retry_policy = RetryPolicy(max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", "3")),
+                           base_delay=float(os.environ.get("OPENAI_RETRY_BASE_DELAY", "1")),
+                           max_delay=float(os.environ.get("OPENAI_RETRY_MAX_DELAY", "30")))
+latency_tracker = LatencyTracker(window=int(os.environ.get("OPENAI_LATENCY_WINDOW", "100")))
+hedge_percentile = float(os.environ.get("OPENAI_HEDGE_PERCENTILE", "0.95"))
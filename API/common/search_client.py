@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import threading
+
+import aiohttp
+import requests
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
+from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+from common.http_client import retire_async_client
+
+logger = logging.getLogger(__name__)
+
+# Search clients are shared by all the requests of the worker, so that the TLS connections are kept alive and reused.
+# The clients are keyed by the endpoint and index, and they are replaced when the key is rotated.
+# (endpoint, index_name) -> (key, search_client)
+_search_clients = {}
+# (endpoint, index_name) -> (loop, key, search_client)
+_async_search_clients = {}
+_lock = threading.Lock()
+
+
+def _get_pool_size():
+    return int(os.environ.get("SEARCH_CLIENT_POOL_SIZE", "10"))
+
+
+def get_search_client(endpoint: str, index_name: str, key: str) -> SearchClient:
+    client_key = (endpoint, index_name)
+    with _lock:
+        search_client_key, search_client = _search_clients.get(client_key, (None, None))
+        if search_client is None or search_client_key != key:
+            # The replaced client may be still used by other threads, and its session is closed when it is released
+            pool_size = _get_pool_size()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            search_client = SearchClient(endpoint=endpoint,
+                                         index_name=index_name,
+                                         credential=AzureKeyCredential(key),
+                                         transport=RequestsTransport(session=session, session_owner=False))
+            _search_clients[client_key] = (key, search_client)
+    return search_client
+
+
+def get_async_search_client(endpoint: str, index_name: str, key: str) -> AsyncSearchClient:
+    # The connections of an async client are bound to the event loop where they are created
+    loop = asyncio.get_running_loop()
+    client_key = (endpoint, index_name)
+    entry = _async_search_clients.get(client_key)
+    if entry is not None and entry[0] is loop and entry[1] == key:
+        return entry[2]
+
+    if entry is not None:
+        retire_async_client(entry[0], entry[2].close)
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=_get_pool_size()))
+    search_client = AsyncSearchClient(endpoint=endpoint,
+                                      index_name=index_name,
+                                      credential=AzureKeyCredential(key),
+                                      transport=AioHttpTransport(session=session, session_owner=True))
+    _async_search_clients[client_key] = (loop, key, search_client)
+    return search_client
+
+
+def get_scenario_search_client() -> SearchClient:
+    return get_search_client(os.environ["SCENARIO_SEARCH_SERVICE_ENDPOINT"],
+                             os.environ["SCENARIO_SEARCH_INDEX"],
+                             os.environ["SCENARIO_SEARCH_SERVICE_SEARCH_KEY"])
+
+
+def get_async_scenario_search_client() -> AsyncSearchClient:
+    return get_async_search_client(os.environ["SCENARIO_SEARCH_SERVICE_ENDPOINT"],
+                                   os.environ["SCENARIO_SEARCH_INDEX"],
+                                   os.environ["SCENARIO_SEARCH_SERVICE_SEARCH_KEY"])
+
+
+def warm_up_search_clients():
+    """
+    Create the shared synchronous scenario search client and send a light request to establish the connection,
+    so that the first request after a cold start does not pay for the TLS handshake.
+    Only the services that use the synchronous client (e.g. SearchService) need it, the async client is bound to the loop of the requests.
+    """
+    try:
+        get_scenario_search_client().get_document_count()
+        logger.info('Search client is warmed up.')
+    except Exception as e:
+        logger.warning('Failed to warm up search client: %s', e)
+
+
+def start_warm_up_search_clients():
+    if os.environ.get("ENABLE_SEARCH_CLIENT_WARM_UP", "true").lower() == "true":
+        threading.Thread(target=warm_up_search_clients, daemon=True).start()
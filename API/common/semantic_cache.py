@@ -0,0 +1,151 @@
+import copy
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache():
+    """
+    Cache the responses by the embedding vectors of the questions.
+    A response is hit when the cosine similarity between the questions is not less than the threshold.
+    The vectors are kept in a preallocated NumPy matrix, so a lookup is a single matrix-vector product.
+    Args:
+        threshold: the minimum cosine similarity for a question to hit a cached response
+        max_size: the maximum number of responses kept in the cache, the least recently used response is evicted first
+        ttl: the time to live of a response in seconds, `None` means responses never expire
+    """
+
+    def __init__(self, threshold: float = 0.95, max_size: int = 1024, ttl: Optional[float] = 3600) -> None:
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._vectors = None
+        # The namespace id of each slot, -1 means the slot is free
+        self._slot_namespaces = np.full(max_size, -1, dtype=np.int32)
+        # slot -> (response, expires_at), ordered from the least recently used
+        self._entries = OrderedDict()
+        self._namespace_ids = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: Hashable, vector: List[float]) -> Any:
+        """
+        Get the response of the most similar question in the namespace
+        Returns: a copy of the cached response, or `None` if no question is similar enough
+        """
+        query = self._normalize(vector)
+        with self._lock:
+            slot, similarity = self._search(namespace, query)
+            if slot is not None and similarity >= self.threshold:
+                response, expires_at = self._entries[slot]
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    logger.info('Semantic cache hit with similarity %.4f', similarity)
+                    return copy.deepcopy(response)
+                self._free(slot)
+            self.misses += 1
+            return None
+
+    def set(self, namespace: Hashable, vector: List[float], response: Any) -> None:
+        if self.max_size <= 0:
+            return
+        vector = self._normalize(vector)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                # The embedding model is changed, the cached vectors can't be compared with the new ones
+                self._vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self._slot_namespaces.fill(-1)
+                self._entries.clear()
+
+            # Replace the response of the same question instead of storing a duplicated vector
+            slot, similarity = self._search(namespace, vector)
+            if slot is None or similarity < self.threshold:
+                slot = self._allocate()
+            self._vectors[slot] = vector
+            self._slot_namespaces[slot] = self._get_namespace_id(namespace)
+            self._entries[slot] = (copy.deepcopy(response), expires_at)
+            self._entries.move_to_end(slot)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._slot_namespaces.fill(-1)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _search(self, namespace, query):
+        namespace_id = self._namespace_ids.get(namespace)
+        if namespace_id is None or self._vectors is None or self._vectors.shape[1] != len(query):
+            return None, 0.0
+        similarities = self._vectors @ query
+        similarities[self._slot_namespaces != namespace_id] = -np.inf
+        slot = int(np.argmax(similarities))
+        if similarities[slot] == -np.inf:
+            return None, 0.0
+        return slot, float(similarities[slot])
+
+    def _allocate(self):
+        free_slots = np.flatnonzero(self._slot_namespaces == -1)
+        if len(free_slots):
+            return int(free_slots[0])
+        slot, _ = self._entries.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def _free(self, slot):
+        self._slot_namespaces[slot] = -1
+        self._entries.pop(slot, None)
+
+    def _get_namespace_id(self, namespace):
+        if namespace not in self._namespace_ids:
+            self._namespace_ids[namespace] = len(self._namespace_ids)
+        return self._namespace_ids[namespace]
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def get_prompt_version(*prompts: str) -> str:
+    """
+    Get the version of the prompts, so that the responses generated by the previous prompts are not hit any more
+    """
+    content = '\n'.join([os.environ.get("SEMANTIC_CACHE_VERSION", "")] + list(prompts))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def _build_semantic_cache():
+    if os.environ.get("ENABLE_SEMANTIC_CACHE", "false").lower() != "true":
+        return None
+    return SemanticCache(threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                         max_size=int(os.environ.get("SEMANTIC_CACHE_MAX_SIZE", "1024")),
+                         ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", "3600")))
+
+
+semantic_cache = _build_semantic_cache()
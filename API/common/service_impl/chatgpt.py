@@ -1,12 +1,17 @@
+import functools
+import hashlib
 import json
 import logging
 import os
+from contextlib import contextmanager
 from typing import Any, Dict, List
 
 import openai
 import tiktoken
-from common.context import log_dependency_call
+from common.cache import LRUCache
+from common.context import log_dependency_call, log_dependency_call_async
 from common.exception import GPTTimeOutException, GPTException
+from common.resilience import call_openai, call_openai_async
 from openai.error import OpenAIError, RateLimitError, Timeout, TryAgain
 
 logger = logging.getLogger(__name__)
@@ -22,9 +27,100 @@ openai.api_version = os.environ["OPENAI_API_VERSION"]
 # the url of the OpenAI API service
 openai.api_base = os.environ["OPENAI_API_URL"]
 
+# The GPT calls whose outputs are interchangeable for the same inputs, even if the temperature is not 0
+DETERMINISTIC_GPT_TASKS = {'CHECK_KNOWLEDGE_SEARCH_SIMILARITY'}
+gpt_response_cache = LRUCache(max_size=int(os.environ.get("GPT_RESPONSE_CACHE_MAX_SIZE", "1024")))
+
 
 @log_dependency_call("gpt generate")
 def gpt_generate(context, system_msg: str, user_msg: str, history_msg: List[Dict[str, str]]) -> Dict[str, Any]:
+    chatgpt_service_params = _build_chatgpt_service_params(context, system_msg, user_msg, history_msg)
+
+    cache_key = _get_gpt_response_cache_key(context, chatgpt_service_params)
+    cached_response = _get_cached_gpt_response(context, cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    with _convert_openai_error():
+        response, attempts = call_openai(openai.ChatCompletion.create, chatgpt_service_params,
+                                         _estimate_reserved_tokens(context, chatgpt_service_params))
+    return _build_gpt_response(context, response, cache_key, attempts)
+
+
+@log_dependency_call_async("gpt generate")
+async def gpt_generate_async(context, system_msg: str, user_msg: str, history_msg: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    The same as `gpt_generate`, but the event loop is not blocked while GPT is generating
+    """
+    chatgpt_service_params = _build_chatgpt_service_params(context, system_msg, user_msg, history_msg)
+
+    cache_key = _get_gpt_response_cache_key(context, chatgpt_service_params)
+    cached_response = _get_cached_gpt_response(context, cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    with _convert_openai_error():
+        response, attempts = await call_openai_async(openai.ChatCompletion.acreate, chatgpt_service_params,
+                                                     _estimate_reserved_tokens(context, chatgpt_service_params))
+    return _build_gpt_response(context, response, cache_key, attempts)
+
+
+def _get_cached_gpt_response(context, cache_key):
+    cached_response = gpt_response_cache.get(cache_key) if cache_key else None
+    if cached_response is None:
+        return None
+    logging.info(f"The {context.custom_context.gpt_task_name} GPT call is hit in the cache, saved tokens = {cached_response['usage']['total_tokens']}.")
+    # No token is consumed by the cached call, and the tokens of the original call are reported as saved
+    response = {
+        "content": cached_response["content"],
+        "usage": {"model": cached_response["usage"]["model"], "completion_tokens": 0, "prompt_tokens": 0, "total_tokens": 0,
+                  "saved_tokens": cached_response["usage"]["total_tokens"]}
+    }
+    return _add_estimated_usage(context, response)
+
+
+def _build_gpt_response(context, response, cache_key, attempts):
+    logging.info(f"The actual cost of {context.custom_context.gpt_task_name} GPT call is as follows: completion tokens = {response['usage']['completion_tokens']}, propmpt tokens = {response['usage']['prompt_tokens']}, total tokens = {response['usage']['total_tokens']}.")
+    chatCompletion = response.choices[0].message.content
+    response.usage['model'] = response.model
+    response = {
+        "content": chatCompletion,
+        "usage": response.usage,
+        "metrics": {"attempts": attempts}
+    }
+    if cache_key:
+        gpt_response_cache.set(cache_key, {"content": chatCompletion, "usage": dict(response["usage"])},
+                               ttl=_get_gpt_response_cache_ttl(context.custom_context.gpt_task_name))
+
+    response = _add_estimated_usage(context, response)
+    return response
+
+
+def _get_gpt_response_cache_key(context, chatgpt_service_params):
+    """
+    Get the cache key of a GPT call, which is the hash of all the messages and engine params.
+    Returns: `None` if the output of the call is not deterministic, so it should not be cached
+    """
+    if os.environ.get("ENABLE_GPT_RESPONSE_CACHE", "true").lower() != "true":
+        return None
+    if chatgpt_service_params["temperature"] != 0 and context.custom_context.gpt_task_name not in DETERMINISTIC_GPT_TASKS:
+        return None
+    content = json.dumps(chatgpt_service_params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _get_gpt_response_cache_ttl(gpt_task_name):
+    # The TTL can be set for each task, e.g. `GPT_RESPONSE_CACHE_TTL_CHECK_KNOWLEDGE_SEARCH_SIMILARITY`
+    default_ttl = os.environ.get("GPT_RESPONSE_CACHE_TTL", "3600")
+    return float(os.environ.get(f"GPT_RESPONSE_CACHE_TTL_{gpt_task_name}", default_ttl))
+
+
+def _estimate_reserved_tokens(context, chatgpt_service_params):
+    # The quota of the deployment is consumed by both the prompt and the max tokens of the completion
+    return (context.custom_context.estimated_prompt_tokens or 0) + chatgpt_service_params["max_tokens"]
+
+
+def _build_chatgpt_service_params(context, system_msg: str, user_msg: str, history_msg: List[Dict[str, str]]) -> Dict[str, Any]:
     # the param dict of the chatgpt service
     chatgpt_service_params = initialize_chatgpt_service_params(system_msg)
     all_user_msg = []
@@ -42,25 +138,19 @@ def gpt_generate(context, system_msg: str, user_msg: str, history_msg: List[Dict
     context.custom_context.estimated_history_tokens = estimated_history_tokens
     context.custom_context.estimated_prompt_tokens = num_tokens_from_messages(chatgpt_service_params["messages"])
     _logging_gpt_call_cost(context)
+    return chatgpt_service_params
+
 
+@contextmanager
+def _convert_openai_error():
     try:
-        response = openai.ChatCompletion.create(**chatgpt_service_params)
-        logging.info(f"The actual cost of {context.custom_context.gpt_task_name} GPT call is as follows: completion tokens = {response['usage']['completion_tokens']}, propmpt tokens = {response['usage']['prompt_tokens']}, total tokens = {response['usage']['total_tokens']}.")
+        yield
     except (TryAgain, Timeout) as e:
         raise GPTTimeOutException() from e
     except RateLimitError as e:
         raise GPTException('The OpenAI API rate limit is exceeded.') from e
     except OpenAIError as e:
         raise GPTException('There is some error from the OpenAI.') from e
-    chatCompletion = response.choices[0].message.content
-    response.usage['model'] = response.model
-    response = {
-        "content": chatCompletion,
-        "usage": response.usage
-    }
-
-    response = _add_estimated_usage(context, response)
-    return response
 
 
 def _logging_gpt_call_cost(context):
@@ -135,18 +225,27 @@ def initialize_chatgpt_service_params(prompt_msg=None, chatgpt_service_params=No
     return chatgpt_service_params
 
 
-def num_tokens_from_messages(messages: List[Dict[str, str]], model="gpt-3.5-turbo-0613"):
-    """Returns the number of tokens used by a list of messages."""
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@functools.lru_cache(maxsize=int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", "4096")))
+def _count_tokens(text: str, model: str) -> int:
+    return len(_get_encoding(model).encode(text))
+
+
+def num_tokens_from_messages(messages: List[Dict[str, str]], model="gpt-3.5-turbo-0613"):
+    """Returns the number of tokens used by a list of messages."""
     if model == "gpt-3.5-turbo-0613":  # note: future models may deviate from this
         num_tokens = 0
         for message in messages:
             num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
             for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
+                num_tokens += _count_tokens(value, model)
                 if key == "name":  # if there's a name, the role is omitted
                     num_tokens += -1  # role is always required and always 1 token
         num_tokens += 2  # every reply is primed with <im_start>assistant
@@ -160,14 +259,31 @@ def num_tokens_from_message(message: str, model="gpt-3.5-turbo-0613"):
     """Returns the number of tokens used by a messages."""
     if not isinstance(message, str):
         message = str(message)
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
     if model == "gpt-3.5-turbo-0613":  # note: future models may deviate from this
-        num_tokens = len(encoding.encode(message))
+        num_tokens = _count_tokens(message, model)
         return num_tokens
     else:
         logging.error(f"""num_tokens_from_message() is not presently implemented for model {model}.
     See https://github.com/openai/openai-python/blob/main/chatml.md for information on how message is converted to tokens.""")
         return None
+
+
+class TokenBudgeter():
+    """
+    Build a message incrementally under a token limit.
+    Every appended part is only tokenized once and its token count is added to the total,
+    instead of tokenizing the whole message again after each append.
+    """
+
+    def __init__(self, message: str, token_limit: float) -> None:
+        self.message = message
+        self.token_limit = token_limit
+        self.num_tokens = num_tokens_from_message(message) or 0
+
+    def try_append(self, part: str) -> bool:
+        part_tokens = num_tokens_from_message(part) or 0
+        if self.num_tokens + part_tokens > self.token_limit:
+            return False
+        self.message += part
+        self.num_tokens += part_tokens
+        return True
@@ -3,10 +3,9 @@ import os
 from enum import Enum
 from typing import List, Optional
 
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
 from common.exception import GPTInvalidBoolException
-from common.service_impl.chatgpt import gpt_generate, num_tokens_from_message
+from common.search_client import get_async_scenario_search_client
+from common.service_impl.chatgpt import gpt_generate_async, num_tokens_from_message
 from common.util import ScenarioSourceType
 
 
@@ -35,47 +34,44 @@ class SearchType(int, Enum):
     FullText = 2
     Keyword = 3
 
-def knowledge_search(keyword: str, top_num: int):
+async def knowledge_search(keyword: str, top_num: int):
     # placeholder for rate limit
     exceed_rate_limit = False
     if not exceed_rate_limit:
-        results = knowledge_search_semantic(keyword, top_num)
+        results = await knowledge_search_semantic(keyword, top_num)
     else:
-        results = knowledge_search_full_text(keyword, top_num)
+        results = await knowledge_search_full_text(keyword, top_num)
     return results
 
 
-def knowledge_search_semantic(keyword: str, top_num: int, scope=SearchScope.Scenario):
+async def knowledge_search_semantic(keyword: str, top_num: int, scope=SearchScope.Scenario):
     # Please refer to ScenarioSourceType for the corresponding numbers of the search source
     knowledge_search_source = os.environ.get("KNOWLEDGE_SEARCH_SOURCE", default="1 3")
     source_filter = list(map(int, knowledge_search_source.split()))
-    results = get_search_results(keyword, source_filter, top_num, scope.get_search_fields(), SearchType.Semantic)
+    results = await get_search_results(keyword, source_filter, top_num, scope.get_search_fields(), SearchType.Semantic)
     return results
 
 
-def knowledge_search_full_text(keyword: str, top_num: int, scope=SearchScope.Scenario, match_rule=MatchRule.All):
+async def knowledge_search_full_text(keyword: str, top_num: int, scope=SearchScope.Scenario, match_rule=MatchRule.All):
     knowledge_search_source = os.environ.get("KNOWLEDGE_SEARCH_SOURCE", default="1 3")
     source_filter = list(map(int, knowledge_search_source.split()))
-    results = get_search_results(build_search_statement(keyword, match_rule), source_filter, top_num, scope.get_search_fields(), SearchType.FullText)
+    results = await get_search_results(build_search_statement(keyword, match_rule), source_filter, top_num, scope.get_search_fields(), SearchType.FullText)
     if len(keyword.split()) > 1 and len(results) < top_num and match_rule == MatchRule.All:
-        or_results = get_search_results(build_or_search_statement(keyword), source_filter, top_num, scope.get_search_fields(), SearchType.FullText)
+        or_results = await get_search_results(build_or_search_statement(keyword), source_filter, top_num, scope.get_search_fields(), SearchType.FullText)
         append_results(results, or_results)
         results = results[:top_num]
     return results
 
 
-def get_search_results(
+async def get_search_results(
         search_statement: str, source_filter: List[ScenarioSourceType],
         top: int = 5, search_fields: Optional[List[str]] = None, search_type=SearchType.Semantic):
-    service_endpoint = os.environ["SCENARIO_SEARCH_SERVICE_ENDPOINT"]
-    search_client = SearchClient(endpoint=service_endpoint,
-                                 index_name=os.environ["SCENARIO_SEARCH_INDEX"],
-                                 credential=AzureKeyCredential(os.environ["SCENARIO_SEARCH_SERVICE_SEARCH_KEY"]))
+    search_client = get_async_scenario_search_client()
 
     filter = " or ".join([f"(source eq {src})" for src in source_filter])
     if search_type == SearchType.Semantic:
 
-        results = search_client.search(
+        results = await search_client.search(
             query_answer='extractive',
             query_caption='extractive',
             semantic_configuration_name='semanctic-config',
@@ -88,7 +84,7 @@ def get_search_results(
             top=top,
             query_type='semantic')
     elif search_type == SearchType.FullText:
-        results = search_client.search(
+        results = await search_client.search(
             search_text=search_statement,
             filter=filter,
             include_total_count=True,
@@ -96,7 +92,7 @@ def get_search_results(
             highlight_fields=", ".join(search_fields) if search_fields else None,
             top=top,
             query_type='full')
-    results = list(results)
+    results = [result async for result in results]
     for result in results:
         result.pop("rid")
         if search_type == SearchType.Semantic:
@@ -152,7 +148,7 @@ def append_results(results, appended_results):
             results.append(result)
 
 
-def pass_verification(context, question, result):
+async def pass_verification(context, question, result):
     if result[0]['score'] < float(os.environ.get('KNOWLEDGE_QUALITY_THRESHOLD', "1.0")):
         return False
     else:
@@ -161,7 +157,7 @@ def pass_verification(context, question, result):
         default_msg = r"""[{"role":"system","content":"Give you a question and a description, please refer to the following rules to determine if the content in the question is completely consistent with the description:\n1. Please determine whether the content in the question is semantically consistent with the description. If inconsistent, output False directly and do not need to continue with subsequent steps.\n2. Analyze the resources and operations on resources included in the question and description separately, and clarify what operations are used on what resources.\n3. Confirm whether the resources, operations, and corresponding relationships between operations and resources included in the question are completely consistent with the description. If they are the same or very close, output True, otherwise output False."},{"role":"user","content":"question: How to create a VM snapshot from VM image.\ndescription: Tutorial to create a VM image from an existing VM."},{"role":"assistant","content":"False"},{"role":"user","content":"question: I want to create a VM snapshot from VM image, could you give some suggestion?\ndescription: Tutorial to create a VM snapshot from an existing VM image."},{"role":"assistant","content":"True"}]"""
         check_similarity_msg = os.environ.get("OPENAI_CHECK_KNOWLEDGE_SEARCH_SIMILARITY_MSG", default=default_msg)
         context.custom_context.gpt_task_name = 'CHECK_KNOWLEDGE_SEARCH_SIMILARITY'
-        content = gpt_generate(context, check_similarity_msg, user_msg, history_msg=[])
+        content = await gpt_generate_async(context, check_similarity_msg, user_msg, history_msg=[])
         content = content.replace("\"", "").replace("'", "").lower()
         if content not in ['true', 'false']:
             logging.error(f"Not a bool value error: {content}")
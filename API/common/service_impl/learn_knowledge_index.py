@@ -1,9 +1,14 @@
+import asyncio
+import copy
+import hashlib
 import logging
 import os
-import re
 from rapidfuzz import fuzz
 
 import httpx
+from common.cache import LRUCache
+from common.embedding_cache import EmbeddingCache, embedding_cache
+from common.http_client import get_async_http_client, get_timeout
 from common.util import determine_strings_are_similar, parse_command_info
 
 logger = logging.getLogger(__name__)
@@ -12,8 +17,99 @@ embedding_model_url = os.environ["EMBEDDING_MODEL_URL"]
 chunk_sieve_top_num = int(os.environ.get("CHUNK_SIEVE_TOP_NUM", "3"))
 keyword_similarity_score = float(os.environ["KEYWORD_SIMILARITY_SCORE"])
 
+# The chunks of a command signature only change when the docs are released,
+# so the parsed chunks are cached by signature. The learn knowledge index doesn't expose its version, so they expire by the TTL.
+chunk_cache = LRUCache(max_size=int(os.environ.get("CHUNK_CACHE_MAX_SIZE", "1024")),
+                       ttl=float(os.environ.get("CHUNK_CACHE_TTL", "86400")))
+# The parsed chunks by the hash of their content, which are still valid when the docs are released
+chunk_parse_cache = LRUCache(max_size=int(os.environ.get("CHUNK_PARSE_CACHE_MAX_SIZE", "4096")))
+SECTION_SEPARATOR = "\n\n###"
+PARAM_SEPARATOR = "\n\n--"
 
-async def _embedding_text_to_vector(text):
+
+class EmbeddingBatcher():
+    """
+    Coalesce the texts to be embedded into a single request of the embeddings endpoint.
+    The texts submitted in the same iteration of the event loop, or within `window` seconds if it is set,
+    are sent together, and each caller gets back the vector of its own text.
+    """
+
+    def __init__(self, window: float = 0, max_batch_size: int = 16) -> None:
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._loop = None
+        self._pending = []
+        self._flush_handle = None
+        # Keep references to the running batch tasks, otherwise they could be garbage collected before completion
+        self._tasks = set()
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._pending = []
+            self._flush_handle = None
+
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            if self.window > 0:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+            else:
+                self._flush_handle = loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._embed_batch(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed_batch(self, pending):
+        texts = list(dict.fromkeys(text for text, _ in pending))
+        try:
+            vectors = await _embedding_texts_to_vectors(texts)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        text_vectors = dict(zip(texts, vectors))
+        for text, future in pending:
+            if not future.done():
+                future.set_result(text_vectors[text])
+
+
+embedding_batcher = EmbeddingBatcher(window=float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "0")) / 1000,
+                                     max_batch_size=int(os.environ.get("EMBEDDING_BATCH_MAX_SIZE", "16")))
+
+
+async def embedding_text_to_vector(text):
+    if embedding_cache is None:
+        return await embedding_batcher.embed(text)
+
+    cache_key = EmbeddingCache.build_key(text, embedding_model_url)
+    vector = await embedding_cache.get_async(cache_key)
+    if vector is None:
+        vector = await embedding_batcher.embed(text)
+        if vector:
+            embedding_cache.set(cache_key, vector)
+    return vector
+
+
+async def _embedding_texts_to_vectors(texts):
+    """
+    Embed a list of texts in one request
+    Args:
+        texts: the texts to be embedded
+    Returns: the embedding vectors in the same order of the texts, the vector is empty if the text fails to be embedded
+    """
     try:
         headers = {
             'Content-Type': 'application/json',
@@ -21,22 +117,23 @@ async def _embedding_text_to_vector(text):
         }
 
         payload = {
-            "input": text
+            "input": texts
         }
 
-        async with httpx.AsyncClient() as client:
-            result = await client.post(embedding_model_url, json=payload, headers=headers)
-            result.raise_for_status()
-
-        data = result.json().get("data")
-        if not data or not data[0].get("embedding"):
-            logging.error('No embedding vector for the text %s', text)
-            return []
-
-        return data[0]["embedding"]
+        client = get_async_http_client()
+        result = await client.post(embedding_model_url, json=payload, headers=headers, timeout=get_timeout("EMBEDDING_TIMEOUT"))
+        result.raise_for_status()
+
+        vectors = [[] for _ in texts]
+        for idx, item in enumerate(result.json().get("data") or []):
+            vectors[item.get("index", idx)] = item.get("embedding") or []
+        for text, vector in zip(texts, vectors):
+            if not vector:
+                logging.error('No embedding vector for the text %s', text)
+        return vectors
     except httpx.RequestError as e:
-        logging.error('Error while retrieving embedding vector for the text %s: %s', text, e)
-        return []
+        logging.error('Error while retrieving embedding vectors for the texts %s: %s', texts, e)
+        return [[] for _ in texts]
 
 
 async def _retrieve_chunks_from_learn_knowledge_index_service(vector_values, filter_command=None, token=None):
@@ -65,9 +162,9 @@ async def _retrieve_chunks_from_learn_knowledge_index_service(vector_values, fil
         if score_threshold:
             learn_knowledge_index_url = learn_knowledge_index_url + "?scoreThreshold=" + score_threshold
 
-        async with httpx.AsyncClient() as client:
-            result = await client.post(learn_knowledge_index_url, json=payload, headers=headers)
-            result.raise_for_status()
+        client = get_async_http_client()
+        result = await client.post(learn_knowledge_index_url, json=payload, headers=headers, timeout=get_timeout("LEARN_KNOWLEDGE_INDEX_TIMEOUT"))
+        result.raise_for_status()
     except httpx.HTTPStatusError as e:
         logging.error('HTTPStatusError while retrieving chunks from learn knowledge index service: %s', e, exc_info=True)
         return []
@@ -118,14 +215,24 @@ async def retrieve_chunk_for_command(command: str, token=None):
     Retrieve chunk according to command signature
     Args:
         command: full command
-    Returns: a merged chunk that is related to the command
+    Returns: a merged chunk that is related to the command. It has no `score`, since the chunk is matched by the signature,
+             and the similarity to the parameters of the first command would be wrong for the other commands sharing the cache.
     """
     sig, _ = parse_command_info(command)
-    vector_values = await _embedding_text_to_vector(command)
+    chunk = chunk_cache.get(sig)
+    if chunk is not None:
+        # The returned chunk is modified by the callers, so never hand out the cached object
+        return copy.deepcopy(chunk)
+
+    vector_values = await embedding_text_to_vector(command)
 
     chunk_items = await _retrieve_chunks_from_learn_knowledge_index_service(vector_values, filter_command=sig, token=token)
     chunks = merge_chunks_by_command(chunk_items)
-    return chunks[0] if chunks else None
+    chunk = chunks[0] if chunks else None
+    if chunk:
+        chunk.pop('score', None)
+        chunk_cache.set(sig, copy.deepcopy(chunk))
+    return chunk
 
 
 async def retrieve_chunks_for_atomic_task(task: str, token=None):
@@ -135,7 +242,7 @@ async def retrieve_chunks_for_atomic_task(task: str, token=None):
         task: task description
     Returns: List of chunks that are related to the task
     """
-    vector_values = await _embedding_text_to_vector(task)
+    vector_values = await embedding_text_to_vector(task)
 
     chunk_items = await _retrieve_chunks_from_learn_knowledge_index_service(vector_values, token=token)
     chunks = merge_chunks_by_command(chunk_items)
@@ -145,44 +252,87 @@ async def retrieve_chunks_for_atomic_task(task: str, token=None):
 def convert_chunks_to_json(chunks_list):
     data_list = []
     for chunk in chunks_list["items"]:
-        chunk2json = {}
-        chunk2json["command"] = chunk["title"]
-        command_match = re.search(r"### Command\n(.*)$", chunk["content"], flags=re.MULTILINE)
-        if not command_match or command_match.group(1) != chunk["title"]:
-            logger.warning("Command not found or invalid chunk '%s': \n%s", chunk["title"], chunk["content"])
+        chunk2json = _parse_chunk(chunk["title"], chunk["content"])
+        if chunk2json is None:
             continue
-        # Some chunk titles have parentheses, e.g. "az aks nodepool scale (aks-preview extension)"
-        chunk2json["command"] = chunk2json["command"].split('(')[0].strip()
-        summary = re.search(r"### Summary\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
-        if summary:
-            chunk2json["summary"] = summary.group(1)
-        optional_params = []
-        optional_params_content = re.search(r"### Optional Parameters\n\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
-        optional_params_content = optional_params_content.group(1) if optional_params_content else ""
-        params = re.findall(r"(--[\s\S]*?)(?=\n\n--|$)", optional_params_content)
-        for param in params:
-            item = {}
-            item["name"] = param.split("\n")[0]
-            item["desc"] = param[len(item["name"])+1:]
-            optional_params.append(item)
-        require_params = []
-        require_params_desc = re.search(r"### Required Parameters\n\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
-        require_params_desc = require_params_desc.group(1) if require_params_desc else ""
-        params = re.findall(r"(--[\s\S]*?)(?=\n\n--|$)", require_params_desc)
-        for param in params:
-            item = {}
-            item["name"] = param.split("\n")[0]
-            item["desc"] = param[len(item["name"])+1:]
-            require_params.append(item)
-        if optional_params:
-            chunk2json["optional parameters"] = optional_params
-        if require_params:
-            chunk2json["required parameters"] = require_params
         chunk2json["score"] = chunk["score"]
         data_list.append(chunk2json)
     return data_list
 
 
+def _parse_chunk(title, content):
+    """
+    Parse the markdown content of a chunk into the command, summary and parameters.
+    The same chunks are retrieved again and again, so the parsed results are cached by the hash of the content.
+    Returns: a new dict of the parsed chunk, or `None` if the chunk is invalid
+    """
+    cache_key = (title, hashlib.sha1(content.encode("utf-8")).hexdigest())
+    parsed_chunk = chunk_parse_cache.get(cache_key)
+    if parsed_chunk is None:
+        parsed_chunk = _parse_chunk_content(title, content)
+        chunk_parse_cache.set(cache_key, parsed_chunk)
+    if not parsed_chunk:
+        return None
+    # The callers may modify the chunk and its parameters, so a copy is returned
+    chunk2json = parsed_chunk.copy()
+    for key in ("optional parameters", "required parameters"):
+        if key in chunk2json:
+            chunk2json[key] = [param.copy() for param in chunk2json[key]]
+    return chunk2json
+
+
+def _parse_chunk_content(title, content):
+    # The sections are located with `str.find` in a single pass over the content, instead of regular expressions with lookaheads
+    command = _find_section(content, "### Command\n", "\n")
+    if command != title:
+        logger.warning("Command not found or invalid chunk '%s': \n%s", title, content)
+        # An empty dict is cached for the invalid chunk, so the warning is only logged once
+        return {}
+    # Some chunk titles have parentheses, e.g. "az aks nodepool scale (aks-preview extension)"
+    chunk2json = {"command": title.split('(')[0].strip()}
+    summary = _find_section(content, "### Summary\n", SECTION_SEPARATOR)
+    if summary is not None:
+        chunk2json["summary"] = summary
+    optional_params = _split_params(_find_section(content, "### Optional Parameters\n\n", SECTION_SEPARATOR) or "")
+    require_params = _split_params(_find_section(content, "### Required Parameters\n\n", SECTION_SEPARATOR) or "")
+    if optional_params:
+        chunk2json["optional parameters"] = optional_params
+    if require_params:
+        chunk2json["required parameters"] = require_params
+    return chunk2json
+
+
+def _find_section(content, header, separator):
+    """
+    Returns: the content after the first `header` until the next `separator` or the end, `None` if the header is not found
+    """
+    start = content.find(header)
+    if start < 0:
+        return None
+    start += len(header)
+    end = content.find(separator, start)
+    return content[start:] if end < 0 else content[start:end]
+
+
+def _split_params(params_content):
+    """
+    Split the parameters, each of which starts with `--` and is separated by a blank line
+    """
+    params = []
+    # The trailing newline is not a part of the last parameter
+    content_end = len(params_content) - 1 if params_content.endswith("\n") else len(params_content)
+    start = params_content.find("--")
+    while start >= 0:
+        end = params_content.find(PARAM_SEPARATOR, start + 2)
+        if end < 0 or end > content_end:
+            end = content_end
+        param = params_content[start:end]
+        name = param.split("\n", 1)[0]
+        params.append({"name": name, "desc": param[len(name)+1:]})
+        start = params_content.find("--", end)
+    return params
+
+
 def filter_chunks_by_keyword_similarity(chunks_list, command):
     """
     Keep only the chunks and their associated parameters that are relevant to the current command, and discard the rest.
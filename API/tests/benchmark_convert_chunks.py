@@ -0,0 +1,44 @@
+"""
+Benchmark the chunk parser of the learn knowledge index against the previous regex-based parser.
+
+Usage: python tests/benchmark_convert_chunks.py [chunks.json]
+    chunks.json: the response of the learn knowledge index (a dict with "items"),
+    a synthetic corpus in the same format is used if it is not provided.
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.service_impl.learn_knowledge_index import chunk_parse_cache, convert_chunks_to_json  # noqa: E402
+from test_convert_chunks import build_chunk, convert_chunks_to_json_by_regex  # noqa: E402
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            chunks_list = json.load(f)
+    else:
+        chunks_list = {"items": [build_chunk(f"az group command{idx}", param_num=idx % 40, seed=idx) for idx in range(200)]}
+    assert convert_chunks_to_json(chunks_list) == convert_chunks_to_json_by_regex(chunks_list)
+
+    number = 20
+    chunk_num = len(chunks_list["items"]) * number
+    regex_time = timeit.timeit(lambda: convert_chunks_to_json_by_regex(chunks_list), number=number)
+
+    def parse_without_cache():
+        chunk_parse_cache.clear()
+        convert_chunks_to_json(chunks_list)
+    single_pass_time = timeit.timeit(parse_without_cache, number=number)
+    convert_chunks_to_json(chunks_list)
+    cached_time = timeit.timeit(lambda: convert_chunks_to_json(chunks_list), number=number)
+
+    print(f"{'parser':<12}{'chunks/s':>12}{'speedup':>10}")
+    for name, seconds in [("regex", regex_time), ("single-pass", single_pass_time), ("cached", cached_time)]:
+        print(f"{name:<12}{chunk_num / seconds:>12.0f}{regex_time / seconds:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Benchmark the merge engine of the recommendation service against the previous list-based merge.
+
+Usage: python tests/benchmark_merge_engine.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RecommendationService.filter import classify_recommendation_item  # noqa: E402
+from RecommendationService.merge_engine import MergeSource, merge_recommendation_items  # noqa: E402
+from RecommendationService.util import RecommendationSource  # noqa: E402
+from test_merge_engine import build_items, merge_by_list  # noqa: E402
+
+
+def main():
+    number = 2000
+    print(f"{'top_num':<10}{'list (us)':>12}{'engine (us)':>14}{'early stop (us)':>18}")
+    for top_num in [50, 75, 100]:
+        knowledge_base_items = build_items(RecommendationSource.KnowledgeBase, 5, 1000, 0)
+        # The offline data and Aladdin return `top_num` items each
+        calculation_items = build_items(RecommendationSource.OfflineCaculation, top_num, 1000, 1)
+        aladdin_items = build_items(RecommendationSource.Aladdin, top_num, 1000, 2)
+        sources = [MergeSource('OfflineCaculation', calculation_items), MergeSource('Aladdin', aladdin_items)]
+        # Half of the merged commands are needed, and the filter keeps 5 scenarios by default
+        limits = {'command': top_num // 2, 'scenario': 5}
+
+        def classify(item):
+            return classify_recommendation_item(item, 'az command1')
+
+        list_time = timeit.timeit(lambda: merge_by_list(knowledge_base_items, calculation_items, aladdin_items), number=number)
+        engine_time = timeit.timeit(lambda: merge_recommendation_items(knowledge_base_items, sources), number=number)
+        early_stop_time = timeit.timeit(lambda: merge_recommendation_items(knowledge_base_items, sources, limits=limits, classify=classify),
+                                        number=number)
+        print(f"{top_num:<10}{list_time / number * 1e6:>12.1f}{engine_time / number * 1e6:>14.1f}{early_stop_time / number * 1e6:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
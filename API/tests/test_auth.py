@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import jwt
+from azure.core.credentials import AccessToken
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from common.auth import AccessTokenCache, JWKSCache, jwks_cache, verified_token_cache, verify_token
+
+
+class TestVerifyToken(unittest.TestCase):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def setUp(self):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk['kid'] = 'kid-1'
+        self.jwks_response = MagicMock(status_code=200)
+        self.jwks_response.json.return_value = {'keys': [jwk]}
+        jwks_cache._keys = None
+        verified_token_cache.clear()
+
+    def _build_request(self, kid='kid-1'):
+        token = jwt.encode({'aud': 'api://copilot', 'azp': 'app-1', 'exp': int(time.time()) + 3600},
+                           self.private_key, algorithm='RS256', headers={'kid': kid})
+        return MagicMock(headers={'Authorization': f'Bearer {token}'})
+
+    @patch.dict(os.environ, {'ALLOWED_APP_IDS': 'app-1', 'MICROSOFT_TENANT_ID': 'tenant'})
+    def test_cache_jwks_and_verified_token(self):
+        service = verify_token(lambda req: 'ok')
+        req = self._build_request()
+        with patch('common.auth.requests.get', return_value=self.jwks_response) as mock_get, \
+                patch('common.auth.jwt.decode', wraps=jwt.decode) as mock_decode:
+            self.assertEqual(service(req=req), 'ok')
+            self.assertEqual(service(req=req), 'ok')
+        mock_get.assert_called_once()
+        # The same token is only verified once
+        mock_decode.assert_called_once()
+
+    @patch.dict(os.environ, {'ALLOWED_APP_IDS': 'app-1', 'MICROSOFT_TENANT_ID': 'tenant'})
+    def test_unknown_kid(self):
+        service = verify_token(lambda req: 'ok')
+        with patch('common.auth.requests.get', return_value=self.jwks_response) as mock_get:
+            self.assertEqual(service(req=self._build_request()), 'ok')
+            response = service(req=self._build_request(kid='kid-2'))
+        self.assertEqual(response.status_code, 401)
+        # The keys were just retrieved, so the unknown kid does not trigger another retrieval
+        mock_get.assert_called_once()
+
+    @patch.dict(os.environ, {'ALLOWED_APP_IDS': 'app-1', 'MICROSOFT_TENANT_ID': 'tenant'})
+    def test_verify_async_function(self):
+        async def async_service(req):
+            return 'ok'
+
+        def get_jwks(*args, **kwargs):
+            fetch_threads.append(threading.current_thread())
+            return self.jwks_response
+
+        fetch_threads = []
+        service = verify_token(async_service)
+        with patch('common.auth.requests.get', side_effect=get_jwks):
+            self.assertEqual(asyncio.run(service(req=self._build_request())), 'ok')
+            response = asyncio.run(service(req=MagicMock(headers={})))
+        self.assertEqual(response.status_code, 401)
+        # The keys are fetched out of the event loop thread
+        self.assertEqual(len(fetch_threads), 1)
+        self.assertIsNot(fetch_threads[0], threading.current_thread())
+
+
+class TestJWKSCache(unittest.TestCase):
+    @patch.dict(os.environ, {'MICROSOFT_TENANT_ID': 'tenant'})
+    def test_failed_to_retrieve_jwks(self):
+        with patch('common.auth.requests.get', return_value=MagicMock(status_code=500)):
+            with self.assertRaises(ValueError):
+                JWKSCache().get_public_key('kid-1')
+
+
+class TestAccessTokenCache(unittest.TestCase):
+    def test_cache_access_token(self):
+        token_cache = AccessTokenCache(refresh_margin=300)
+        credential = MagicMock()
+        credential.get_token.return_value = AccessToken('token-1', int(time.time()) + 3600)
+        with patch('common.auth.DefaultAzureCredential', return_value=credential) as mock_credential:
+            self.assertEqual(token_cache.get_token('scope').token, 'token-1')
+            self.assertEqual(token_cache.get_token('scope').token, 'token-1')
+        mock_credential.assert_called_once()
+        credential.get_token.assert_called_once_with('scope')
+
+    def test_refresh_ahead_of_expiration(self):
+        token_cache = AccessTokenCache(refresh_margin=300)
+        credential = MagicMock()
+        credential.get_token.side_effect = [AccessToken('token-1', int(time.time()) + 60),
+                                            AccessToken('token-2', int(time.time()) + 3600)]
+        with patch('common.auth.DefaultAzureCredential', return_value=credential):
+            self.assertEqual(token_cache.get_token('scope').token, 'token-1')
+            # The token is still valid, so it is returned while being refreshed in the background
+            self.assertEqual(token_cache.get_token('scope').token, 'token-1')
+            for _ in range(100):
+                if token_cache._tokens[('scope',)].token == 'token-2':
+                    break
+                time.sleep(0.01)
+            self.assertEqual(token_cache.get_token('scope').token, 'token-2')
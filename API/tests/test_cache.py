@@ -0,0 +1,33 @@
+import time
+import unittest
+
+from common.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache(max_size=2)
+        cache.set('group create', [1])
+        self.assertEqual(cache.get('group create'), [1])
+        self.assertIsNone(cache.get('vm create'))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiration(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=60)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
@@ -0,0 +1,44 @@
+import unittest
+
+from common.context_packer import pack_chunks
+
+
+def count_tokens(chunk):
+    # One token for the command and each parameter
+    return 1 + len(chunk.get('required parameters', [])) + len(chunk.get('optional parameters', []))
+
+
+class TestContextPacker(unittest.TestCase):
+    def test_select_best_subset(self):
+        chunks = [
+            {'command': 'az group create', 'score': 0.5, 'required parameters': [{'name': '--name'}, {'name': '--location'}]},
+            {'command': 'az vm create', 'score': 0.9, 'required parameters': [{'name': '--name'}, {'name': '--image'}, {'name': '--resource-group'}]},
+            {'command': 'az vm start', 'score': 0.8, 'required parameters': [{'name': '--name'}]},
+        ]
+        # A greedy packer would stop at `az vm create`, which does not fit after `az group create`
+        packed = pack_chunks(chunks, token_limit=6, count_tokens=count_tokens)
+        self.assertEqual([chunk['command'] for chunk in packed], ['az vm create', 'az vm start'])
+
+    def test_trim_optional_parameters(self):
+        optional_params = [{'name': f'--param-{i}', 'score': i / 10} for i in range(8)]
+        chunks = [{'command': 'az vm create', 'score': 0.9, 'optional parameters': optional_params}]
+        packed = pack_chunks(chunks, token_limit=6, count_tokens=count_tokens)
+        self.assertEqual(len(packed), 1)
+        # The parameters with the highest scores are kept in their original order
+        self.assertEqual([p['name'] for p in packed[0]['optional parameters']], ['--param-4', '--param-5', '--param-6', '--param-7'])
+        self.assertEqual(len(chunks[0]['optional parameters']), 8)
+
+    def test_nothing_fits(self):
+        chunks = [{'command': 'az vm create', 'score': 0.9, 'required parameters': [{'name': '--name'}]}]
+        self.assertEqual(pack_chunks(chunks, token_limit=1, count_tokens=count_tokens), [])
+        self.assertEqual(pack_chunks(chunks, token_limit=-10, count_tokens=count_tokens), [])
+
+    def test_chunk_without_score(self):
+        chunks = [
+            {'command': 'az group create', 'score': 0.5, 'required parameters': [{'name': '--name'}]},
+            {'command': 'az vm create', 'required parameters': [{'name': '--name'}]},
+            {'command': 'az vm start', 'score': 0.8, 'required parameters': [{'name': '--name'}]},
+        ]
+        # The chunk of the exact command is worth as much as the best scored chunk
+        packed = pack_chunks(chunks, token_limit=4, count_tokens=count_tokens)
+        self.assertEqual([chunk['command'] for chunk in packed], ['az vm create', 'az vm start'])
@@ -0,0 +1,95 @@
+import random
+import re
+import unittest
+
+from common.service_impl.learn_knowledge_index import chunk_parse_cache, convert_chunks_to_json
+
+
+def convert_chunks_to_json_by_regex(chunks_list):
+    """
+    The previous implementation of `convert_chunks_to_json`, which the single-pass parser must be equivalent to
+    """
+    data_list = []
+    for chunk in chunks_list["items"]:
+        chunk2json = {}
+        chunk2json["command"] = chunk["title"]
+        command_match = re.search(r"### Command\n(.*)$", chunk["content"], flags=re.MULTILINE)
+        if not command_match or command_match.group(1) != chunk["title"]:
+            continue
+        chunk2json["command"] = chunk2json["command"].split('(')[0].strip()
+        summary = re.search(r"### Summary\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
+        if summary:
+            chunk2json["summary"] = summary.group(1)
+        optional_params = []
+        optional_params_content = re.search(r"### Optional Parameters\n\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
+        optional_params_content = optional_params_content.group(1) if optional_params_content else ""
+        params = re.findall(r"(--[\s\S]*?)(?=\n\n--|$)", optional_params_content)
+        for param in params:
+            item = {}
+            item["name"] = param.split("\n")[0]
+            item["desc"] = param[len(item["name"])+1:]
+            optional_params.append(item)
+        require_params = []
+        require_params_desc = re.search(r"### Required Parameters\n\n([\s\S]*?)(?=\n\n###|\Z)", chunk["content"])
+        require_params_desc = require_params_desc.group(1) if require_params_desc else ""
+        params = re.findall(r"(--[\s\S]*?)(?=\n\n--|$)", require_params_desc)
+        for param in params:
+            item = {}
+            item["name"] = param.split("\n")[0]
+            item["desc"] = param[len(item["name"])+1:]
+            require_params.append(item)
+        if optional_params:
+            chunk2json["optional parameters"] = optional_params
+        if require_params:
+            chunk2json["required parameters"] = require_params
+        chunk2json["score"] = chunk["score"]
+        data_list.append(chunk2json)
+    return data_list
+
+
+def build_chunk(command, param_num=10, seed=0, extension=None):
+    """
+    Build a chunk in the format of the Learn knowledge index
+    """
+    rand = random.Random(seed)
+    title = f'{command} ({extension} extension)' if extension else command
+    sections = [f'### Command\n{title}',
+                f'### Summary\nManage the resource with `{command}`.\n\nIt supports --name and --resource-group.']
+    required_params = [f'--name -n\nThe name of the resource.\nIt is unique in the resource group.',
+                       f'--resource-group -g\nName of resource group. You can configure the default group using `az configure --defaults group=<name>`.']
+    sections.append('### Required Parameters\n\n' + '\n\n'.join(required_params))
+    optional_params = []
+    for idx in range(param_num):
+        desc = ' '.join(rand.choice(['Enable', 'the', 'resource', 'value', '--flag', 'default:', 'true']) for _ in range(rand.randint(3, 30)))
+        optional_params.append(f'--param-{idx}\n{desc}\naccepted values: false, true')
+    sections.append('### Optional Parameters\n\n' + '\n\n'.join(optional_params))
+    sections.append('### Examples\n\n```\naz example\n```')
+    return {'title': title, 'content': '\n\n'.join(sections), 'score': rand.random()}
+
+
+class TestConvertChunks(unittest.TestCase):
+    def setUp(self):
+        chunk_parse_cache.clear()
+
+    def test_equivalent_to_regex(self):
+        chunks = [build_chunk(f'az vm command{idx}', param_num=idx, seed=idx) for idx in range(20)]
+        chunks.append(build_chunk('az aks nodepool scale', extension='aks-preview'))
+        chunks.append({'title': 'az vm create', 'content': '### Command\naz vm delete\n\n### Summary\nDelete', 'score': 1})
+        chunks.append({'title': 'az vm create', 'content': 'no command', 'score': 1})
+        chunks.append({'title': 'az vm create', 'content': '### Command\naz vm create\n### Summary\n', 'score': 1})
+        chunks.append({'title': 'az vm create', 'content': '### Command\naz vm create\n\n### Optional Parameters\n\n--a\n\n--b\ndesc\n', 'score': 1})
+        chunks.append({'title': 'az vm create', 'content': '### Command\naz vm create\n\n### Required Parameters\n\nUse --x\n\n\n\n--y\n\n###', 'score': 1})
+        chunks_list = {'items': chunks}
+        expected = convert_chunks_to_json_by_regex(chunks_list)
+        self.assertEqual(convert_chunks_to_json(chunks_list), expected)
+        # The cached results are the same
+        self.assertEqual(convert_chunks_to_json(chunks_list), expected)
+
+    def test_cached_chunk_not_modified(self):
+        chunks_list = {'items': [build_chunk('az vm create')]}
+        hits = chunk_parse_cache.hits
+        chunk = convert_chunks_to_json(chunks_list)[0]
+        chunk['optional parameters'][0]['desc'] = ''
+        chunk['required parameters'].pop()
+        self.assertEqual(convert_chunks_to_json(chunks_list), convert_chunks_to_json_by_regex(chunks_list))
+        self.assertEqual(chunk_parse_cache.hits, hits + 1)
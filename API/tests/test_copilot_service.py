@@ -0,0 +1,44 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import CopilotService
+
+
+class TestMixServiceConcurrently(unittest.TestCase):
+    def run_mix_service(self, search_and_verify):
+        rag_events = []
+
+        async def delayed_search_and_verify(*args):
+            # Let the RAG task start before the search result is ready
+            await asyncio.sleep(0.01)
+            return await search_and_verify(*args)
+
+        async def augment_question(context, question, system_msg):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                rag_events.append('cancelled')
+                raise
+            finally:
+                rag_events.append('finished')
+
+        async def mix_service():
+            context = SimpleNamespace(custom_context=SimpleNamespace())
+            try:
+                return await CopilotService._mix_service_concurrently(context, 'Create a VM', [], 5, 'system')
+            finally:
+                # The RAG task has finished before the result is returned
+                self.assertEqual(rag_events, ['cancelled', 'finished'])
+
+        with patch.multiple('CopilotService', _augment_question=augment_question, _search_and_verify=delayed_search_and_verify):
+            return asyncio.run(mix_service())
+
+    def test_cancel_rag_when_verified(self):
+        result = [{'scenario': 'Create a VM'}]
+        self.assertEqual(self.run_mix_service(AsyncMock(return_value=result)), result)
+
+    def test_cancel_rag_on_error(self):
+        with self.assertRaises(ValueError):
+            self.run_mix_service(AsyncMock(side_effect=ValueError('Search failed')))
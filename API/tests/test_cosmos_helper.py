@@ -0,0 +1,21 @@
+import unittest
+
+from RecommendationService.util import CosmosType, match_query_conditions
+
+
+class TestMatchQueryConditions(unittest.TestCase):
+    def test_type(self):
+        item = {'command': 'vm create', 'type': CosmosType.Command}
+        self.assertTrue(match_query_conditions(item, CosmosType.Command, ()))
+        self.assertFalse(match_query_conditions(item, CosmosType.Solution, ()))
+        self.assertTrue(match_query_conditions(item, '3,1', ()))
+        self.assertFalse(match_query_conditions(item, '3,2', ()))
+        self.assertFalse(match_query_conditions({'command': 'vm create'}, CosmosType.Command, ()))
+        self.assertTrue(match_query_conditions({'command': 'vm create'}, None, ()))
+
+    def test_error_information(self):
+        item = {'type': CosmosType.Solution, 'errorInformation': 'The VM Size is not available in location'}
+        self.assertTrue(match_query_conditions(item, CosmosType.Solution, ('the vm size', 'in location')))
+        self.assertFalse(match_query_conditions(item, CosmosType.Solution, ('the vm size', 'quota')))
+        self.assertFalse(match_query_conditions({'type': CosmosType.Solution}, CosmosType.Solution, ('the vm size',)))
+
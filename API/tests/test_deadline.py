@@ -0,0 +1,78 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import azure.functions as func
+
+import RecommendationService
+from RecommendationService.deadline import gather_with_deadline
+
+
+async def delayed(value, delay):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def failed():
+    raise ValueError('Service unavailable')
+
+
+class TestGatherWithDeadline(unittest.TestCase):
+    def test_all_sources_in_time(self):
+        results, missing_sources = asyncio.run(gather_with_deadline({'a': delayed([1], 0), 'b': delayed([2], 0.01)}, deadline=1))
+        self.assertEqual(results, {'a': [1], 'b': [2]})
+        self.assertEqual(missing_sources, [])
+
+    def test_deadline(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        results, missing_sources = asyncio.run(gather_with_deadline({'fast': delayed([1], 0), 'slow': slow()}, deadline=0.05))
+        self.assertEqual(results, {'fast': [1]})
+        self.assertEqual(missing_sources, ['slow'])
+        self.assertEqual(cancelled, [True])
+
+    def test_source_timeout(self):
+        sources = {'a': delayed([1], 0.1), 'b': delayed([2], 0.1), 'c': delayed([3], 0)}
+        results, missing_sources = asyncio.run(gather_with_deadline(sources, timeouts={'a': 0.01, 'c': 0.01}))
+        self.assertEqual(results, {'b': [2], 'c': [3]})
+        self.assertEqual(missing_sources, ['a'])
+
+    def test_source_timeout_capped_by_deadline(self):
+        results, missing_sources = asyncio.run(gather_with_deadline({'a': delayed([1], 0.2)}, deadline=0.01, timeouts={'a': 1}))
+        self.assertEqual(results, {})
+        self.assertEqual(missing_sources, ['a'])
+
+    def test_error(self):
+        results, missing_sources = asyncio.run(gather_with_deadline({'a': failed(), 'b': delayed([2], 0)}))
+        self.assertEqual(results, {'b': [2]})
+        self.assertEqual(missing_sources, ['a'])
+
+    def test_cancelled(self):
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        results, missing_sources = asyncio.run(gather_with_deadline({'a': cancelled(), 'b': delayed([2], 0)}))
+        self.assertEqual(results, {'b': [2]})
+        self.assertEqual(missing_sources, ['a'])
+
+
+class TestMissingSources(unittest.TestCase):
+    def call_main(self, result, missing_sources):
+        req = func.HttpRequest('GET', '/api/RecommendationService', params={'command_list': '[]'}, body=b'')
+        with patch('RecommendationService.get_recommendation_items', new=AsyncMock(return_value=(result, missing_sources))):
+            return asyncio.run(RecommendationService.main(req))
+
+    def test_empty_result(self):
+        self.assertEqual(self.call_main([], []).get_body(), b'{}')
+
+        response = json.loads(self.call_main([], ['Aladdin']).get_body())
+        self.assertEqual(response['data'], [])
+        self.assertEqual(response['missing_sources'], ['Aladdin'])
@@ -0,0 +1,25 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from common.service_impl.learn_knowledge_index import EmbeddingBatcher
+
+
+class TestEmbeddingBatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_embed_in_one_request(self):
+        batcher = EmbeddingBatcher()
+        with patch('common.service_impl.learn_knowledge_index._embedding_texts_to_vectors',
+                   new=AsyncMock(side_effect=lambda texts: [[float(len(text))] for text in texts])) as mock_embedding:
+            vectors = await asyncio.gather(
+                batcher.embed('az group create'),
+                batcher.embed('Create a virtual machine'),
+                batcher.embed('az group create'))
+        self.assertEqual(vectors, [[15.0], [24.0], [15.0]])
+        mock_embedding.assert_awaited_once_with(['az group create', 'Create a virtual machine'])
+
+    async def test_max_batch_size(self):
+        batcher = EmbeddingBatcher(max_batch_size=2)
+        with patch('common.service_impl.learn_knowledge_index._embedding_texts_to_vectors',
+                   new=AsyncMock(side_effect=lambda texts: [[1.0] for _ in texts])) as mock_embedding:
+            await asyncio.gather(*[batcher.embed(f'task {i}') for i in range(5)])
+        self.assertEqual(mock_embedding.await_count, 3)
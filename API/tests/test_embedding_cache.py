@@ -0,0 +1,52 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from common.embedding_cache import EmbeddingCache, start_request_statistics
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_build_key(self):
+        key = EmbeddingCache.build_key('az group create  --name --location', 'https://embedding')
+        self.assertEqual(key, EmbeddingCache.build_key(' az group create --name --location', 'https://embedding'))
+        self.assertNotEqual(key, EmbeddingCache.build_key('az group create --name --location', 'https://embedding-2'))
+
+    def test_persist_vectors(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'embedding.sqlite3')
+            key = EmbeddingCache.build_key('Create a resource group', 'https://embedding')
+            cache = EmbeddingCache(path=path)
+            cache.set(key, [0.5, -0.25, 1.0])
+            cache.flush()
+
+            cache = EmbeddingCache(path=path)
+            request_statistics = start_request_statistics()
+            self.assertEqual(asyncio.run(cache.get_async(key)), [0.5, -0.25, 1.0])
+            self.assertIsNone(asyncio.run(cache.get_async('unknown')))
+            self.assertEqual(request_statistics['hits'], 1)
+            self.assertEqual(request_statistics['misses'], 1)
+            self.assertGreater(request_statistics['lookupSeconds'], 0)
+
+    def test_open_lazily(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'embedding.sqlite3')
+            cache = EmbeddingCache(path=path)
+            self.assertFalse(os.path.exists(path))
+            cache.set('key', [1.0])
+            # The vector is served from memory before it is written
+            self.assertEqual(cache.get('key'), [1.0])
+            cache.flush()
+            self.assertTrue(os.path.exists(path))
+
+    def test_batch_writes(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'embedding.sqlite3')
+            cache = EmbeddingCache(max_size=1, path=path, max_disk_size=10)
+            for i in range(EmbeddingCache.PRUNE_INTERVAL + 1):
+                cache.set(f'key{i}', [float(i)])
+            cache.flush()
+            # The vectors are read from the disk, and the database is pruned to its max size
+            cache = EmbeddingCache(path=path)
+            self.assertEqual(cache.get(f'key{EmbeddingCache.PRUNE_INTERVAL}'), [float(EmbeddingCache.PRUNE_INTERVAL)])
+            self.assertIsNone(cache.get('key0'))
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from common.context import ContextStatistics
+from common.service_impl.chatgpt import _count_tokens, gpt_generate, gpt_generate_async, gpt_response_cache
+import openai
+from openai.openai_object import OpenAIObject
+
+
+class TestGPTResponseCache(unittest.TestCase):
+    def setUp(self):
+        encoding = MagicMock()
+        encoding.encode.side_effect = lambda text: text.split()
+        response = OpenAIObject.construct_from({
+            'model': 'gpt-4-32k',
+            'choices': [{'message': {'role': 'assistant', 'content': 'True'}}],
+            'usage': {'completion_tokens': 1, 'prompt_tokens': 99, 'total_tokens': 100}
+        })
+        self.patchers = [
+            patch('common.service_impl.chatgpt._get_encoding', return_value=encoding),
+            patch('openai.ChatCompletion.create', return_value=response),
+            patch('openai.ChatCompletion.acreate', new=AsyncMock(return_value=response)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        _count_tokens.cache_clear()
+        gpt_response_cache.clear()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        _count_tokens.cache_clear()
+        gpt_response_cache.clear()
+
+    @staticmethod
+    def _build_context(gpt_task_name):
+        custom_context = SimpleNamespace(tracer=MagicMock(), statistics=ContextStatistics(), gpt_task_name=gpt_task_name)
+        return SimpleNamespace(custom_context=custom_context)
+
+    def _generate(self, gpt_task_name, user_msg='question: create a VM'):
+        context = self._build_context(gpt_task_name)
+        content = gpt_generate(context, '[{"role": "system", "content": "check"}]', user_msg, history_msg=[])
+        return content, context.custom_context.statistics.callGraph[0].usage
+
+    def test_memoize_deterministic_task(self):
+        content, usage = self._generate('CHECK_KNOWLEDGE_SEARCH_SIMILARITY')
+        self.assertEqual((content, usage['total_tokens']), ('True', 100))
+        content, usage = self._generate('CHECK_KNOWLEDGE_SEARCH_SIMILARITY')
+        self.assertEqual((content, usage['total_tokens'], usage['saved_tokens']), ('True', 0, 100))
+        self.assertEqual(openai.ChatCompletion.create.call_count, 1)
+
+        self._generate('CHECK_KNOWLEDGE_SEARCH_SIMILARITY', user_msg='question: delete a VM')
+        self.assertEqual(openai.ChatCompletion.create.call_count, 2)
+
+    def test_skip_nondeterministic_task(self):
+        with patch.dict('os.environ', {'OPENAI_TEMPERATURE': '0.5'}):
+            self._generate('GENERATE_SCENARIO')
+            self._generate('GENERATE_SCENARIO')
+        self.assertEqual(openai.ChatCompletion.create.call_count, 2)
+
+    def test_memoize_zero_temperature(self):
+        with patch.dict('os.environ', {'OPENAI_TEMPERATURE': '0'}):
+            self._generate('GENERATE_SCENARIO')
+            _, usage = self._generate('GENERATE_SCENARIO')
+        self.assertEqual(openai.ChatCompletion.create.call_count, 1)
+        self.assertEqual(usage['saved_tokens'], 100)
+
+    def test_memoize_async(self):
+        context = self._build_context('CHECK_KNOWLEDGE_SEARCH_SIMILARITY')
+        content = asyncio.run(gpt_generate_async(context, '[{"role": "system", "content": "check"}]', 'question', history_msg=[]))
+        self.assertEqual(content, 'True')
+        self._generate('CHECK_KNOWLEDGE_SEARCH_SIMILARITY', user_msg='question')
+        # The response of the async call is shared with the sync call
+        self.assertEqual(openai.ChatCompletion.acreate.call_count, 1)
+        self.assertEqual(openai.ChatCompletion.create.call_count, 0)
@@ -0,0 +1,23 @@
+import asyncio
+import unittest
+
+from common.http_client import get_async_http_client
+
+
+class TestAsyncHttpClient(unittest.TestCase):
+    def test_shared_client_in_loop(self):
+        async def get_clients():
+            clients = get_async_http_client(), get_async_http_client()
+            await asyncio.sleep(0.01)
+            return clients
+
+        client_1, client_2 = asyncio.run(get_clients())
+        self.assertIs(client_1, client_2)
+
+        # A new event loop can not reuse the connections created in the previous one
+        client_3, _ = asyncio.run(get_clients())
+        self.assertIsNot(client_1, client_3)
+
+        # The client of the previous loop is closed once it is replaced
+        self.assertTrue(client_1.is_closed)
+        self.assertFalse(client_3.is_closed)
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import random
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import RecommendationService
+
+from RecommendationService.filter import classify_recommendation_item, filter_recommendation_result
+from RecommendationService.merge_engine import MergeSource, merge_recommendation_items
+from RecommendationService.util import RecommendationSource, RecommendType
+
+
+def merge_by_list(knowledge_base_items, calculation_items, aladdin_items, prefer="1"):
+    """
+    The previous implementation of `merge_and_sort_recommendation_items`, which the merge engine must be equivalent to
+    """
+    result = list(knowledge_base_items)
+    exist_commands = [item['command'] for item in knowledge_base_items if 'command' in item]
+    first_items, second_items = (calculation_items, aladdin_items) if prefer == "1" else (aladdin_items, calculation_items)
+    command_index = 0
+    while command_index < len(first_items) and command_index < len(second_items):
+        for item in (first_items[command_index], second_items[command_index]):
+            if item['command'] not in exist_commands:
+                result.append(item)
+                exist_commands.append(item['command'])
+        command_index += 1
+    for items in (calculation_items, aladdin_items):
+        for item in items[command_index:]:
+            if item['command'] not in exist_commands:
+                result.append(item)
+                exist_commands.append(item['command'])
+    return result
+
+
+def build_items(source, num, command_num, seed):
+    """
+    Build the recommendation items of a source, the commands are drawn from `command_num` commands so that some are duplicated
+    """
+    rand = random.Random(seed)
+    commands = rand.sample(range(command_num), min(num, command_num))
+    return [{'command': f'az command{idx}' if idx % 10 else f'az delete{idx}',
+             'type': RecommendType.Scenario if idx % 7 == 0 else RecommendType.Command,
+             'source': source} for idx in commands]
+
+
+class TestMergeEngine(unittest.TestCase):
+    def _build_sources(self, num, seed=0):
+        knowledge_base_items = build_items(RecommendationSource.KnowledgeBase, 3, 200, seed)
+        calculation_items = build_items(RecommendationSource.OfflineCaculation, num, 200, seed + 1)
+        aladdin_items = build_items(RecommendationSource.Aladdin, num // 2, 200, seed + 2)
+        return knowledge_base_items, calculation_items, aladdin_items
+
+    def test_round_robin_equivalent_to_list(self):
+        for num in [0, 5, 50, 100]:
+            knowledge_base_items, calculation_items, aladdin_items = self._build_sources(num, seed=num)
+            for prefer in ["1", "0"]:
+                sources = [MergeSource('OfflineCaculation', calculation_items), MergeSource('Aladdin', aladdin_items)]
+                if prefer != "1":
+                    sources.reverse()
+                self.assertEqual(merge_recommendation_items(knowledge_base_items, sources),
+                                 merge_by_list(knowledge_base_items, calculation_items, aladdin_items, prefer))
+
+    def test_not_modify_leading_items(self):
+        knowledge_base_items, calculation_items, aladdin_items = self._build_sources(10)
+        leading_items = list(knowledge_base_items)
+        merge_recommendation_items(knowledge_base_items, [MergeSource('OfflineCaculation', calculation_items)])
+        self.assertEqual(knowledge_base_items, leading_items)
+
+    def test_weighted_round_robin(self):
+        items_a = [{'command': f'a{idx}'} for idx in range(4)]
+        items_b = [{'command': f'b{idx}'} for idx in range(4)]
+        result = merge_recommendation_items([], [MergeSource('a', items_a, 2), MergeSource('b', items_b, 1)])
+        self.assertEqual([item['command'] for item in result], ['a0', 'a1', 'b0', 'a2', 'a3', 'b1', 'b2', 'b3'])
+
+    def test_score(self):
+        items_a = [{'command': f'a{idx}'} for idx in range(3)]
+        items_b = [{'command': f'b{idx}'} for idx in range(3)]
+        result = merge_recommendation_items([], [MergeSource('a', items_a, 1), MergeSource('b', items_b, 2)], strategy='score')
+        self.assertEqual([item['command'] for item in result], ['b0', 'a0', 'b1', 'b2', 'a1', 'a2'])
+
+    def test_early_stop(self):
+        filter_command = 'az command1'
+        for top_num in [5, 50, 100]:
+            knowledge_base_items, calculation_items, aladdin_items = self._build_sources(top_num * 2, seed=top_num)
+            sources = [MergeSource('OfflineCaculation', calculation_items), MergeSource('Aladdin', aladdin_items)]
+            result = merge_recommendation_items(knowledge_base_items, sources,
+                                                limits={'command': top_num, 'scenario': top_num},
+                                                classify=lambda item: classify_recommendation_item(item, filter_command))
+            full_result = merge_recommendation_items(knowledge_base_items, sources)
+            self.assertLessEqual(len(result), len(full_result))
+            command_list = [{'command': filter_command}]
+            self.assertEqual(filter_recommendation_result(result, command_list, top_num, top_num),
+                             filter_recommendation_result(full_result, command_list, top_num, top_num))
+
+    def test_early_stop_at_command_top_num(self):
+        calculation_items = [{'command': f'az calculation{idx}', 'type': RecommendType.Command} for idx in range(20)]
+        aladdin_items = [{'command': f'az aladdin{idx}', 'type': RecommendType.Command} for idx in range(20)]
+        scenario_items = [{'scenario': 'Create a VM', 'type': RecommendType.Scenario}]
+        command_list = json.dumps([json.dumps({'command': 'az vm create'})])
+        with patch.multiple('RecommendationService',
+                            get_recommend_from_knowledge_base=AsyncMock(return_value=[]),
+                            get_recommend_from_offline_data=AsyncMock(return_value=calculation_items),
+                            get_recommend_from_aladdin=AsyncMock(return_value=aladdin_items),
+                            get_scenario_recommendation_from_search=AsyncMock(return_value=scenario_items),
+                            need_solution_recommendation=lambda *args: False,
+                            filter_recommendation_result=lambda result, *args: result):
+            result, _ = asyncio.run(RecommendationService.get_recommendation_items(
+                command_list, RecommendType.All, None, None, None, None, None, command_top_num=3, scenario_top_num=5))
+        # The scenarios are not in the merged sources, so they don't keep the merge going after the commands are enough
+        self.assertEqual([item['command'] for item in result if 'command' in item],
+                         ['az calculation0', 'az aladdin0', 'az calculation1'])
+        self.assertEqual(result[-1], scenario_items[0])
@@ -0,0 +1,154 @@
+import asyncio
+import copy
+import random
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from RecommendationService.offline_data_service import (_get_offline_query_policy, get_recommend_from_cosmos, get_recommend_from_offline_data,
+                                                        get_usage_condition)
+from RecommendationService.query_policy import OfflineQueryPolicy, OfflineQueryStats, PairHitTracker
+from RecommendationService.util import RecommendationSource, RecommendType
+
+
+def select_by_sort(query_items, commands, totalcount_threshold, ratio_threshold, top_num):
+    """
+    The previous implementation, which sorts all the commands and takes the top n
+    """
+    result = []
+    for item in query_items:
+        if item['totalCount'] < totalcount_threshold:
+            continue
+        for command_info in item['nextCommand']:
+            command_info['ratio'] = float((int(command_info['count'])/int(item['totalCount'])))
+            if command_info['ratio'] * 100 < ratio_threshold:
+                break
+            command_info['type'] = RecommendType.Command
+            if command_info['command'] in commands:
+                continue
+            command_info['usage_condition'] = get_usage_condition(command_info['ratio'])
+            command_info['source'] = RecommendationSource.OfflineCaculation
+            result.append(command_info)
+    return sorted(result, key=lambda x: x['ratio'], reverse=True)[0: top_num]
+
+
+def build_query_items(seed, item_num=3, command_num=200):
+    rand = random.Random(seed)
+    query_items = []
+    for _ in range(item_num):
+        counts = sorted((rand.randint(1, 20) for _ in range(command_num)), reverse=True)
+        next_commands = [{'command': f'vm command{rand.randint(0, 50)}', 'count': count} for count in counts]
+        query_items.append({'totalCount': 100, 'nextCommand': next_commands})
+    return query_items
+
+
+class TestGetRecommendFromCosmos(unittest.TestCase):
+    def test_same_as_sort(self):
+        for seed in range(5):
+            for top_num in [1, 5, 50, 1000]:
+                query_items = build_query_items(seed)
+                with patch('RecommendationService.offline_data_service.query_recommendation_from_offline_data',
+                           new=AsyncMock(return_value=query_items)):
+                    result = asyncio.run(get_recommend_from_cosmos(['vm command1'], RecommendType.Command, None, 10, 2, top_num))
+                expected = select_by_sort(copy.deepcopy(query_items), ['vm command1'], 10, 2, top_num)
+                self.assertEqual(result, expected)
+                # The queried items are not modified
+                self.assertNotIn('ratio', query_items[0]['nextCommand'][0])
+
+    def test_thresholds(self):
+        query_items = [{'totalCount': 5, 'nextCommand': [{'command': 'vm start', 'count': 5}]},
+                       {'totalCount': 100, 'nextCommand': [{'command': 'vm stop', 'count': 50}, {'command': 'vm list', 'count': 1}]}]
+        with patch('RecommendationService.offline_data_service.query_recommendation_from_offline_data_2',
+                   new=AsyncMock(return_value=query_items)):
+            result = asyncio.run(get_recommend_from_cosmos(['vm create', 'vm show'], RecommendType.Command, None, 10, 2, 5))
+        self.assertEqual([item['command'] for item in result], ['vm stop'])
+        self.assertEqual(result[0]['ratio'], 0.5)
+
+
+class TestPairHitTracker(unittest.TestCase):
+    def test_hot(self):
+        tracker = PairHitTracker(hot_rate=0.8, min_samples=5)
+        for _ in range(4):
+            tracker.record(('vm create', 'vm show'), True)
+        self.assertFalse(tracker.is_hot(('vm create', 'vm show')))
+        tracker.record(('vm create', 'vm show'), True)
+        self.assertTrue(tracker.is_hot(('vm create', 'vm show')))
+        self.assertFalse(tracker.is_hot(('vm create', 'vm list')))
+
+        tracker.record(('vm create', 'vm show'), False)
+        tracker.record(('vm create', 'vm show'), False)
+        self.assertFalse(tracker.is_hot(('vm create', 'vm show')))
+
+    def test_window(self):
+        tracker = PairHitTracker(hot_rate=0.8, min_samples=5, window=10)
+        for _ in range(100):
+            tracker.record('pair', False)
+        for _ in range(20):
+            tracker.record('pair', True)
+        # The old misses are decayed, so the pair becomes hot again
+        self.assertTrue(tracker.is_hot('pair'))
+
+
+class TestOfflineQueryPolicy(unittest.TestCase):
+    COMMAND_LIST = [{'command': 'vm create'}, {'command': 'vm show'}]
+
+    def query(self, policy, pair_items, single_items, top_num=2, tracker=None):
+        queried = []
+
+        async def fake_get_recommend_from_cosmos(commands, *args):
+            queried.append(tuple(commands))
+            return list(pair_items if len(commands) == 2 else single_items)
+
+        stats = OfflineQueryStats()
+        with patch('RecommendationService.offline_data_service.get_recommend_from_cosmos', new=fake_get_recommend_from_cosmos), \
+                patch('RecommendationService.offline_data_service.offline_query_policy', new=policy), \
+                patch('RecommendationService.offline_data_service.pair_hit_tracker', new=tracker or PairHitTracker()), \
+                patch('RecommendationService.offline_data_service.offline_query_stats', new=stats), \
+                patch.dict('os.environ', {'Command_TotalCount_Threshold': '10', 'Command_Ratio_Threshold': '2'}):
+            result = asyncio.run(get_recommend_from_offline_data(self.COMMAND_LIST, RecommendType.Command, top_num))
+        return result, queried, stats.stats()
+
+    def test_race(self):
+        result, queried, stats = self.query(OfflineQueryPolicy.Race, ['a', 'b'], ['c'])
+        self.assertEqual(result, ['a', 'b'])
+        self.assertEqual(len(queried), 2)
+        self.assertEqual(stats['wastedQueries'], 1)
+
+        result, queried, stats = self.query(OfflineQueryPolicy.Race, ['a'], ['c'])
+        self.assertEqual(result, ['a', 'c'])
+
+    def test_sequential(self):
+        result, queried, stats = self.query(OfflineQueryPolicy.Sequential, ['a', 'b'], ['c'])
+        self.assertEqual(result, ['a', 'b'])
+        self.assertEqual(queried, [('vm create', 'vm show')])
+        self.assertEqual(stats['savedQueries'], 1)
+
+        result, queried, stats = self.query(OfflineQueryPolicy.Sequential, ['a'], ['c'])
+        self.assertEqual(result, ['a', 'c'])
+        self.assertEqual(queried, [('vm create', 'vm show'), ('vm show',)])
+        self.assertEqual(stats['fallbackQueries'], 1)
+
+    def test_auto(self):
+        tracker = PairHitTracker(min_samples=2)
+        for expected_queries in [2, 2, 1]:
+            result, queried, _ = self.query(OfflineQueryPolicy.Auto, ['a', 'b'], ['c'], tracker=tracker)
+            self.assertEqual(result, ['a', 'b'])
+            self.assertEqual(len(queried), expected_queries)
+
+    def test_invalid_policy(self):
+        with patch.dict('os.environ', {'Offline_Query_Policy': 'sequencial'}):
+            self.assertEqual(_get_offline_query_policy(), OfflineQueryPolicy.Auto)
+        with patch.dict('os.environ', {'Offline_Query_Policy': 'race'}):
+            self.assertEqual(_get_offline_query_policy(), OfflineQueryPolicy.Race)
+
+
+class TestOfflineQueryStats(unittest.TestCase):
+    def test_report(self):
+        stats = OfflineQueryStats(report_interval=0)
+        with self.assertLogs(level='INFO') as logs:
+            stats.record(saved=True)
+        self.assertIn('"savedQueries": 1', logs.output[0])
+
+        stats = OfflineQueryStats(report_interval=3600)
+        with self.assertNoLogs(level='INFO'):
+            stats.record(saved=True)
+        self.assertEqual(stats.stats()['savedQueries'], 1)
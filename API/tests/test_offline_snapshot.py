@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from RecommendationService import cosmos_helper
+from RecommendationService.offline_snapshot import (SNAPSHOT_TABLE, SNAPSHOT_TABLE_2, OfflineSnapshotStore, export_offline_snapshot,
+                                                    prune_offline_snapshots, read_current_version)
+from RecommendationService.util import RecommendType
+
+ITEMS = [
+    {'id': '1', 'command': 'vm create', 'type': 1, 'totalCount': 100, '_ts': 1,
+     'nextCommand': [{'command': 'vm show', 'count': 50, 'arguments': ['--name']}, {'command': 'vm list', 'count': 10}]},
+    {'id': '2', 'command': 'vm create', 'type': 2, 'totalCount': 20, 'errorInformation': 'The VM size is not available',
+     'nextCommand': [{'command': 'vm list-sizes', 'count': 15}]},
+    {'id': '3', 'command': 'group create', 'type': 1, 'totalCount': 30, 'nextCommand': []},
+]
+ITEMS_2 = [
+    {'id': '4', 'command': 'group create|vm create', 'type': 1, 'totalCount': 40, 'nextCommand': [{'command': 'vm show', 'count': 30}]},
+]
+
+
+class TestOfflineSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.local_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.root.cleanup()
+        self.local_dir.cleanup()
+
+    def build_store(self):
+        return OfflineSnapshotStore(self.root.name, local_dir=self.local_dir.name)
+
+    def test_round_trip(self):
+        version = export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS, SNAPSHOT_TABLE_2: ITEMS_2}, version='v1')
+        self.assertEqual(version, 'v1')
+        self.assertEqual(read_current_version(self.root.name), 'v1')
+
+        store = self.build_store()
+        store.reload()
+        snapshot = store.get()
+        items = snapshot.get_items(SNAPSHOT_TABLE, 'vm create')
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['type'], 1)
+        self.assertEqual(items[0]['totalCount'], 100)
+        self.assertEqual(list(items[0]['nextCommand']), ITEMS[0]['nextCommand'])
+        self.assertEqual(items[0]['nextCommand'][-1], {'command': 'vm list', 'count': 10})
+        self.assertEqual(items[1]['errorInformation'], 'The VM size is not available')
+        self.assertNotIn('_ts', items[0])
+        self.assertEqual(list(snapshot.get_items(SNAPSHOT_TABLE, 'group create')[0]['nextCommand']), [])
+        self.assertEqual(snapshot.get_items(SNAPSHOT_TABLE, 'vm delete'), [])
+        self.assertEqual(list(snapshot.get_items(SNAPSHOT_TABLE_2, 'group create|vm create')[0]['nextCommand']),
+                         ITEMS_2[0]['nextCommand'])
+
+    def test_reload(self):
+        export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS}, version='v1')
+        store = self.build_store()
+        store.reload()
+        self.assertEqual(store.get().version, 'v1')
+
+        export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS[:1]}, version='v2')
+        store.reload()
+        snapshot = store.get()
+        self.assertEqual(snapshot.version, 'v2')
+        self.assertEqual(snapshot.get_items(SNAPSHOT_TABLE, 'group create'), [])
+        # The version is served from the local copy, and the previous local copy is removed
+        self.assertEqual(os.listdir(self.local_dir.name), ['v2'])
+
+        # A broken version is not loaded, and the previous version is still served
+        os.makedirs(os.path.join(self.root.name, 'v3'))
+        with open(os.path.join(self.root.name, 'CURRENT'), 'w') as f:
+            f.write('v3')
+        store.reload()
+        self.assertEqual(store.get().version, 'v2')
+
+    def test_load_in_background(self):
+        export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS}, version='v1')
+        store = self.build_store()
+        loaded = threading.Event()
+        reload = store.reload
+
+        def wait_and_reload():
+            loaded.wait(5)
+            reload()
+        store.reload = wait_and_reload
+
+        # The request doesn't wait for the loading, and it falls back to Cosmos DB until the snapshot is loaded
+        self.assertIsNone(store.get())
+        loaded.set()
+        store._loader.join(5)
+        self.assertEqual(store.get().version, 'v1')
+
+    def test_no_snapshot(self):
+        store = self.build_store()
+        store.reload()
+        self.assertIsNone(store.get())
+
+    def test_prune(self):
+        for version in ['v1', 'v2', 'v3']:
+            export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS}, version=version)
+        os.makedirs(os.path.join(self.root.name, '.v4.tmp'))
+        self.assertEqual(prune_offline_snapshots(self.root.name, keep=1), ['v1', 'v2'])
+        self.assertEqual(sorted(os.listdir(self.root.name)), ['CURRENT', 'v3'])
+
+    def test_failed_export(self):
+        with self.assertRaises(KeyError):
+            export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: [{'type': 1}]}, version='v1')
+        self.assertEqual(os.listdir(self.root.name), [])
+
+    def test_query_from_snapshot(self):
+        export_offline_snapshot(self.root.name, {SNAPSHOT_TABLE: ITEMS, SNAPSHOT_TABLE_2: ITEMS_2})
+        store = self.build_store()
+        store.reload()
+        with patch.object(cosmos_helper, 'offline_snapshot_store', store):
+            items = asyncio.run(cosmos_helper.query_recommendation_from_offline_data('vm create', RecommendType.Command, None))
+            self.assertEqual([item['type'] for item in items], [1])
+            items = asyncio.run(cosmos_helper.query_recommendation_from_offline_data('vm create', RecommendType.Solution, 'The VM size is not available.'))
+            self.assertEqual([item['type'] for item in items], [2])
+            items = asyncio.run(cosmos_helper.query_recommendation_from_offline_data_2('group create', 'vm create', RecommendType.Command, None))
+            self.assertEqual(items[0]['totalCount'], 40)
@@ -0,0 +1,155 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+from openai.error import InvalidRequestError, RateLimitError
+
+from common.resilience import (Deployment, DeploymentRouter, LatencyTracker, RateLimiter, RetryPolicy, TokenBucket,
+                               call_openai, call_openai_async)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve(self):
+        bucket = TokenBucket(rate_per_minute=600)
+        self.assertEqual(bucket.reserve(600), 0)
+        # The bucket is empty, 60 tokens are refilled in 6 seconds
+        self.assertAlmostEqual(bucket.reserve(60), 6, places=1)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(tokens_per_minute=0, requests_per_minute=60)
+        self.assertEqual(limiter.reserve(10000), 0)
+        self.assertEqual(RateLimiter().reserve(10000), 0)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_get_delay(self):
+        policy = RetryPolicy(max_retries=2, base_delay=1, max_delay=30)
+        self.assertLessEqual(policy.get_delay(1, RateLimitError('429')), 2)
+        self.assertIsNone(policy.get_delay(2, RateLimitError('429')))
+        self.assertIsNone(policy.get_delay(0, InvalidRequestError('invalid', None)))
+
+    def test_retry_after(self):
+        policy = RetryPolicy(max_retries=2, base_delay=1, max_delay=30)
+        delay = policy.get_delay(0, RateLimitError('429', headers={'retry-after': '10'}))
+        self.assertTrue(10 <= delay <= 11)
+        self.assertIsNone(policy.get_delay(0, RateLimitError('429', headers={'retry-after': '60'})))
+        # Another healthy deployment doesn't need to wait for the `Retry-After`
+        self.assertLessEqual(policy.get_delay(0, RateLimitError('429', headers={'retry-after': '60'}), failover=True), policy.failover_jitter)
+
+
+class TestDeploymentRouter(unittest.TestCase):
+    def setUp(self):
+        self.eastus = Deployment('eastus', 'https://eastus.openai.azure.com/', 'key1', weight=1)
+        self.westus = Deployment('westus', 'https://westus.openai.azure.com/', 'key2', weight=2)
+        self.router = DeploymentRouter([self.eastus, self.westus], eject_seconds=30)
+
+    def test_select_least_loaded(self):
+        self.assertIs(self.router.select(), self.westus)
+        self.router.start(self.westus)
+        self.router.start(self.westus)
+        self.assertIs(self.router.select(), self.eastus)
+        self.router.end(self.westus, 1)
+        self.router.end(self.westus, 1)
+        # The latency of eastus is unknown, and it is regarded as the best known latency
+        self.router.start(self.eastus)
+        self.router.end(self.eastus, 10)
+        self.assertIs(self.router.select(), self.westus)
+
+    def test_eject_unhealthy_deployment(self):
+        self.router.start(self.westus)
+        self.router.end(self.westus, 1, RateLimitError('429', headers={'retry-after': '60'}))
+        self.assertIs(self.router.select(), self.eastus)
+        self.assertGreater(self.westus.ejected_until - self.eastus.ejected_until, 59)
+        self.router.start(self.eastus)
+        self.router.end(self.eastus, 1, InvalidRequestError('invalid', None))
+        self.assertIs(self.router.select(), self.eastus)
+        # All the deployments are excluded or ejected
+        self.assertIs(self.router.select(exclude={self.eastus}), self.westus)
+
+    def test_build_params(self):
+        params = Deployment('eastus', 'https://eastus.openai.azure.com/', 'key1', gpt_engine='GPT_4').build_params({'engine': 'GPT_4_32k'})
+        self.assertEqual((params['api_base'], params['api_key'], params['engine']), ('https://eastus.openai.azure.com/', 'key1', 'GPT_4'))
+
+
+class TestCallOpenAI(unittest.TestCase):
+    PARAMS = {'engine': 'gpt-4', 'messages': []}
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=0.01))
+    def test_retry(self):
+        create = MagicMock(side_effect=[RateLimitError('429'), 'response'])
+        response, attempts = call_openai(create, self.PARAMS, estimated_tokens=100)
+        self.assertEqual(response, 'response')
+        self.assertEqual([attempt['result'] for attempt in attempts], ['RateLimitError', 'success'])
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=0.01))
+    def test_retry_on_another_deployment(self):
+        router = DeploymentRouter([Deployment('eastus', 'https://eastus', 'key1'), Deployment('westus', 'https://westus', 'key2')])
+        create = MagicMock(side_effect=[RateLimitError('429'), 'response'])
+        with patch('common.resilience.deployment_router', router):
+            response, attempts = call_openai(create, self.PARAMS, estimated_tokens=100)
+        self.assertEqual(response, 'response')
+        self.assertEqual([attempt['deployment'] for attempt in attempts], ['eastus', 'westus'])
+        self.assertEqual([call.kwargs['api_base'] for call in create.call_args_list], ['https://eastus', 'https://westus'])
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=1, max_delay=30))
+    def test_failover_without_retry_after(self):
+        router = DeploymentRouter([Deployment('eastus', 'https://eastus', 'key1'), Deployment('westus', 'https://westus', 'key2')])
+        create = MagicMock(side_effect=[RateLimitError('429', headers={'retry-after': '60'}), 'response'])
+        with patch('common.resilience.deployment_router', router), patch('common.resilience.time.sleep') as sleep:
+            response, attempts = call_openai(create, self.PARAMS, estimated_tokens=100)
+        self.assertEqual(response, 'response')
+        self.assertEqual([attempt['deployment'] for attempt in attempts], ['eastus', 'westus'])
+        sleep.assert_called_once()
+        self.assertLessEqual(sleep.call_args.args[0], 0.1)
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=1, max_delay=30))
+    def test_failover_without_retry_after_async(self):
+        router = DeploymentRouter([Deployment('eastus', 'https://eastus', 'key1'), Deployment('westus', 'https://westus', 'key2')])
+
+        async def acreate(api_base, **kwargs):
+            if api_base == 'https://eastus':
+                raise RateLimitError('429', headers={'retry-after': '5'})
+            return api_base
+
+        async def call():
+            started = asyncio.get_running_loop().time()
+            response, attempts = await call_openai_async(acreate, self.PARAMS, estimated_tokens=100, hedge=False)
+            return response, attempts, asyncio.get_running_loop().time() - started
+
+        with patch('common.resilience.deployment_router', router):
+            response, attempts, elapsed = asyncio.run(call())
+        self.assertEqual(response, 'https://westus')
+        self.assertEqual([attempt['deployment'] for attempt in attempts], ['eastus', 'westus'])
+        self.assertLess(elapsed, 1)
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=0.01, max_delay=30))
+    def test_give_up_without_healthy_deployment(self):
+        router = DeploymentRouter([Deployment('eastus', 'https://eastus', 'key1'), Deployment('westus', 'https://westus', 'key2')])
+        create = MagicMock(side_effect=[RateLimitError('429', headers={'retry-after': '60'}), RateLimitError('429', headers={'retry-after': '60'})])
+        with patch('common.resilience.deployment_router', router), patch('common.resilience.time.sleep'):
+            with self.assertRaises(RateLimitError):
+                call_openai(create, self.PARAMS, estimated_tokens=100)
+        # The `Retry-After` of the last deployment exceeds `max_delay`
+        self.assertEqual(create.call_count, 2)
+
+    @patch('common.resilience.retry_policy', RetryPolicy(max_retries=2, base_delay=0.01))
+    def test_not_retry(self):
+        create = MagicMock(side_effect=InvalidRequestError('invalid', None))
+        with self.assertRaises(InvalidRequestError):
+            call_openai(create, self.PARAMS, estimated_tokens=100)
+        create.assert_called_once()
+
+    @patch.dict('os.environ', {'OPENAI_HEDGE_ENGINE': 'gpt-4-backup'})
+    def test_hedge(self):
+        latency_tracker = LatencyTracker(min_samples=1)
+        latency_tracker.record(0.01)
+
+        async def acreate(engine, **kwargs):
+            await asyncio.sleep(1 if engine == 'gpt-4' else 0)
+            return engine
+
+        with patch('common.resilience.latency_tracker', latency_tracker):
+            response, attempts = asyncio.run(call_openai_async(acreate, self.PARAMS, estimated_tokens=100))
+        self.assertEqual(response, 'gpt-4-backup')
+        self.assertEqual({attempt['engine']: attempt['result'] for attempt in attempts},
+                         {'gpt-4': 'cancelled', 'gpt-4-backup': 'success'})
@@ -1,9 +1,45 @@
+import copy
 import unittest
+from unittest.mock import AsyncMock, patch
 
-from common.service_impl.learn_knowledge_index import retrieve_chunks_for_atomic_task
+from common.cache import LRUCache
+from common.service_impl.learn_knowledge_index import chunk_cache, retrieve_chunk_for_command, retrieve_chunks_for_atomic_task
 
 
 class TestRetrieveChunk(unittest.IsolatedAsyncioTestCase):
     async def test_retrieve_chunk(self):
         chunk = await retrieve_chunks_for_atomic_task('Install Service Mesh on the Cluster')
         self.assertIsNotNone(chunk)
+
+
+class TestRetrieveChunkCache(unittest.IsolatedAsyncioTestCase):
+    CHUNK = {
+        "command": "az vm create",
+        "summary": "Create an Azure Virtual Machine.",
+        "required parameters": [{"name": "--name -n", "desc": "Name of the virtual machine."}],
+        "score": 0.82,
+    }
+
+    async def test_retrieve_chunk_for_command_from_cache(self):
+        chunk_cache.clear()
+        with patch('common.service_impl.learn_knowledge_index.embedding_text_to_vector',
+                   new=AsyncMock(return_value=[0.1, 0.2])) as mock_embedding, \
+                patch('common.service_impl.learn_knowledge_index._retrieve_chunks_from_learn_knowledge_index_service',
+                      new=AsyncMock(side_effect=lambda *args, **kwargs: [copy.deepcopy(self.CHUNK)])):
+            chunk = await retrieve_chunk_for_command('az vm create --name MyVm')
+            chunk['required parameters'].pop()
+            cached_chunk = await retrieve_chunk_for_command('az vm create --image Ubuntu2204')
+        # The score is the similarity to the first command, so it is not shared with the other commands
+        self.assertNotIn('score', chunk)
+        self.assertEqual(cached_chunk, {key: value for key, value in self.CHUNK.items() if key != 'score'})
+        mock_embedding.assert_awaited_once()
+
+    async def test_expire_by_ttl(self):
+        with patch('common.service_impl.learn_knowledge_index.embedding_text_to_vector',
+                   new=AsyncMock(return_value=[0.1, 0.2])) as mock_embedding, \
+                patch('common.service_impl.learn_knowledge_index._retrieve_chunks_from_learn_knowledge_index_service',
+                      new=AsyncMock(side_effect=lambda *args, **kwargs: [copy.deepcopy(self.CHUNK)])), \
+                patch('common.service_impl.learn_knowledge_index.chunk_cache', new=LRUCache(ttl=0)):
+            await retrieve_chunk_for_command('az vm create --name MyVm')
+            await retrieve_chunk_for_command('az vm create --name MyVm')
+        self.assertEqual(mock_embedding.await_count, 2)
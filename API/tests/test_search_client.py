@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import common.http_client
+from common.search_client import get_async_search_client, get_search_client
+
+
+def patch_async_search_client():
+    # The clients and their sessions are mocked, so the closes can be checked without connections
+    return patch.multiple('common.search_client', AsyncSearchClient=MagicMock(side_effect=lambda **kwargs: MagicMock(close=AsyncMock())),
+                          aiohttp=MagicMock(), AioHttpTransport=MagicMock())
+
+
+class TestSearchClientRegistry(unittest.TestCase):
+    def test_shared_search_client(self):
+        client = get_search_client('https://search.example.com', 'scenario', 'key')
+        self.assertIs(client, get_search_client('https://search.example.com', 'scenario', 'key'))
+        self.assertIsNot(client, get_search_client('https://search.example.com', 'command', 'key'))
+
+    def test_rotated_key(self):
+        client = get_search_client('https://search.example.com', 'rotated', 'key')
+        rotated_client = get_search_client('https://search.example.com', 'rotated', 'key-2')
+        self.assertIsNot(client, rotated_client)
+        self.assertIs(rotated_client, get_search_client('https://search.example.com', 'rotated', 'key-2'))
+
+
+class TestAsyncSearchClientRegistry(unittest.IsolatedAsyncioTestCase):
+    async def test_shared_async_search_client(self):
+        client = get_async_search_client('https://search.example.com', 'scenario', 'key')
+        self.assertIs(client, get_async_search_client('https://search.example.com', 'scenario', 'key'))
+        await client.close()
+
+    async def test_rotated_key(self):
+        with patch_async_search_client(), patch.object(common.http_client, 'ASYNC_CLIENT_CLOSE_DELAY', 0.05):
+            client = get_async_search_client('https://search.example.com', 'async-rotated', 'key')
+            rotated_client = get_async_search_client('https://search.example.com', 'async-rotated', 'key-2')
+            self.assertIsNot(client, rotated_client)
+            # The replaced client may be still used by the in-flight requests until the delay passes
+            await asyncio.sleep(0.01)
+            client.close.assert_not_awaited()
+            await asyncio.sleep(0.1)
+            client.close.assert_awaited_once()
+            rotated_client.close.assert_not_awaited()
+
+
+class TestAsyncSearchClientLoop(unittest.TestCase):
+    def test_close_with_loop(self):
+        async def get_client():
+            client = get_async_search_client('https://search.example.com', 'loop', 'key')
+            await asyncio.sleep(0.01)
+            return client
+
+        with patch_async_search_client():
+            client = asyncio.run(get_client())
+            client.close.assert_not_awaited()
+            # A new client is created for the new loop, and the client of the closed loop is closed without waiting
+            new_client = asyncio.run(get_client())
+            self.assertIsNot(client, new_client)
+            client.close.assert_awaited_once()
+            new_client.close.assert_not_awaited()
@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from common.semantic_cache import SemanticCache, get_prompt_version
+
+
+class TestSemanticCache(unittest.TestCase):
+    NAMESPACE = ('GPTGeneration', 5, 'v1')
+
+    def test_hit_similar_question(self):
+        cache = SemanticCache(threshold=0.95, max_size=4)
+        cache.set(self.NAMESPACE, [1.0, 0.0, 0.1], {'scenario': 'create a storage account'})
+        self.assertEqual(cache.get(self.NAMESPACE, [2.0, 0.0, 0.21]), {'scenario': 'create a storage account'})
+        self.assertIsNone(cache.get(self.NAMESPACE, [0.0, 1.0, 0.0]))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_namespace_isolation(self):
+        cache = SemanticCache(threshold=0.95, max_size=4)
+        cache.set(self.NAMESPACE, [1.0, 0.0], 'v1 result')
+        self.assertIsNone(cache.get(('GPTGeneration', 5, 'v2'), [1.0, 0.0]))
+
+    def test_returns_copy(self):
+        cache = SemanticCache(threshold=0.95, max_size=4)
+        cache.set(self.NAMESPACE, [1.0, 0.0], [{'commandSet': []}])
+        cache.get(self.NAMESPACE, [1.0, 0.0])[0]['commandSet'].append('az vm create')
+        self.assertEqual(cache.get(self.NAMESPACE, [1.0, 0.0]), [{'commandSet': []}])
+
+    def test_replace_similar_question(self):
+        cache = SemanticCache(threshold=0.95, max_size=4)
+        cache.set(self.NAMESPACE, [1.0, 0.0], 'old')
+        cache.set(self.NAMESPACE, [1.0, 0.01], 'new')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(self.NAMESPACE, [1.0, 0.0]), 'new')
+
+    def test_lru_eviction(self):
+        cache = SemanticCache(threshold=0.99, max_size=2)
+        cache.set(self.NAMESPACE, [1.0, 0.0, 0.0], 'a')
+        cache.set(self.NAMESPACE, [0.0, 1.0, 0.0], 'b')
+        cache.get(self.NAMESPACE, [1.0, 0.0, 0.0])
+        cache.set(self.NAMESPACE, [0.0, 0.0, 1.0], 'c')
+        self.assertEqual(cache.get(self.NAMESPACE, [1.0, 0.0, 0.0]), 'a')
+        self.assertIsNone(cache.get(self.NAMESPACE, [0.0, 1.0, 0.0]))
+        self.assertEqual(cache.get(self.NAMESPACE, [0.0, 0.0, 1.0]), 'c')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        cache = SemanticCache(threshold=0.95, max_size=4, ttl=0.01)
+        cache.set(self.NAMESPACE, [1.0, 0.0], 'a')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(self.NAMESPACE, [1.0, 0.0]))
+        self.assertEqual(len(cache), 0)
+
+    def test_prompt_version(self):
+        self.assertEqual(get_prompt_version('system msg'), get_prompt_version('system msg'))
+        self.assertNotEqual(get_prompt_version('system msg'), get_prompt_version('new system msg'))
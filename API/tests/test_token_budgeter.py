@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from common.service_impl.chatgpt import TokenBudgeter, _count_tokens, num_tokens_from_message
+
+
+class TestTokenBudgeter(unittest.TestCase):
+    def setUp(self):
+        # Count the words instead of the tokens, so that the encoding does not need to be downloaded
+        self.encoding = MagicMock()
+        self.encoding.encode.side_effect = lambda text: text.split()
+        self.patcher = patch('common.service_impl.chatgpt._get_encoding', return_value=self.encoding)
+        self.patcher.start()
+        _count_tokens.cache_clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+        _count_tokens.cache_clear()
+
+    def test_try_append(self):
+        budgeter = TokenBudgeter('How to create a VM', token_limit=11)
+        self.assertTrue(budgeter.try_append('\naz group create'))
+        self.assertFalse(budgeter.try_append('\naz vm create --name --resource-group'))
+        self.assertTrue(budgeter.try_append('\naz vm start'))
+        self.assertEqual(budgeter.message, 'How to create a VM\naz group create\naz vm start')
+        self.assertEqual(budgeter.num_tokens, 11)
+
+    def test_count_each_part_once(self):
+        budgeter = TokenBudgeter('How to create a VM', token_limit=100)
+        for step in ['\nstep 1', '\nstep 2', '\nstep 3']:
+            budgeter.try_append(step)
+        self.assertEqual(self.encoding.encode.call_count, 4)
+        self.assertEqual(num_tokens_from_message('How to create a VM'), 5)
+        self.assertEqual(self.encoding.encode.call_count, 4)